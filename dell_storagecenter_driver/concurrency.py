@@ -0,0 +1,207 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Thread helpers for running independent driver work concurrently."""
+
+import logging
+import sys
+import threading
+
+import six
+
+
+DEFAULT_MAX_WORKERS = 8
+LOG = logging.getLogger(__name__)
+
+
+def parallel_map(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """Calls func for each item using a bounded number of threads.
+
+    :param func: Callable taking a single item.
+    :param items: Iterable of items to process.
+    :param max_workers: Maximum number of concurrent calls.
+    :returns: A list of results in the same order as ``items``.
+    :raises: The first exception raised by any call to ``func``.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = []
+    lock = threading.Lock()
+    pending = iter(range(len(items)))
+
+    def worker():
+        while True:
+            with lock:
+                if errors:
+                    return
+                index = next(pending, None)
+            if index is None:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception:
+                with lock:
+                    errors.append(sys.exc_info())
+
+    threads = []
+    for _ in range(min(max_workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        six.reraise(*errors[0])
+    return results
+
+
+def parallel_results(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """Calls func for each item, collecting each call's result or error.
+
+    Unlike ``parallel_map`` a failing call does not stop the others.
+
+    :param func: Callable taking a single item.
+    :param items: Iterable of items to process.
+    :param max_workers: Maximum number of concurrent calls.
+    :returns: A list of (result, exception) tuples in the same order as
+              ``items``.  The exception is None if the call succeeded.
+    """
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            LOG.debug('Error processing %s', item, exc_info=True)
+            return None, e
+    return parallel_map(call, items, max_workers)
+
+
+class Task(object):
+    """A call running on its own daemon thread.
+
+    Used to start work early and pick up its result once it is needed.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        """Starts calling func with the given arguments.
+
+        :param func: The callable to run.
+        """
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        thread = threading.Thread(target=self._run,
+                                  args=(func, args, kwargs))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._result = func(*args, **kwargs)
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Waits for the call to finish.
+
+        :param timeout: The maximum number of seconds to wait, or None to
+                        wait until it finishes.
+        :returns: True if the call has finished.
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def result(self):
+        """Waits for the call to finish and returns its result.
+
+        :raises: The exception raised by the call, if any.
+        """
+        self._done.wait()
+        if self._error:
+            six.reraise(*self._error)
+        return self._result
+
+
+class SingleFlight(object):
+    """Shares one call's result among concurrent callers with the same key.
+
+    While a call for a key is running, other callers for that key wait for
+    it and get its result, or its exception, instead of repeating it.
+    """
+
+    def __init__(self, name, registry=None):
+        """Create a new single-flight group.
+
+        :param name: The name the counters are recorded under.
+        :param registry: Optional ``metrics.MetricsRegistry`` to count
+                         calls in.
+        """
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._registry = registry
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Calls func, unless a call for the key is already running.
+
+        :param key: Hashable key identifying identical calls.
+        :param func: The callable to run.
+        :returns: The result of the call for the key.
+        :raises: The exception raised by the call for the key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = [threading.Event(), None, None]
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if self._registry is not None:
+            self._registry.increment(
+                'singleflight_calls_total',
+                {'operation': self.name,
+                 'result': 'called' if leader else 'coalesced'})
+
+        done, _, _ = flight
+        if leader:
+            try:
+                flight[1] = func(*args, **kwargs)
+            except Exception:
+                flight[2] = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                done.set()
+        else:
+            done.wait()
+        if flight[2]:
+            six.reraise(*flight[2])
+        return flight[1]
+
+    def stats(self):
+        """Gets the call counters.
+
+        :returns: A dict with the number of calls made and the number of
+                  calls that shared another call's result.
+        """
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced}
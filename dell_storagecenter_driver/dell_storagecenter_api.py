@@ -13,18 +13,298 @@
 #    under the License.
 '''Interface for interacting with the Dell Storage Center array.'''
 
+import collections
+import functools
 import json
 import logging
 import os.path
+import string
+import sys
+import threading
+import time
+
 import requests
 import six
 
+import concurrency
+import em_aggregator
+import metrics
+
 
 DEFAULT_VOLUME_FOLDER = 'Flocker'
 DEFAULT_SERVER_FOLDER = 'Flocker'
+DEFAULT_SESSION_POOL_SIZE = 4
+DEFAULT_KEEPALIVE_INTERVAL = 300
+DEFAULT_METADATA_CACHE_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_MIN_CONCURRENCY = 2
+DEFAULT_LATENCY_TOLERANCE = 2.0
+MIN_BASELINE_LATENCY = 0.01
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ('critical', 'normal', 'background')
+JSON_CHUNK_SIZE = 64 * 1024
+MAPPING_PROFILE_BATCH = 100
+MAX_LOGGED_RESPONSE = 1024
 LOG = logging.getLogger(__name__)
 
 
+def _cached(name):
+    """Caches the result of a StorageCenterApi method in its TtlCache.
+
+    The cache key is the name, the connection's SSN and the call arguments.
+
+    :param name: The cache key name for this method.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            return self.cache.get((name, self.ssn) + args,
+                                  lambda: func(self, *args))
+        return wrapper
+    return decorator
+
+
+def _memoized(name):
+    """Answers repeated identical reads within one driver operation.
+
+    Results are kept in the connection's ``memo`` dict, which is cleared
+    when the connection is returned to the pool.  Arguments that are
+    Storage Center objects are keyed by their instanceId.  A connection is
+    meant to be used by one thread at a time, but a read racing a
+    ``_forget`` only costs a repeated request rather than an error.
+
+    :param name: The memo key name for this method.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            key = (name,) + tuple(self._memo_key(arg) for arg in args)
+            try:
+                return self.memo[key]
+            except KeyError:
+                pass
+            result = func(self, *args)
+            self.memo[key] = result
+            return result
+        return wrapper
+    return decorator
+
+
+class TtlCache(object):
+    """Time limited cache for rarely changing Storage Center objects.
+
+    Folders, storage profiles, server OS types and iSCSI ports almost never
+    change, so there is no need to look them up for every driver call.
+    Empty results are not cached so a missing object is looked up again.
+    """
+
+    def __init__(self, ttl=DEFAULT_METADATA_CACHE_TTL):
+        """Create a new cache.
+
+        :param ttl: Seconds an entry is valid for.  0 disables caching.
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Gets a cached value, loading it if missing or expired.
+
+        :param key: Tuple identifying the value.
+        :param loader: Callable returning the value on a miss.
+        :returns: The cached or newly loaded value.
+        """
+        if self.ttl <= 0:
+            return loader()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        value = loader()
+        if value is not None and value != []:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, name=None):
+        """Drops cached entries.
+
+        :param name: The cache key name to drop.  If None everything is
+                     dropped.
+        """
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                for key in list(self._entries):
+                    if key[0] == name:
+                        del self._entries[key]
+
+
+class VolumeRecord(collections.namedtuple(
+        'VolumeRecord',
+        ['name', 'instance_id', 'device_id', 'size', 'folder'])):
+    """Compact, immutable record of a Storage Center volume.
+
+    EM volume objects carry dozens of fields.  Only the ones the driver
+    uses are kept, with the configured size already converted to bytes.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, blob):
+        """Creates a record from an EM ScVolume object.
+
+        :param blob: The ScVolume dict from a REST response.
+        :returns: A ``VolumeRecord``.
+        """
+        return cls(name=blob.get('name'),
+                   instance_id=blob.get('instanceId'),
+                   device_id=blob.get('deviceId'),
+                   size=int(float(blob.get('configuredSize', '0 Bytes')
+                                  .replace(' Bytes', ''))),
+                   folder=blob.get('volumeFolderPath'))
+
+
+class VolumeIndex(object):
+    """In-process index of our volumes keyed by volume name.
+
+    Lets ``find_volume`` turn a dataset ID into the volume's instanceId and
+    deviceId without a REST call.  The index is rebuilt from every
+    ``list_volumes`` and updated by the driver's own creates, deletes and
+    expands.  Names known to be missing are remembered for a short time.
+    Callers that see a write fail should ``discard`` the name and look the
+    volume up on the array again.
+
+    Every update bumps a generation.  A listing records the generation it
+    started at, and names updated after that keep their newer state when
+    the listing is applied.
+    """
+
+    def __init__(self, enabled=True, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """Create a new index.
+
+        :param enabled: If False lookups always miss.
+        :param negative_ttl: Seconds to remember a name as missing.
+        """
+        self.enabled = enabled
+        self.negative_ttl = negative_ttl
+        self._volumes = {}
+        self._missing = {}
+        self._generation = 0
+        # Generation each name was last updated at, since the last listing.
+        self._updated = {}
+        self._listed = 0
+        self._lock = threading.Lock()
+
+    def _update(self, name):
+        """Records an update of a name.  Must hold the lock."""
+        self._generation += 1
+        self._updated[name] = self._generation
+
+    def lookup(self, name):
+        """Looks up a volume by name.
+
+        :param name: The volume name.
+        :returns: A (found, ``VolumeRecord``) tuple.  If found is True the
+                  record is the answer, which is None for a volume known to
+                  be missing.
+        """
+        if not self.enabled:
+            return False, None
+        with self._lock:
+            if name in self._volumes:
+                return True, self._volumes[name]
+            expires = self._missing.get(name)
+            if expires is not None:
+                if expires > time.time():
+                    return True, None
+                del self._missing[name]
+        return False, None
+
+    def add(self, scvolume):
+        """Adds or updates a volume.
+
+        :param scvolume: The ``VolumeRecord`` to add.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._update(scvolume.name)
+            self._missing.pop(scvolume.name, None)
+            self._volumes[scvolume.name] = scvolume
+
+    def mark_missing(self, name):
+        """Records that a volume does not exist.
+
+        :param name: The volume name.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._update(name)
+            self._volumes.pop(name, None)
+            if self.negative_ttl > 0:
+                self._missing[name] = time.time() + self.negative_ttl
+
+    def discard(self, name):
+        """Forgets anything known about a volume.
+
+        :param name: The volume name.
+        """
+        with self._lock:
+            self._update(name)
+            self._volumes.pop(name, None)
+            self._missing.pop(name, None)
+
+    def start_listing(self):
+        """Gets the generation to pass to ``replace_all``.
+
+        Call this before requesting the listing.
+
+        :returns: The current generation.
+        """
+        with self._lock:
+            return self._generation
+
+    def replace_all(self, scvolumes, generation=None):
+        """Replaces the indexed volumes with a full listing.
+
+        Names updated after the listing started are left as they are.  A
+        listing that started before the last one applied is ignored.
+
+        :param scvolumes: ``VolumeRecord`` list of every volume in the
+                          volume folder.
+        :param generation: The ``start_listing`` generation of the listing.
+                           If None the listing is taken as current.
+        """
+        if not self.enabled:
+            return
+        volumes = dict((vol.name, vol) for vol in scvolumes)
+        with self._lock:
+            if generation is None:
+                generation = self._generation
+            if generation < self._listed:
+                return
+            for name, updated in self._updated.items():
+                if updated <= generation:
+                    continue
+                volumes.pop(name, None)
+                if name in self._volumes:
+                    volumes[name] = self._volumes[name]
+            self._volumes = volumes
+            for name in volumes:
+                self._missing.pop(name, None)
+            self._listed = generation
+            self._updated = dict(
+                (name, updated) for name, updated in self._updated.items()
+                if updated > generation)
+
+
 class PayloadFilter(object):
     """Storage Center REST API filtering structure.
 
@@ -78,10 +358,167 @@ class LegacyPayloadFilter(object):
             self.payload['filters'].append(apifilter)
 
 
+def _normalize_endpoint(url):
+    """Turns a REST url into an endpoint name for metrics.
+
+    Path elements containing digits are object IDs and are replaced, so
+    ``StorageCenter/ScVolume/448.12/MappingProfileList`` becomes
+    ``StorageCenter/ScVolume/{id}/MappingProfileList``.
+
+    :param url: The REST url relative to the base url.
+    :returns: The normalized endpoint name.
+    """
+    parts = url.strip('/').split('/')
+    return '/'.join('{id}' if any(c.isdigit() for c in part) else part
+                    for part in parts)
+
+
+class RequestLimiter(object):
+    """Admission control for the requests sent to the Enterprise Manager.
+
+    Requests wait for a free slot before they are sent.  Waiting requests
+    are let through strictly in priority order: ``PRIORITY_CRITICAL``
+    changes first, then ``PRIORITY_NORMAL`` reads, then
+    ``PRIORITY_BACKGROUND`` listings, which may only use half the slots.
+
+    The number of slots adapts to the Enterprise Manager.  Latency is
+    tracked per endpoint, since a volume listing is always much slower than
+    a single object lookup.  While each endpoint's smoothed latency stays
+    within ``tolerance`` times the lowest latency seen for it, the limit
+    grows by one per limit's worth of requests.  When an endpoint gets
+    slower, or requests fail with a server error, it is cut by a tenth at
+    most once per round trip.  An optional token bucket also caps the
+    request rate.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 min_concurrency=DEFAULT_MIN_CONCURRENCY, rate=0, burst=0,
+                 tolerance=DEFAULT_LATENCY_TOLERANCE):
+        """Create a new limiter.
+
+        :param max_concurrency: The most requests to have in flight.
+        :param min_concurrency: The fewest slots the limit adapts down to.
+        :param rate: Requests per second allowed on average.  0 disables
+                     rate limiting.
+        :param burst: Requests that may be sent at once above the rate.
+                      Defaults to one second's worth.
+        :param tolerance: How many times the baseline latency a request
+                          may take before the limit is lowered.
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(max_concurrency)
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self._tokens = self.burst
+        self._refilled = time.time()
+        # Endpoint to its [baseline, smoothed] latency.
+        self._latencies = {}
+        self._decreased = 0
+        self._waiting = [0] * len(PRIORITY_NAMES)
+        self._cond = threading.Condition()
+        self._metrics = metrics.REGISTRY
+
+    def _slots(self, priority):
+        """Gets the number of slots a priority class may use."""
+        if priority == PRIORITY_BACKGROUND:
+            return max(1, int(self.limit) // 2)
+        return max(1, int(self.limit))
+
+    def _take_token(self):
+        """Takes a rate limit token.
+
+        :returns: 0 if a token was taken, otherwise the seconds until the
+                  next token is available.
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Waits until a request may be sent.
+
+        Every ``acquire`` must be followed by a ``release``.
+
+        :param priority: The priority class of the request.
+        """
+        labels = {'priority': PRIORITY_NAMES[priority]}
+        start = time.time()
+        with self._cond:
+            self._waiting[priority] += 1
+            self._metrics.set_gauge('em_limiter_queue_depth', labels,
+                                    self._waiting[priority])
+            try:
+                while True:
+                    wait = None
+                    if (self.in_flight < self._slots(priority) and
+                            not any(self._waiting[:priority])):
+                        wait = self._take_token()
+                        if not wait:
+                            break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._metrics.set_gauge('em_limiter_queue_depth', labels,
+                                        self._waiting[priority])
+            self.in_flight += 1
+            self._metrics.set_gauge('em_limiter_in_flight', None,
+                                    self.in_flight)
+        self._metrics.observe('em_limiter_wait_seconds', labels,
+                              time.time() - start)
+
+    def release(self, latency, ok=True, endpoint=None):
+        """Records that a request has completed.
+
+        :param latency: The seconds the request took.
+        :param ok: False if the request failed in a way that suggests the
+                   Enterprise Manager is overloaded.
+        :param endpoint: The method and normalized endpoint of the request,
+                         which its latency is compared by.
+        """
+        now = time.time()
+        with self._cond:
+            self.in_flight -= 1
+            stats = self._latencies.get(endpoint)
+            if stats is None:
+                stats = self._latencies[endpoint] = [latency, latency]
+            elif latency < stats[0]:
+                stats[0] = latency
+            else:
+                # Let the baseline follow a lasting change in latency.
+                stats[0] += (latency - stats[0]) * 0.001
+            stats[1] += (latency - stats[1]) * 0.1
+            baseline, smoothed = stats
+            slow = (smoothed > self.tolerance *
+                    max(baseline, MIN_BASELINE_LATENCY))
+            if not ok or slow:
+                # Back off at most once per round trip.
+                if now - self._decreased > smoothed:
+                    self._decreased = now
+                    self.limit = max(self.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+            self._metrics.set_gauge('em_limiter_in_flight', None,
+                                    self.in_flight)
+            self._metrics.set_gauge('em_limiter_limit', None,
+                                    int(self.limit))
+            self._cond.notify_all()
+
+
 class HttpClient(object):
     """Wrapper class for making Storage Center API calls."""
 
-    def __init__(self, host, port, user, password, verify):
+    def __init__(self, host, port, user, password, verify, adapter=None):
         """HttpClient handles the REST requests.
 
         :param host: IP address of the Dell Data Collector.
@@ -90,14 +527,22 @@ class HttpClient(object):
         :param password: Password.
         :param verify: Boolean indicating whether certificate verification
                        should be turned on or not.
+        :param adapter: Optional ``requests`` transport adapter to send the
+                        requests through, such as an ``em_simulator``.
         """
         self.base_url = 'https://%s:%s/api/rest/' % (host, port)
         self.session = requests.Session()
+        if adapter is not None:
+            self.session.mount(self.base_url, adapter)
         self.session.auth = (user, password)
         self.header = {}
         self.header['Content-Type'] = 'application/json; charset=utf-8'
         self.header['x-dell-api-version'] = '2.0'
         self.verify = verify
+        self.relogin = None
+        self.metrics = metrics.REGISTRY
+        self.limiter = None
+        self.priority = None
 
         if not verify:
             requests.packages.urllib3.disable_warnings()
@@ -112,67 +557,312 @@ class HttpClient(object):
         """Formats the REST URL to use for API calls."""
         return '%s%s' % (self.base_url, url if url[0] != '/' else url[1:])
 
+    def _request(self, method, url, payload=None, stream=False):
+        """Perform a REST request.
+
+        If the Enterprise Manager reports our session is no longer valid
+        (HTTP 401) and a ``relogin`` handler has been set, the handler is
+        called to establish a new session and the request is retried once.
+
+        :param method: The HTTP method to use.
+        :param url: The REST URL relative to the base url.
+        :param payload: Optional dict to send as the JSON body.
+        :param stream: If True the response body is not read until it is
+                       accessed.
+        :returns: The ``requests`` response object.
+        """
+        kwargs = {'headers': self.header,
+                  'verify': self.verify,
+                  'stream': stream}
+        if payload is not None:
+            kwargs['data'] = json.dumps(payload,
+                                        ensure_ascii=False).encode('utf-8')
+        r = self._timed_request(method, url, kwargs)
+        if (r.status_code == 401 and self.relogin is not None and
+                not url.startswith('ApiConnection/')):
+            LOG.info('Enterprise Manager session expired, logging in again.')
+            self.relogin()
+            r = self._timed_request(method, url, kwargs)
+        return r
+
+    def _timed_request(self, method, url, kwargs):
+        """Sends a request and records its latency, status and size.
+
+        :param method: The HTTP method to use.
+        :param url: The REST URL relative to the base url.
+        :param kwargs: Keyword arguments for ``Session.request``.
+        :returns: The ``requests`` response object.
+        """
+        labels = {'method': method, 'endpoint': _normalize_endpoint(url)}
+        endpoint = (method, labels['endpoint'])
+        if self.limiter is not None:
+            self.limiter.acquire(self._priority(method, url))
+        start = time.time()
+        try:
+            r = self.session.request(method, self._format_url(url), **kwargs)
+        except Exception:
+            if self.limiter is not None:
+                self.limiter.release(time.time() - start, False, endpoint)
+            self.metrics.increment('em_requests_total',
+                                   dict(labels, status='error'))
+            raise
+        latency = time.time() - start
+        if self.limiter is not None:
+            self.limiter.release(latency, r.status_code < 500 and
+                                 r.status_code != 429, endpoint)
+        self.metrics.observe('em_request_seconds', labels, latency)
+        self.metrics.increment('em_requests_total',
+                               dict(labels, status=str(r.status_code)))
+        self.metrics.increment('em_request_bytes_total', labels,
+                               len(kwargs.get('data') or ''))
+        size = r.headers.get('Content-Length')
+        if size is None and not kwargs['stream']:
+            size = len(r.content)
+        self.metrics.increment('em_response_bytes_total', labels,
+                               int(size or 0))
+        return r
+
+    def _priority(self, method, url):
+        """Gets the limiter priority class of a request.
+
+        Changes are critical and reads are normal, unless ``priority`` has
+        been set for the operation using this client.
+        """
+        if self.priority is not None:
+            return self.priority
+        if method == 'GET' or url.endswith('/GetList'):
+            return PRIORITY_NORMAL
+        return PRIORITY_CRITICAL
+
     def get(self, url):
         """Perform a REST GET request."""
-        return self.session.get(
-            self._format_url(url),
-            headers=self.header,
-            verify=self.verify)
+        return self._request('GET', url)
 
-    def post(self, url, payload):
+    def post(self, url, payload, stream=False):
         """Perform a REST POST request."""
-        return self.session.post(
-            self._format_url(url),
-            data=json.dumps(payload,
-                            ensure_ascii=False).encode('utf-8'),
-            headers=self.header,
-            verify=self.verify)
+        return self._request('POST', url, payload, stream)
 
     def put(self, url, payload):
         """Perform a REST PUT request."""
-        return self.session.put(
-            self._format_url(url),
-            data=json.dumps(payload,
-                            ensure_ascii=False).encode('utf-8'),
-            headers=self.header,
-            verify=self.verify)
+        return self._request('PUT', url, payload)
 
     def delete(self, url):
         """Perform a REST DELETE request."""
-        return self.session.delete(
-            self._format_url(url),
-            headers=self.header,
-            verify=self.verify)
+        return self._request('DELETE', url)
+
+
+class SessionPool(object):
+    """Pool of authenticated Enterprise Manager connections.
+
+    Logging in to the Enterprise Manager costs a TLS handshake and two
+    extra REST calls, so connections are kept logged in and handed out
+    again on the next ``acquire``.  At most ``max_size`` idle connections
+    are retained.  Connections checked out beyond that are logged out when
+    they are released.  Idle connections are periodically sent a keepalive
+    request so the EM does not expire the session.  Once the pool is
+    closed connections are logged out as soon as they are released.
+    """
+
+    def __init__(self, factory, max_size=DEFAULT_SESSION_POOL_SIZE,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL):
+        """Create a new pool.
+
+        :param factory: Callable returning a new, logged in
+                        ``StorageCenterApi`` object.
+        :param max_size: Maximum number of idle connections to keep.
+        :param keepalive_interval: Seconds between keepalives sent to
+                                   idle connections.  0 disables keepalives.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.keepalive_interval = keepalive_interval
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._keepalive_thread = None
+
+    def acquire(self):
+        """Gets a logged in connection from the pool.
+
+        :returns: A ``StorageCenterApi`` object.
+        """
+        connection = None
+        with self._lock:
+            if self._idle:
+                connection = self._idle.pop()
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.REGISTRY.increment(
+            'em_session_pool_total',
+            {'result': 'miss' if connection is None else 'hit'})
+        if connection is None:
+            connection = self.factory()
+        connection.pool = self
+        return connection
+
+    def release(self, connection):
+        """Returns a connection to the pool.
+
+        :param connection: The ``StorageCenterApi`` object to return.
+        """
+        connection.last_used = time.time()
+        with self._lock:
+            if (not self._closed.is_set() and
+                    len(self._idle) < self.max_size):
+                self._idle.append(connection)
+                connection = None
+        if connection is not None:
+            self.discard(connection)
+        else:
+            self._start_keepalive()
+
+    def discard(self, connection):
+        """Logs out a connection without returning it to the pool.
+
+        :param connection: The ``StorageCenterApi`` object to close.
+        """
+        connection.pool = None
+        with self._lock:
+            self.discarded += 1
+        try:
+            connection.close_connection()
+        except Exception:
+            LOG.debug('Error closing pooled connection.', exc_info=True)
+
+    def close(self):
+        """Stops the keepalives and logs out all idle connections."""
+        self._closed.set()
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for connection in idle:
+            self.discard(connection)
+
+    def stats(self):
+        """Gets the pool counters.
+
+        :returns: A dict of pool hit, miss, discard and idle counts.
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'discarded': self.discarded,
+                    'idle': len(self._idle)}
+
+    def _start_keepalive(self):
+        """Starts the keepalive thread if it is not already running."""
+        if self.keepalive_interval <= 0:
+            return
+        with self._lock:
+            if (self._keepalive_thread is not None or
+                    self._closed.is_set()):
+                return
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop)
+            self._keepalive_thread.name = 'em_session_keepalive'
+            self._keepalive_thread.daemon = True
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        """Sends keepalives to connections that have been idle a while."""
+        while not self._closed.wait(self.keepalive_interval):
+            cutoff = time.time() - self.keepalive_interval
+            with self._lock:
+                stale = [c for c in self._idle if c.last_used <= cutoff]
+                self._idle = [c for c in self._idle if c.last_used > cutoff]
+            for connection in stale:
+                if connection.keepalive():
+                    self.release(connection)
+                else:
+                    self.discard(connection)
 
 
 class StorageCenterApiHelper(object):
     """Helper class for working with the SC API.
 
     Helper class for API access.  Handles opening and closing the
-    connection to the Dell Enterprise Manager.
+    connection to the Dell Enterprise Manager.  Connections are pooled
+    so each driver call does not need to log in and out again.  If
+    ``aggregator_socket`` is set requests are sent through the node's
+    ``em_aggregator`` daemon instead.
     """
     def __init__(self, config):
         self.config = config
-
-    def open_connection(self):
-        """Creates the StorageCenterApi object.
+        self.cache = TtlCache(int(config.get('metadata_cache_ttl',
+                                             DEFAULT_METADATA_CACHE_TTL)))
+        self.index = VolumeIndex(
+            config.get('volume_index', True),
+            int(config.get('volume_index_negative_ttl',
+                           DEFAULT_NEGATIVE_TTL)))
+        self.pool = SessionPool(
+            self._create_connection,
+            int(config.get('session_pool_size', DEFAULT_SESSION_POOL_SIZE)),
+            int(config.get('session_keepalive_interval',
+                           DEFAULT_KEEPALIVE_INTERVAL)))
+        self.limiter = None
+        max_concurrency = int(config.get('em_max_concurrency',
+                                         DEFAULT_MAX_CONCURRENCY))
+        if max_concurrency > 0:
+            self.limiter = RequestLimiter(
+                max_concurrency,
+                int(config.get('em_min_concurrency',
+                               DEFAULT_MIN_CONCURRENCY)),
+                float(config.get('em_rate_limit', 0)),
+                int(config.get('em_rate_burst', 0)))
+
+    def _create_connection(self):
+        """Creates and logs in a new StorageCenterApi object.
 
         :return: StorageCenterApi object.
-        :raises: VolumeBackendAPIException
         """
+        adapter = self.config.get('em_adapter')
+        if self.config.get('aggregator_socket'):
+            adapter = em_aggregator.AggregatorAdapter(
+                self.config['aggregator_socket'],
+                int(self.config.get('aggregator_timeout',
+                                    em_aggregator.DEFAULT_TIMEOUT)))
         connection = StorageCenterApi(self.config['storage_host'],
                                       self.config.get('storage_port', 3033),
                                       self.config['username'],
                                       self.config['password'],
-                                      False)
+                                      False,
+                                      adapter)
         connection.ssn = self.config['dell_sc_ssn']
         connection.vfname = self.config.get(
             'volume_folder_name', DEFAULT_VOLUME_FOLDER).strip()
         connection.sfname = self.config.get(
             'server_folder_name', DEFAULT_SERVER_FOLDER).strip()
+        connection.max_workers = int(self.config.get(
+            'max_parallel_requests', concurrency.DEFAULT_MAX_WORKERS))
+        connection.cache = self.cache
+        connection.index = self.index
+        connection.chunked = self.config.get('volume_list_chunked', False)
+        connection.client.limiter = self.limiter
         connection.open_connection()
         return connection
 
+    def open_connection(self, priority=None):
+        """Gets a StorageCenterApi object from the session pool.
+
+        The connection is returned to the pool when its context exits.
+
+        :param priority: Optional ``RequestLimiter`` priority class for all
+                         the requests made on the connection.
+        :return: StorageCenterApi object.
+        :raises: VolumeBackendAPIException
+        """
+        connection = self.pool.acquire()
+        connection.client.priority = priority
+        return connection
+
+    def close(self):
+        """Logs out of all pooled connections."""
+        self.pool.close()
+
 
 class StorageCenterApi(object):
     """Storage Center API interface.
@@ -181,7 +871,7 @@ class StorageCenterApi(object):
     """
     APIVERSION = '2.3.1'
 
-    def __init__(self, host, port, user, password, verify):
+    def __init__(self, host, port, user, password, verify, adapter=None):
         """This creates a connection to Dell Enterprise Manager.
 
         :param host: IP address of the Dell Data Collector.
@@ -190,23 +880,45 @@ class StorageCenterApi(object):
         :param password: Password.
         :param verify: Boolean indicating whether certificate verification
                        should be turned on or not.
+        :param adapter: Optional ``requests`` transport adapter for the
+                        REST requests.
         """
         self.notes = 'Created by Dell Flocker Driver'
         self.ssn = None
         self.vfname = DEFAULT_VOLUME_FOLDER
         self.sfname = DEFAULT_SERVER_FOLDER
         self.legacypayloadfilters = False
+        self.api_version = None
+        self.max_workers = concurrency.DEFAULT_MAX_WORKERS
+        self.chunked = False
+        self.cache = TtlCache(0)
+        self.index = VolumeIndex(False)
+        self.memo = {}
+        self.pool = None
+        self.last_used = 0
         self.client = HttpClient(host,
                                  port,
                                  user,
                                  password,
-                                 verify)
+                                 verify,
+                                 adapter)
+        self.client.relogin = self.open_connection
 
     def __enter__(self):
         return self
 
     def __exit__(self, tipe, value, traceback):
-        self.close_connection()
+        # Anything we memoized is only valid for this operation.
+        self.memo.clear()
+        if self.client is not None:
+            self.client.priority = None
+        if self.pool is None:
+            self.close_connection()
+        elif isinstance(value, requests.exceptions.RequestException):
+            # The session may be broken, don't hand it out again.
+            self.pool.discard(self)
+        else:
+            self.pool.release(self)
 
     def _check_result(self, rest_response):
         """Checks and logs API responses.
@@ -286,7 +998,8 @@ class StorageCenterApi(object):
             LOG.debug('Unable to find result where %(attr)s is %(val)s',
                       {'attr': attribute,
                        'val': value})
-            LOG.debug('Blob was %(blob)s', {'blob': blob.text})
+            LOG.debug('Blob was %(blob)s',
+                      {'blob': blob.text[:MAX_LOGGED_RESPONSE]})
         return rsp
 
     def _get_json(self, blob):
@@ -302,6 +1015,62 @@ class StorageCenterApi(object):
                       blob)
         return None
 
+    def _iter_json_list(self, blob):
+        """Yields the items of a JSON list response one at a time.
+
+        The response is decoded as it is read so only the current item,
+        rather than the whole response, is held in memory.  The response
+        should have been requested with ``stream=True``.
+
+        :param blob: The response from a REST call.
+        :returns: A generator of the JSON items.  A JSON dict response is
+                  yielded as a single item.
+        :raises ValueError: If the response is not valid JSON or ends
+                            before the end of the list.
+        """
+        decoder = json.JSONDecoder()
+        buf = u''
+        started = False
+        try:
+            if blob.encoding is None:
+                blob.encoding = 'utf-8'
+            for chunk in blob.iter_content(JSON_CHUNK_SIZE,
+                                           decode_unicode=True):
+                buf += chunk
+                pos = 0
+                while True:
+                    while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                        pos += 1
+                    if pos >= len(buf):
+                        break
+                    if not started:
+                        if buf[pos] != u'[':
+                            # Not a list, wait for the whole value.
+                            break
+                        started = True
+                        pos += 1
+                        continue
+                    if buf[pos] == u']':
+                        return
+                    try:
+                        item, pos = decoder.raw_decode(buf, pos)
+                    except ValueError:
+                        # Incomplete item, need more data.
+                        break
+                    yield item
+                buf = buf[pos:]
+            if started:
+                # A dropped connection must not look like a shorter list.
+                raise ValueError('Response ended inside the JSON list.')
+            if buf.strip():
+                yield json.loads(buf)
+        except ValueError:
+            LOG.error('Error invalid json: %s',
+                      buf[:MAX_LOGGED_RESPONSE])
+            raise
+        finally:
+            blob.close()
+
     def _get_id(self, blob):
         """Returns the instanceId from a Dell REST object.
 
@@ -309,6 +1078,8 @@ class StorageCenterApi(object):
         :returns: The instanceId from the Dell SC object or None on error.
         """
         try:
+            if isinstance(blob, VolumeRecord):
+                return blob.instance_id
             if isinstance(blob, dict):
                 return blob.get('instanceId')
         except AttributeError:
@@ -316,6 +1087,65 @@ class StorageCenterApi(object):
                       blob)
         return None
 
+    def _memo_key(self, arg):
+        """Gets the memo key for a memoized method argument."""
+        if isinstance(arg, (dict, VolumeRecord)):
+            return self._get_id(arg)
+        return arg
+
+    def _forget(self, *names):
+        """Drops memoized results after a write.
+
+        :param names: The memo key names to drop.
+        """
+        for key in list(self.memo):
+            if key[0] in names:
+                self.memo.pop(key, None)
+
+    def _fan_out(self, runner, func, items, max_workers=None):
+        """Runs a call for each item on concurrent connections.
+
+        A connection's session and memo are only used by one thread at a
+        time, so each worker thread gets its own connection from the
+        session pool, with the same priority as this one.  If this
+        connection is not pooled the calls are made one at a time on it.
+
+        :param runner: ``concurrency.parallel_map`` or
+                       ``concurrency.parallel_results``.
+        :param func: Callable taking a ``StorageCenterApi`` and an item.
+        :param items: Iterable of items to process.
+        :param max_workers: The maximum number of concurrent calls, by
+                            default ``max_workers``.
+        :returns: The result of ``runner``.
+        """
+        if self.pool is None:
+            return runner(lambda item: func(self, item), items, 1)
+
+        local = threading.local()
+        connections = []
+
+        def call(item):
+            api = getattr(local, 'api', None)
+            if api is None:
+                api = local.api = self.pool.acquire()
+                api.client.priority = self.client.priority
+                connections.append(api)
+            try:
+                return func(api, item)
+            except requests.exceptions.RequestException:
+                # The session may be broken, don't use it again.
+                exc_info = sys.exc_info()
+                local.api = None
+                connections.remove(api)
+                api.__exit__(*exc_info)
+                six.reraise(*exc_info)
+
+        try:
+            return runner(call, items, max_workers or self.max_workers)
+        finally:
+            for api in connections:
+                api.__exit__(None, None, None)
+
     def _get_payload_filter(self, filter_type='AND'):
         """Gets the appropriate payload filter.
 
@@ -347,6 +1177,7 @@ class StorageCenterApi(object):
         try:
             apidict = self._get_json(r)
             version = apidict['apiVersion']
+            self.api_version = version
             splitver = version.split('.')
             # REST API only available starting with 2.0, but 2.0 and 2.1
             # did filtering a little differently
@@ -365,6 +1196,22 @@ class StorageCenterApi(object):
         self._check_result(r)
         self.client = None
 
+    def keepalive(self):
+        """Keeps our Enterprise Manager session from expiring.
+
+        :returns: ``True`` if the session is still usable.
+        """
+        try:
+            r = self.client.get('ApiConnection/ApiConnection')
+            if r.status_code == 401:
+                self.open_connection()
+                return True
+            return self._check_result(r)
+        except Exception:
+            LOG.debug('Keepalive failed.', exc_info=True)
+        return False
+
+    @_cached('sc')
     def find_sc(self):
         """Check that the SC is there and being managed by EM.
 
@@ -415,6 +1262,8 @@ class StorageCenterApi(object):
                        'reason': r.reason})
         else:
             scfolder = self._first_result(r)
+            # Cached lookups may have recorded the old folder tree.
+            self.cache.invalidate('folder')
         return scfolder
 
     def _create_folder_path(self, url, foldername):
@@ -459,6 +1308,7 @@ class StorageCenterApi(object):
             folderpath = folderpath + '/'
         return scfolder
 
+    @_cached('folder')
     def _find_folder(self, url, foldername):
         """Find a folder on the SC using the specified url.
 
@@ -519,10 +1369,10 @@ class StorageCenterApi(object):
         it. This initializes the volume.
 
         Don't wig out if this fails.
-        :param scvolume: Dell Volume object.
+        :param scvolume: ``VolumeRecord`` of the volume.
         """
         pf = self._get_payload_filter()
-        pf.append('scSerialNumber', scvolume.get('scSerialNumber'), 'Equals')
+        pf.append('scSerialNumber', self.ssn, 'Equals')
         r = self.client.post('StorageCenter/ScServer/GetList', pf.payload)
         if r.status_code == 200:
             scservers = self._get_json(r)
@@ -537,7 +1387,7 @@ class StorageCenterApi(object):
                     self.map_volume(scvolume,
                                     scserver)
                     # We have changed the volume so grab a new copy of it.
-                    scvolume = self.find_volume(scvolume.get('name'))
+                    scvolume = self.find_volume(scvolume.name)
                     self.unmap_volume(scvolume,
                                       scserver)
                     return
@@ -568,61 +1418,87 @@ class StorageCenterApi(object):
         # and look through for the one we want. Never many profiles, so
         # this doesn't cause as much overhead as it might seem.
         storage_profile = storage_profile.replace(' ', '').lower()
-        pf = self._get_payload_filter()
-        pf.append('scSerialNumber', self.ssn, 'Equals')
-        r = self.client.post(
-            'StorageCenter/ScStorageProfile/GetList', pf.payload)
-        if self._check_result(r):
-            profiles = self._get_json(r)
-            for profile in profiles:
-                # Look for the stripped, case insensitive match
-                name = profile.get('name', '').replace(' ', '').lower()
-                if name == storage_profile:
-                    return profile
+        profiles = dict(
+            (profile.get('name', '').replace(' ', '').lower(), profile)
+            for profile in self._get_storage_profiles())
+        # Look for the stripped, case insensitive match
+        if storage_profile in profiles:
+            return profiles[storage_profile]
 
         # It's possible the standard Flocker profiles are requested but
         # matching named profiles are not defined on the SC. In this case
         # we match up the Flocker default profiles with the SC default
         # profiles.
-        if storage_profile == 'gold':
-            return self._find_storage_profile('highpriority')
-        elif storage_profile == 'silver':
-            return self._find_storage_profile('mediumpriority')
-        elif storage_profile == 'bronze':
-            return self._find_storage_profile('lowpriority')
+        aliases = {'gold': 'highpriority',
+                   'silver': 'mediumpriority',
+                   'bronze': 'lowpriority'}
+        return profiles.get(aliases.get(storage_profile))
 
-        return None
+    @_cached('storage_profiles')
+    def _get_storage_profiles(self):
+        """Gets all Storage Profiles on the array.
+
+        :returns: A list of Storage Profile objects.
+        """
+        pf = self._get_payload_filter()
+        pf.append('scSerialNumber', self.ssn, 'Equals')
+        r = self.client.post(
+            'StorageCenter/ScStorageProfile/GetList', pf.payload)
+        if self._check_result(r):
+            return self._get_json(r) or []
+        return []
 
     def list_volumes(self):
         """Gets all volumes in our configured folder.
 
-        :returns: All volumes present in the volume folder.
+        :returns: ``VolumeRecord`` of all volumes present in the volume
+                  folder.
+        """
+        generation = self.index.start_listing()
+        result = list(self.iter_volumes())
+        self.index.replace_all(result, generation)
+        return result
+
+    def iter_volumes(self):
+        """Yields the volumes in our configured folder one at a time.
+
+        Volumes are decoded as the response is read.  If ``chunked`` is set
+        the listing is split into one request per leading digit of the
+        volume index, so the size of each response stays bounded as the
+        folder grows.  Instance IDs are ``<ssn>.<index>``, so every volume is
+        in exactly one chunk whatever its name.  Chunking needs EM2015R1 or
+        later.
+
+        :returns: A generator of ``VolumeRecord`` for the volumes in the
+                  volume folder.
         """
         LOG.debug('Getting list of all volumes.')
-        result = []
 
         # Make sure our volume folder is created.
         volume_folder = self._find_volume_folder(create=True)
         if not volume_folder:
             LOG.error("Error getting configured volume folder.")
-            return result
+            return
 
-        # Query the array for all volumes in the folder
-        pf = self._get_payload_filter()
-        pf.append('scSerialNumber', self.ssn)
+        prefixes = [None]
+        if self.chunked and not self.legacypayloadfilters:
+            prefixes = ['%s.%s' % (self.ssn, digit)
+                        for digit in string.digits]
         vfname = (self.vfname if self.vfname.endswith('/')
                   else self.vfname + '/')
-        pf.append('volumeFolderPath', vfname)
-        pf.append('inRecycleBin', False)
-        r = self.client.post('StorageCenter/ScVolume/GetList',
-                             pf.payload)
-        if self._check_result(r):
-            retval = self._get_json(r)
-            if isinstance(retval, list):
-                result = retval
-            elif retval:
-                result.append(retval)
-        return result
+        for prefix in prefixes:
+            # Query the array for all volumes in the folder
+            pf = self._get_payload_filter()
+            pf.append('scSerialNumber', self.ssn)
+            pf.append('volumeFolderPath', vfname)
+            pf.append('inRecycleBin', False)
+            pf.append('instanceId', prefix, 'StartsWith')
+            r = self.client.post('StorageCenter/ScVolume/GetList',
+                                 pf.payload,
+                                 True)
+            if self._check_result(r):
+                for vol in self._iter_json_list(r):
+                    yield VolumeRecord.from_json(vol)
 
     def create_volume(self, name, size, storage_profile=None):
         """Creates a new volume on the Storage Center.
@@ -635,7 +1511,7 @@ class StorageCenterApi(object):
                      This is the cinder volume ID.
         :param size: The size of the volume to be created in GB.
         :param storage_profile: Optional storage profile to set for the volume.
-        :returns: Dell Volume object or None.
+        :returns: ``VolumeRecord`` or None.
         """
         LOG.debug('Create Volume %(name)s %(ssn)s %(folder)s %(profile)s',
                   {'name': name,
@@ -657,6 +1533,55 @@ class StorageCenterApi(object):
         if storage_profile and profile is None:
             raise Exception('Storage Profile %s not found.' % storage_profile)
 
+        return self._post_volume(name, size, folder, profile)
+
+    def create_volumes(self, volumes, max_workers=None):
+        """Creates several volumes on the Storage Center.
+
+        The volume folder and each storage profile are looked up once and
+        the volumes are then created concurrently, each worker on its own
+        pooled connection.
+
+        :param volumes: A list of (name, size in GB, storage profile)
+                        tuples.  The storage profile may be None.
+        :param max_workers: The maximum number of concurrent creates, by
+                            default ``max_workers``.
+        :returns: A list of (``VolumeRecord``, exception) tuples in the
+                  same order as ``volumes``.  The exception is None for
+                  each volume that was created.
+        """
+        folder = self._find_volume_folder(True)
+        if folder is None:
+            LOG.warning('Unable to create folder %s',
+                        self.vfname)
+        profiles = {}
+        for _name, _size, storage_profile in volumes:
+            if storage_profile not in profiles:
+                profiles[storage_profile] = self._find_storage_profile(
+                    storage_profile)
+
+        def create(api, volume):
+            name, size, storage_profile = volume
+            profile = profiles[storage_profile]
+            if storage_profile and profile is None:
+                raise Exception('Storage Profile %s not found.' %
+                                storage_profile)
+            return api._post_volume(name, size, folder, profile)
+
+        results = self._fan_out(concurrency.parallel_results, create,
+                                volumes, max_workers)
+        self._forget('volume', 'volume_list')
+        return results
+
+    def _post_volume(self, name, size, folder, profile):
+        """Sends the request to create a volume.
+
+        :param name: Name of the volume to be created.
+        :param size: The size of the volume to be created in GB.
+        :param folder: The volume folder object or None.
+        :param profile: The Storage Profile object or None.
+        :returns: ``VolumeRecord`` or None.
+        """
         # Init our return.
         scvolume = None
 
@@ -673,11 +1598,15 @@ class StorageCenterApi(object):
         r = self.client.post('StorageCenter/ScVolume',
                              payload)
         if self._check_result(r):
+            self._forget('volume', 'volume_list')
+            self.index.discard(name)
             scvolume = self._get_json(r)
             if scvolume:
+                scvolume = VolumeRecord.from_json(scvolume)
+                self.index.add(scvolume)
                 LOG.info('Created volume %(instanceId)s: %(name)s',
-                         {'instanceId': scvolume['instanceId'],
-                          'name': scvolume['name']})
+                         {'instanceId': scvolume.instance_id,
+                          'name': scvolume.name})
             else:
                 LOG.error('ScVolume returned success with empty payload. '
                           'Attempting to locate volume.')
@@ -689,6 +1618,7 @@ class StorageCenterApi(object):
 
         return scvolume
 
+    @_memoized('volume_list')
     def _get_volume_list(self, name, deviceid, filterbyvfname=True):
         """Return the specified list of volumes.
 
@@ -696,7 +1626,7 @@ class StorageCenterApi(object):
         :param deviceid: Volume device ID on the SC backend.
         :param filterbyvfname:  If set to true then this filters by the preset
                                 folder name.
-        :return: Returns the scvolume list or None.
+        :return: Returns the ``VolumeRecord`` list or None.
         """
         result = None
         # We need a name or a device ID to find a volume.
@@ -713,13 +1643,16 @@ class StorageCenterApi(object):
                           else self.vfname + '/')
                 pf.append('volumeFolderPath', vfname)
             r = self.client.post('StorageCenter/ScVolume/GetList',
-                                 pf.payload)
+                                 pf.payload,
+                                 True)
             if self._check_result(r):
-                result = self._get_json(r)
+                result = [VolumeRecord.from_json(vol)
+                          for vol in self._iter_json_list(r)]
         # We return None if there was an error and a list if the command
         # succeeded. It might be an empty list.
         return result
 
+    @_memoized('volume')
     def find_volume(self, name):
         """Search self.ssn for volume of name.
 
@@ -729,7 +1662,7 @@ class StorageCenterApi(object):
 
         :param name: Name of the volume to search for.  This is the cinder
                      volume ID.
-        :returns: Dell Volume object or None if not found.
+        :returns: ``VolumeRecord`` or None if not found.
         :raises VolumeBackendAPIException: If multiple copies are found.
         """
         LOG.debug('Searching %(sn)s for %(name)s',
@@ -740,6 +1673,10 @@ class StorageCenterApi(object):
         if name is None:
             return None
 
+        found, scvolume = self.index.lookup(name)
+        if found:
+            return scvolume
+
         # Look for our volume in our folder.
         vollist = self._get_volume_list(name,
                                         None,
@@ -755,12 +1692,30 @@ class StorageCenterApi(object):
                                             False)
 
         # If multiple volumes of the same name are found we need to error.
-        if len(vollist) > 1:
+        if vollist and len(vollist) > 1:
             # blow up
             raise Exception('Multiple copies of volume %s found.' % name)
 
         # We made it and should have a valid volume.
-        return None if not vollist else vollist[0]
+        if not vollist:
+            if vollist is not None:
+                self.index.mark_missing(name)
+            return None
+        self.index.add(vollist[0])
+        return vollist[0]
+
+    def refresh_volume(self, name):
+        """Looks up a volume on the array, bypassing the volume index.
+
+        Used when a request made with an indexed volume failed, in case the
+        volume was deleted or replaced behind our back.
+
+        :param name: Name of the volume to search for.
+        :returns: ``VolumeRecord`` or None if not found.
+        """
+        self.index.discard(name)
+        self._forget('volume', 'volume_list')
+        return self.find_volume(name)
 
     def delete_volume(self, name):
         """Deletes the volume from the SC backend array.
@@ -777,7 +1732,10 @@ class StorageCenterApi(object):
         if vol is not None:
             r = self.client.delete('StorageCenter/ScVolume/%s'
                                    % self._get_id(vol))
+            self._forget('volume', 'volume_list',
+                         'mappings', 'mapping_profiles')
             if not self._check_result(r):
+                self.index.discard(name)
                 raise Exception(
                     'Error deleting volume '
                     '%(ssn)s: %(volume)s: %(code)d %(reason)s' %
@@ -785,6 +1743,7 @@ class StorageCenterApi(object):
                      'volume': name,
                      'code': r.status_code,
                      'reason': r.reason})
+            self.index.mark_missing(name)
             # json return should be true or false
             return self._get_json(r)
         LOG.warning('delete_volume: unable to find volume %s',
@@ -792,6 +1751,25 @@ class StorageCenterApi(object):
         # If we can't find the volume then it is effectively gone.
         return True
 
+    def delete_volumes(self, names, max_workers=None):
+        """Deletes several volumes from the SC backend array.
+
+        The volumes are deleted concurrently, each worker on its own pooled
+        connection.
+
+        :param names: The names of the volumes to delete.
+        :param max_workers: The maximum number of concurrent deletes, by
+                            default ``max_workers``.
+        :returns: A list of (result, exception) tuples in the same order as
+                  ``names``, as from ``delete_volume``.
+        """
+        results = self._fan_out(concurrency.parallel_results,
+                                lambda api, name: api.delete_volume(name),
+                                names, max_workers)
+        self._forget('volume', 'volume_list',
+                     'mappings', 'mapping_profiles')
+        return results
+
     def _find_server_folder(self, create=False):
         """Looks for the server folder on the Dell Storage Center.
 
@@ -841,6 +1819,7 @@ class StorageCenterApi(object):
             return False
         return True
 
+    @_cached('serveros')
     def _find_serveros(self, osname='Red Hat Linux 6.x'):
         """Returns the serveros instance id of the specified osname.
 
@@ -929,6 +1908,7 @@ class StorageCenterApi(object):
         # create our server
         r = self.client.post('StorageCenter/ScPhysicalServer',
                              payload)
+        self._forget('server', 'serverhba')
         if self._check_result(r):
             # Server was created
             scserver = self._first_result(r)
@@ -945,6 +1925,7 @@ class StorageCenterApi(object):
         # Success or failure is determined by the caller
         return scserver
 
+    @_memoized('server')
     def find_server(self, wwnoriscsiname):
         """Hunts for a server on the Dell backend by instance_name.
 
@@ -975,6 +1956,7 @@ class StorageCenterApi(object):
             LOG.debug('Server (%s) not found.', wwnoriscsiname)
         return scserver
 
+    @_memoized('serverhba')
     def _find_serverhba(self, instance_name):
         """Hunts for a server HBA on the Dell backend by instance_name.
 
@@ -1038,6 +2020,7 @@ class StorageCenterApi(object):
         LOG.debug(initiators)
         return initiators
 
+    @_memoized('mappings')
     def _find_mappings(self, scvolume):
         """Find the Dell volume object mappings.
 
@@ -1045,22 +2028,20 @@ class StorageCenterApi(object):
         :returns: A list of Dell mappings objects.
         """
         mappings = []
-        if scvolume.get('active', False):
-            r = self.client.get('StorageCenter/ScVolume/%s/MappingList'
-                                % self._get_id(scvolume))
-            if self._get_result(r):
-                mappings = self._get_json(r)
-            else:
-                LOG.debug('MappingList error: %(code)d %(reason)s',
-                          {'code': r.status_code,
-                           'reason': r.reason})
-                LOG.error('Unable to find volume mappings: %s',
-                          scvolume.get('name'))
+        r = self.client.get('StorageCenter/ScVolume/%s/MappingList'
+                            % self._get_id(scvolume))
+        if self._check_result(r):
+            mappings = self._get_json(r)
         else:
-            LOG.error('_find_mappings: volume is not active')
+            LOG.debug('MappingList error: %(code)d %(reason)s',
+                      {'code': r.status_code,
+                       'reason': r.reason})
+            LOG.error('Unable to find volume mappings: %s',
+                      scvolume.name)
         LOG.debug(mappings)
         return mappings
 
+    @_memoized('mapping_profiles')
     def find_mapping_profiles(self, scvolume):
         """Find the Dell volume object mapping profiles.
 
@@ -1074,6 +2055,74 @@ class StorageCenterApi(object):
             mapping_profiles = self._get_json(r)
         return mapping_profiles
 
+    def list_mapping_profiles(self, scvolumes):
+        """Gets the mapping profiles of a list of volumes in bulk.
+
+        Rather than every mapping profile on the Storage Center, only those
+        of the given volumes are requested, with ScMappingProfile/GetList
+        calls filtered on up to ``MAPPING_PROFILE_BATCH`` volume instanceIds
+        each.
+
+        :param scvolumes: List of Dell volume objects.
+        :returns: A list of Dell mapping profile objects or None if the
+                  bulk request is not available.
+        """
+        if self.legacypayloadfilters:
+            return None
+        volumeids = [self._get_id(vol) for vol in scvolumes]
+        mapping_profiles = []
+        for start in range(0, len(volumeids), MAPPING_PROFILE_BATCH):
+            pf = self._get_payload_filter('OR')
+            for volumeid in volumeids[start:start + MAPPING_PROFILE_BATCH]:
+                pf.append('volume', volumeid)
+            r = self.client.post('StorageCenter/ScMappingProfile/GetList',
+                                 pf.payload,
+                                 True)
+            if not self._check_result(r):
+                LOG.debug('ScMappingProfile GetList failed: '
+                          '%(code)d %(reason)s',
+                          {'code': r.status_code,
+                           'reason': r.reason})
+                return None
+            mapping_profiles.extend(self._iter_json_list(r))
+        return mapping_profiles
+
+    def find_mapping_profiles_for_volumes(self, scvolumes,
+                                          mapping_profiles=None):
+        """Find the mapping profiles for a list of Dell volume objects.
+
+        The volumes' mapping profiles are fetched in bulk with
+        ``list_mapping_profiles`` and joined to the volumes.  If that is not
+        available (pre EM2015R1) each volume's MappingProfileList is
+        requested with a bounded number of concurrent calls, each on its
+        own pooled connection.
+
+        :param scvolumes: List of Dell volume objects.
+        :param mapping_profiles: Optional result of a previous
+                                 ``list_mapping_profiles`` call.
+        :returns: A dict of volume instanceId to list of mapping profiles.
+        """
+        result = dict((self._get_id(vol), []) for vol in scvolumes)
+        if not result:
+            return result
+
+        if mapping_profiles is None:
+            mapping_profiles = self.list_mapping_profiles(scvolumes)
+        if mapping_profiles is not None:
+            for profile in mapping_profiles:
+                volumeid = self._get_id(profile.get('volume'))
+                if volumeid in result:
+                    result[volumeid].append(profile)
+            return result
+
+        profiles = self._fan_out(
+            concurrency.parallel_map,
+            lambda api, vol: api.find_mapping_profiles(vol),
+            scvolumes)
+        for vol, mapping_profiles in zip(scvolumes, profiles):
+            result[self._get_id(vol)] = mapping_profiles
+        return result
+
     def _find_controller_port(self, cportid):
         """Finds the SC controller port object for the specified cportid.
 
@@ -1201,8 +2250,10 @@ class StorageCenterApi(object):
             iqn = controllerport.get('iscsiName')
         return iqn
 
+    @_cached('vpmode')
     def _is_virtualport_mode(self):
-        isvpmode = False
+        # None, which is not cached, if the configuration can't be read.
+        isvpmode = None
         r = self.client.get('StorageCenter/ScConfiguration/%s' % self.ssn)
         if self._check_result(r):
             scconfig = self._get_json(r)
@@ -1381,6 +2432,7 @@ class StorageCenterApi(object):
 
         return data
 
+    @_cached('iscsi_ports')
     def get_iscsi_ports(self):
         """Gets the array's iSCSI ports.
 
@@ -1449,12 +2501,14 @@ class StorageCenterApi(object):
             r = self.client.post('StorageCenter/ScVolume/%s/MapToServer'
                                  % volumeid,
                                  payload)
+            self._forget('volume', 'volume_list',
+                         'mappings', 'mapping_profiles')
             if self._check_result(r):
                 # We just return our mapping
                 return self._first_result(r)
         # Error out
         LOG.error('Unable to map %(vol)s to %(srv)s',
-                  {'vol': scvolume['name'],
+                  {'vol': scvolume.name,
                    'srv': scserver['name']})
         return None
 
@@ -1478,6 +2532,8 @@ class StorageCenterApi(object):
                 if prosrv is not None and self._get_id(prosrv) == serverid:
                     r = self.client.delete('StorageCenter/ScMappingProfile/%s'
                                            % self._get_id(profile))
+                    self._forget('volume', 'volume_list',
+                                 'mappings', 'mapping_profiles')
                     if not self._check_result(r):
                         LOG.debug('ScMappingProfile error: '
                                   '%(code)d %(reason)s',
@@ -1499,26 +2555,65 @@ class StorageCenterApi(object):
 
         :param scvolume: Dell volume object to be expanded.
         :param newsize: The new size of the volume object.
-        :returns: The updated Dell volume object on success or None on failure.
+        :returns: The updated ``VolumeRecord`` on success or None on failure.
         """
         payload = {}
         payload['NewSize'] = '%d GB' % newsize
         r = self.client.post('StorageCenter/ScVolume/%s/ExpandToSize'
                              % self._get_id(scvolume),
                              payload)
+        self._forget('volume', 'volume_list')
         vol = None
         if self._check_result(r):
             vol = self._get_json(r)
+            if vol:
+                vol = VolumeRecord.from_json(vol)
+                self.index.add(vol)
         else:
             LOG.error('Error expanding volume '
                       '%(name)s: %(code)d %(reason)s',
-                      {'name': scvolume['name'],
+                      {'name': scvolume.name,
                        'code': r.status_code,
                        'reason': r.reason})
         if vol is not None:
             LOG.debug('Volume expanded: %(name)s %(size)s',
-                      {'name': vol['name'],
-                       'size': vol['configuredSize']})
+                      {'name': vol.name,
+                       'size': vol.size})
+        return vol
+
+    def rename_volume(self, scvolume, name):
+        """Renames a volume and moves it into our volume folder.
+
+        :param scvolume: ``VolumeRecord`` of the volume to rename.
+        :param name: The new name of the volume.
+        :returns: The updated ``VolumeRecord`` on success or None on failure.
+        """
+        payload = {}
+        payload['Name'] = name
+        folder = self._find_volume_folder(True)
+        if folder:
+            payload['VolumeFolder'] = self._get_id(folder)
+        r = self.client.put('StorageCenter/ScVolume/%s'
+                            % self._get_id(scvolume),
+                            payload)
+        self._forget('volume', 'volume_list')
+        self.index.discard(scvolume.name)
+        self.index.discard(name)
+        vol = None
+        if self._check_result(r):
+            vol = self._get_json(r)
+            if vol:
+                vol = VolumeRecord.from_json(vol)
+                self.index.add(vol)
+            else:
+                vol = self.find_volume(name)
+        else:
+            LOG.error('Error renaming volume '
+                      '%(original)s to %(name)s: %(code)d %(reason)s',
+                      {'original': scvolume.name,
+                       'name': name,
+                       'code': r.status_code,
+                       'reason': r.reason})
         return vol
 
     def update_storage_profile(self, scvolume, storage_profile):
@@ -1555,7 +2650,7 @@ class StorageCenterApi(object):
                 return False
 
         LOG.info('Switching volume %(vol)s to profile %(prof)s.',
-                 {'vol': scvolume['name'],
+                 {'vol': scvolume.name,
                   'prof': profile.get('name')})
         payload = {}
         payload['StorageProfile'] = self._get_id(profile)
@@ -1567,7 +2662,7 @@ class StorageCenterApi(object):
             LOG.error('Error changing Storage Profile for volume '
                       '%(original)s to %(name)s: %(code)d %(reason)s '
                       '%(text)s',
-                      {'original': scvolume['name'],
+                      {'original': scvolume.name,
                        'name': storage_profile,
                        'code': r.status_code,
                        'reason': r.reason,
@@ -0,0 +1,213 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Reactor based Dell Storage Center Block Device Driver.
+
+To use this driver set ``backend`` in the agent configuration to
+``dell_storagecenter_driver.dell_storagecenter_async``.
+"""
+
+import logging
+
+from flocker import node
+from flocker.node.agents import blockdevice
+from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python import failure
+from twisted.python import threadpool
+from zope.interface import implementer
+
+import concurrency
+import dell_storagecenter_blockdevice
+
+
+LOG = logging.getLogger(__name__)
+DRIVER_NAME = u"dell_storagecenter_flocker_plugin_async"
+
+
+def create_async_driver_instance(cluster_id, reactor, **config):
+    """Instantiate a new reactor based driver instance.
+
+    :param cluster_id: The container cluster ID.
+    :param reactor: The reactor the driver will run on.
+    :param config: The driver configuration settings.
+    :return: A new DellStorageCenterAsyncBlockDeviceAPI object.
+    """
+    sync_driver = dell_storagecenter_blockdevice.create_driver_instance(
+        cluster_id, **config)
+    return DellStorageCenterAsyncBlockDeviceAPI(
+        reactor,
+        sync_driver,
+        int(config.get('max_parallel_requests',
+                       concurrency.DEFAULT_MAX_WORKERS)))
+
+
+@implementer(blockdevice.IBlockDeviceAsyncAPI)
+class DellStorageCenterAsyncBlockDeviceAPI(object):
+    """Asynchronous block device driver for Dell Storage Center.
+
+    Implements the ``IBlockDeviceAsyncAPI`` on top of the steps of a
+    ``DellStorageCenterBlockDeviceAPI``.  REST calls are made on a dedicated
+    thread pool so they never block the reactor.  Waiting for devices to
+    show up or go away can take up to ``device_wait_timeout``, so those
+    calls run on a separate pool and can't hold up the REST calls.
+    """
+
+    def __init__(self, reactor, sync_driver, max_workers):
+        """Initialize new instance of the driver.
+
+        :param reactor: The reactor to run on.
+        :param sync_driver: The ``DellStorageCenterBlockDeviceAPI`` whose
+                            steps are run.
+        :param max_workers: The maximum number of concurrent REST calls,
+                            and of concurrent device waits.
+        """
+        self._reactor = reactor
+        self._sync = sync_driver
+        self._threadpool = threadpool.ThreadPool(
+            minthreads=0, maxthreads=max_workers,
+            name='dell_storagecenter_async')
+        self._device_threadpool = threadpool.ThreadPool(
+            minthreads=0, maxthreads=max_workers,
+            name='dell_storagecenter_async_devices')
+        for pool in (self._threadpool, self._device_threadpool):
+            reactor.callWhenRunning(pool.start)
+        reactor.addSystemEventTrigger('during', 'shutdown', self.close)
+
+    def close(self):
+        """Stops the thread pools and closes the sync driver."""
+        if self._threadpool.joined:
+            return
+        self._threadpool.stop()
+        self._device_threadpool.stop()
+        self._sync.close()
+
+    def _defer(self, func, *args, **kwargs):
+        """Runs a blocking REST call on the driver thread pool."""
+        return threads.deferToThreadPool(
+            self._reactor, self._threadpool, func, *args, **kwargs)
+
+    def _defer_device(self, func, *args, **kwargs):
+        """Runs a call that waits on local devices on its own pool."""
+        return threads.deferToThreadPool(
+            self._reactor, self._device_threadpool, func, *args, **kwargs)
+
+    def allocation_unit(self):
+        """Gets the minimum allocation unit for our backend."""
+        return defer.succeed(self._sync.allocation_unit())
+
+    def compute_instance_id(self):
+        """Gets an identifier for this node."""
+        return self._defer(self._sync.compute_instance_id)
+
+    def create_volume(self, dataset_id, size):
+        """Create a new volume on the array."""
+        return self._defer(self._sync.create_volume, dataset_id, size)
+
+    def create_volume_with_profile(self, dataset_id, size, profile_name):
+        """Create a new volume with a storage profile on the array."""
+        return self._defer(self._sync.create_volume_with_profile,
+                           dataset_id, size, profile_name)
+
+    def destroy_volume(self, blockdevice_id):
+        """Destroy an existing volume."""
+        return self._defer(self._sync.destroy_volume, blockdevice_id)
+
+    def create_volumes(self, volumes, max_workers=None):
+        """Create several new volumes on the array."""
+        return self._defer(self._sync.create_volumes, volumes, max_workers)
+
+    def destroy_volumes(self, blockdevice_ids, max_workers=None):
+        """Destroy several existing volumes."""
+        return self._defer(self._sync.destroy_volumes, blockdevice_ids,
+                           max_workers)
+
+    def detach_volume(self, blockdevice_id):
+        """Detach ``blockdevice_id`` from whatever host it is attached to.
+
+        Runs on the device pool as it waits for the local devices to be
+        removed.
+        """
+        return self._defer_device(self._sync.detach_volume, blockdevice_id)
+
+    def resize_volume(self, blockdevice_id, size):
+        """Resize an existing volume."""
+        return self._defer(self._sync.resize_volume, blockdevice_id, size)
+
+    def get_device_path(self, blockdevice_id):
+        """Return the device path.
+
+        Runs on the device pool as it may wait for the device to show up.
+        """
+        return self._defer_device(self._sync.get_device_path,
+                                  blockdevice_id)
+
+    @defer.inlineCallbacks
+    def attach_volume(self, blockdevice_id, attach_to):
+        """Attach an existing volume to an initiator.
+
+        The volume and server lookups run concurrently.  Once the volume is
+        known to exist the iSCSI portal logins run on the device pool while
+        the volume is mapped.  Device discovery is left running for
+        ``get_device_path``.
+
+        See ``DellStorageCenterBlockDeviceAPI.attach_volume``.
+        """
+        LOG.info('Attaching %s to %s', blockdevice_id, attach_to)
+        scvolume, mappings, host = yield self._defer(
+            self._sync._find_for_attach, blockdevice_id)
+
+        login = self._defer_device(self._sync._login_ports)
+        try:
+            # Functional tests expect a failure if it's already
+            # attached, even if we're being asked to attach to
+            # the same host.
+            scvolume, host = yield self._defer(
+                self._sync._map_volume, blockdevice_id, scvolume, mappings,
+                host, attach_to, True)
+        except Exception:
+            error = failure.Failure()
+            # Let the logins finish before the failure is reported.
+            yield login.addErrback(lambda _: None)
+            error.raiseException()
+
+        try:
+            yield login
+        except Exception:
+            error = failure.Failure()
+            yield self._defer(self._sync._unmap_volume, blockdevice_id,
+                              scvolume, host)
+            error.raiseException()
+
+        volume = yield self._defer(self._sync._finish_attach,
+                                   blockdevice_id, scvolume, attach_to)
+        defer.returnValue(volume)
+
+    def list_volumes(self):
+        """List all the block devices available via the back end API.
+
+        See ``DellStorageCenterBlockDeviceAPI.list_volumes``.
+
+        :returns: A ``Deferred`` firing with a ``list`` of
+                  ``BlockDeviceVolume``s.
+        """
+        return self._defer(self._sync.list_volumes)
+
+
+FLOCKER_BACKEND = node.BackendDescription(
+    # Name isn't actually used for 3rd party plugins
+    name=DRIVER_NAME,
+    needs_reactor=True,
+    needs_cluster_id=True,
+    api_factory=create_async_driver_instance,
+    deployer_type=node.DeployerType.block)
@@ -13,24 +13,36 @@
 #    under the License.
 """The Dell Storage Center Block Device Driver."""
 
+import collections
 import logging
+import os
 import platform
+import sys
 import threading
-import time
 import uuid
 
 import bitmath
 import eliot
 from flocker.node.agents import blockdevice
+import six
 from twisted.python import filepath
 from zope.interface import implementer
 
+import concurrency
 import dell_storagecenter_api
 import iscsi_utils
+import metrics
+import warm_pool
 
 
 LOG = logging.getLogger(__name__)
 ALLOCATION_UNIT = bitmath.GiB(1).bytes
+# Attach and detach requests go to the Enterprise Manager ahead of reads,
+# and volume listings last.
+ATTACH_PRIORITY = dell_storagecenter_api.PRIORITY_CRITICAL
+LIST_PRIORITY = dell_storagecenter_api.PRIORITY_BACKGROUND
+# Seconds to wait for a snapshot refresh in progress when closing.
+SNAPSHOT_STOP_TIMEOUT = 30
 
 
 class DellStorageCenterBlockDriverLogHandler(logging.Handler):
@@ -69,6 +81,140 @@ class BlockDriverAPIException(Exception):
     """General backend API exception."""
 
 
+class VolumeSnapshot(object):
+    """Last known list of our volumes, refreshed in the background.
+
+    Lets ``list_volumes`` answer without waiting on the array.  A worker
+    thread replaces the snapshot with a full listing every ``interval``
+    seconds, and the driver's own creates, deletes, attaches, detaches and
+    resizes patch it as they complete so callers always see their own
+    changes.  Changes made while a listing is in flight are applied on top
+    of that listing when it arrives.
+    """
+
+    def __init__(self, refresh, interval=0):
+        """Create a new snapshot.
+
+        :param refresh: Callable returning a full list of
+                        ``BlockDeviceVolume``s.
+        :param interval: Seconds between refreshes.  The snapshot is
+                         disabled if not positive.
+        """
+        self.enabled = interval > 0
+        self.interval = interval
+        self._refresh = refresh
+        self._volumes = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the background refresh thread."""
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='volume_snapshot')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=SNAPSHOT_STOP_TIMEOUT):
+        """Stops the background refresh thread.
+
+        :param timeout: Seconds to wait for a refresh in progress.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                LOG.warning('Volume snapshot refresh still running.')
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                LOG.exception('Error refreshing the volume snapshot.')
+            self._stopped.wait(self.interval)
+
+    def refresh(self):
+        """Replaces the snapshot with a full listing from the array."""
+        with self._refresh_lock:
+            with self._lock:
+                self._pending = collections.OrderedDict()
+            try:
+                volumes = self._refresh()
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                snapshot = collections.OrderedDict(
+                    (volume.blockdevice_id, volume) for volume in volumes)
+                for blockdevice_id, volume in self._pending.items():
+                    if volume is None:
+                        snapshot.pop(blockdevice_id, None)
+                    else:
+                        snapshot[blockdevice_id] = volume
+                self._volumes = snapshot
+                self._pending = None
+
+    def volumes(self):
+        """Gets the volumes in the snapshot.
+
+        :returns: A ``list`` of ``BlockDeviceVolume``s, or None if there is
+                  no snapshot yet.
+        """
+        with self._lock:
+            if self._volumes is None:
+                return None
+            return list(self._volumes.values())
+
+    def _patch(self, blockdevice_id, volume):
+        with self._lock:
+            if self._volumes is not None:
+                if volume is None:
+                    self._volumes.pop(blockdevice_id, None)
+                else:
+                    self._volumes[blockdevice_id] = volume
+            if self._pending is not None:
+                self._pending[blockdevice_id] = volume
+
+    def put(self, volume):
+        """Adds or replaces a volume.
+
+        :param volume: The new ``BlockDeviceVolume``.
+        """
+        if self.enabled:
+            self._patch(volume.blockdevice_id, volume)
+
+    def remove(self, blockdevice_id):
+        """Removes a volume that was destroyed.
+
+        :param blockdevice_id: The volume unique ID.
+        """
+        if self.enabled:
+            self._patch(blockdevice_id, None)
+
+    def update(self, blockdevice_id, **changes):
+        """Changes attributes of a volume in the snapshot.
+
+        :param blockdevice_id: The volume unique ID.
+        :param changes: The ``BlockDeviceVolume`` attributes to set.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            volume = None
+            if self._volumes is not None:
+                volume = self._volumes.get(blockdevice_id)
+            if self._pending is not None:
+                volume = self._pending.get(blockdevice_id, volume)
+        if volume is not None:
+            self._patch(blockdevice_id, volume.set(**changes))
+
+
 @implementer(blockdevice.IBlockDeviceAPI)
 @implementer(blockdevice.IProfiledBlockDeviceAPI)
 class DellStorageCenterBlockDeviceAPI(object):
@@ -92,22 +238,113 @@ class DellStorageCenterBlockDeviceAPI(object):
         self.configuration = kwargs
         self._client = dell_storagecenter_api.StorageCenterApiHelper(
             kwargs)
+        self._device_timeout = int(kwargs.get(
+            'device_wait_timeout', iscsi_utils.DEFAULT_DEVICE_TIMEOUT))
+        self._rescan_mode = kwargs.get('rescan_mode', 'targeted')
+        self._max_workers = int(kwargs.get(
+            'max_parallel_requests', concurrency.DEFAULT_MAX_WORKERS))
+        # Device discovery started by attach_volume, by blockdevice_id.
+        self._discoveries = {}
+        self._discoveries_lock = threading.Lock()
+        # Concurrent identical lookups share a single request.  Lookups
+        # only share requests started since the last change we made, so a
+        # caller always sees its own changes.
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        self._list_flight = concurrency.SingleFlight('list_volumes',
+                                                     metrics.REGISTRY)
+        self._find_flight = concurrency.SingleFlight('find_volume',
+                                                     metrics.REGISTRY)
+        self._snapshot = VolumeSnapshot(
+            self._list_volumes,
+            float(kwargs.get('volume_snapshot_interval', 0)))
+        self._snapshot.start()
+        self._pool = None
+        if int(kwargs.get('warm_pool_size', 0)) > 0:
+            self._pool = warm_pool.WarmPool(
+                kwargs,
+                self.compute_instance_id(),
+                int(kwargs['warm_pool_size']),
+                kwargs.get('warm_pool_profiles'),
+                kwargs.get('warm_pool_folder', warm_pool.DEFAULT_FOLDER),
+                int(kwargs.get('warm_pool_volume_size',
+                               warm_pool.DEFAULT_VOLUME_SIZE)),
+                kwargs.get('warm_pool_init', False))
+            self._pool.start()
+        iscsi_utils.configure_exec(
+            int(kwargs.get('command_timeout',
+                           iscsi_utils.DEFAULT_EXEC_TIMEOUT)),
+            int(kwargs.get('max_parallel_commands',
+                           iscsi_utils.DEFAULT_MAX_COMMANDS)))
+        self._exporter = metrics.start_exporter(
+            metrics.REGISTRY,
+            int(kwargs.get('metrics_interval', 60)),
+            kwargs.get('metrics_file'),
+            kwargs.get('metrics_eliot', False))
+
+    def close(self):
+        """Stops the background work and logs out of the array."""
+        self._snapshot.stop()
+        if self._pool is not None:
+            self._pool.close()
+        if self._exporter is not None:
+            self._exporter.stop()
+        self._client.close()
 
     def _to_blockdevicevolume(self, scvolume, attached_to=None):
-        """Converts our API volume to a ``BlockDeviceVolume``."""
+        """Converts our API ``VolumeRecord`` to a ``BlockDeviceVolume``."""
         dataset_id = uuid.UUID('{00000000-0000-0000-0000-000000000000}')
         try:
-            dataset_id = uuid.UUID("{%s}" % scvolume.get('name'))
+            dataset_id = uuid.UUID("{%s}" % scvolume.name)
         except ValueError:
             pass
         retval = blockdevice.BlockDeviceVolume(
-            blockdevice_id=scvolume.get('name'),
-            size=int(
-                float(scvolume.get('configuredSize').replace(' Bytes', ''))),
+            blockdevice_id=scvolume.name,
+            size=scvolume.size,
             attached_to=attached_to,
             dataset_id=dataset_id)
         return retval
 
+    def _refresh_volume(self, api, blockdevice_id):
+        """Looks a volume up on the array, bypassing the volume index.
+
+        Called when a request made with an indexed volume did not work out
+        in case the index was stale.
+
+        :param api: The open ``StorageCenterApi`` connection.
+        :param blockdevice_id: The volume unique ID.
+        :raises UnknownVolume: If the volume does not exist on the array.
+        :returns: The ``VolumeRecord`` from the array.
+        """
+        scvolume = api.refresh_volume(blockdevice_id)
+        if not scvolume:
+            raise blockdevice.UnknownVolume(blockdevice_id)
+        return scvolume
+
+    def _find_volume(self, api, blockdevice_id):
+        """Looks up a volume, sharing any identical lookup in progress.
+
+        :param api: The open ``StorageCenterApi`` connection.
+        :param blockdevice_id: The volume unique ID.
+        :returns: The ``VolumeRecord`` or None if it was not found.
+        """
+        return self._find_flight.do((self._generation, blockdevice_id),
+                                    api.find_volume, blockdevice_id)
+
+    def _changed(self):
+        """Records that we changed a volume, see ``_generation``."""
+        with self._generation_lock:
+            self._generation += 1
+
+    def single_flight_stats(self):
+        """Gets the counters of lookups shared between concurrent callers.
+
+        :returns: A dict of operation name to a dict with the number of
+                  ``calls`` made and the number of calls ``coalesced``.
+        """
+        return {'list_volumes': self._list_flight.stats(),
+                'find_volume': self._find_flight.stats()}
+
     def allocation_unit(self):
         """Gets the minimum allocation unit for our backend.
 
@@ -157,34 +394,110 @@ class DellStorageCenterBlockDeviceAPI(object):
         scvolume = None
         with self._client.open_connection() as api:
             try:
-                scvolume = api.create_volume(volume_name,
-                                             volume_size,
-                                             profile_name)
+                if self._pool is not None:
+                    # Hand out a pre-created volume if there is one.
+                    scvolume = self._pool.claim(api, volume_name,
+                                                volume_size, profile_name)
+                if not scvolume:
+                    scvolume = api.create_volume(volume_name,
+                                                 volume_size,
+                                                 profile_name)
             except Exception:
                 LOG.exception('Error creating volume.')
                 raise
-        return self._to_blockdevicevolume(scvolume)
+        volume = self._to_blockdevicevolume(scvolume)
+        self._changed()
+        self._snapshot.put(volume)
+        return volume
+
+    def create_volumes(self, volumes, max_workers=None):
+        """Create several new volumes on the array.
+
+        The volume folder and storage profiles are looked up once and the
+        volumes are created concurrently.
+
+        :param volumes: A list of (dataset_id, size) or (dataset_id, size,
+                        profile_name) tuples, with the size in bytes.
+        :param max_workers: The maximum number of concurrent creates, by
+                            default ``max_parallel_requests``.
+        :return: A list of (``BlockDeviceVolume``, exception) tuples in the
+                 same order as ``volumes``.  The exception is None for each
+                 volume that was created.
+        """
+        requests = [(u"%s" % volume[0],
+                     self._bytes_to_gig(volume[1]),
+                     volume[2] if len(volume) > 2 else None)
+                    for volume in volumes]
+        with self._client.open_connection() as api:
+            results = api.create_volumes(requests, max_workers)
+        self._changed()
+        blockdevicevolumes = []
+        for scvolume, error in results:
+            if error is None and not scvolume:
+                error = BlockDriverAPIException('Unable to create volume.')
+            if error is not None:
+                LOG.error('Error creating volume: %s', error)
+                blockdevicevolumes.append((None, error))
+            else:
+                volume = self._to_blockdevicevolume(scvolume)
+                self._snapshot.put(volume)
+                blockdevicevolumes.append((volume, None))
+        return blockdevicevolumes
 
     def destroy_volume(self, blockdevice_id):
         """Destroy an existing volume.
 
+        :param blockdevice_id: The volume unique ID.
+        """
+        with self._client.open_connection() as api:
+            self._destroy_volume(api, blockdevice_id)
+
+    def destroy_volumes(self, blockdevice_ids, max_workers=None):
+        """Destroy several existing volumes concurrently.
+
+        :param blockdevice_ids: The volume unique IDs.
+        :param max_workers: The maximum number of concurrent deletes, by
+                            default ``max_parallel_requests``.
+        :return: A list of exceptions in the same order as
+                 ``blockdevice_ids``.  Each is None if that volume was
+                 destroyed.
+        """
+        # Each delete uses its own connection, connections are not shared
+        # between threads.
+        results = concurrency.parallel_results(
+            self.destroy_volume,
+            blockdevice_ids,
+            max_workers or self._max_workers)
+        return [error for _, error in results]
+
+    def _destroy_volume(self, api, blockdevice_id):
+        """Destroys an existing volume using an open connection.
+
+        :param api: The open ``StorageCenterApi`` connection.
         :param blockdevice_id: The volume unique ID.
         """
         deleted = False
         LOG.info('Destroying volume %s', blockdevice_id)
-        with self._client.open_connection() as api:
+        self._forget_discovery(blockdevice_id)
+        try:
+            volume = self._find_volume(api, blockdevice_id)
+            if not volume:
+                raise blockdevice.UnknownVolume(blockdevice_id)
             try:
-                volume = api.find_volume(blockdevice_id)
-                if not volume:
-                    raise blockdevice.UnknownVolume(blockdevice_id)
                 deleted = api.delete_volume(blockdevice_id)
             except Exception:
-                # TODO(smcginnis) Catch more specific exception
-                LOG.exception('Error destroying volume.')
-                raise
+                # Our volume index may be out of date, check the array.
+                self._refresh_volume(api, blockdevice_id)
+                deleted = api.delete_volume(blockdevice_id)
+        except Exception:
+            # TODO(smcginnis) Catch more specific exception
+            LOG.exception('Error destroying volume.')
+            raise
         if not deleted:
             # Something happened
             raise BlockDriverAPIException('Unable to delete volume.')
+        self._changed()
+        self._snapshot.remove(blockdevice_id)
 
     def _do_rescan(self, process):
         """Performs a SCSI rescan on this host."""
@@ -193,6 +506,177 @@ class DellStorageCenterBlockDeviceAPI(object):
         rescan_thread.daemon = True
         rescan_thread.start()
 
+    def _rescan_targets(self, api, scvolume):
+        """Gets the (target IQN, LUN) tuples to rescan for a volume.
+
+        :param api: The open ``StorageCenterApi`` connection.
+        :param scvolume: The ``VolumeRecord`` that was mapped.
+        :returns: A list of tuples, or None if all sessions should be
+                  rescanned.
+        """
+        if self._rescan_mode == 'full':
+            return None
+        try:
+            props = api.find_iscsi_properties(scvolume)
+            return list(zip(props['target_iqns'], props['target_luns']))
+        except Exception:
+            LOG.exception('Unable to find iSCSI targets for %s, '
+                          'rescanning all sessions.', scvolume.name)
+        return None
+
+    def _discover_device(self, scvolume):
+        """Rescans for a newly mapped volume and waits for its paths.
+
+        :param scvolume: The ``VolumeRecord`` that was mapped.
+        :returns: The local paths of the volume, as from
+                  ``iscsi_utils.wait_for_paths``.
+        """
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            targets = self._rescan_targets(api, scvolume)
+        if targets:
+            iscsi_utils.rescan_luns(targets)
+        else:
+            iscsi_utils.rescan_iscsi()
+        return iscsi_utils.wait_for_paths(scvolume.device_id,
+                                          self._device_timeout)
+
+    def _start_discovery(self, blockdevice_id, scvolume):
+        """Starts looking for the device of a newly mapped volume.
+
+        ``get_device_path`` picks up the result instead of polling for the
+        device from scratch.
+
+        :param blockdevice_id: The volume unique ID.
+        :param scvolume: The ``VolumeRecord`` that was mapped.
+        """
+        discovery = concurrency.Task(self._discover_device, scvolume)
+        with self._discoveries_lock:
+            self._discoveries[blockdevice_id] = discovery
+
+    def _forget_discovery(self, blockdevice_id):
+        """Drops the device discovery for a volume that is going away."""
+        with self._discoveries_lock:
+            self._discoveries.pop(blockdevice_id, None)
+
+    def _discovered_path(self, blockdevice_id):
+        """Gets the device path found by an attach's device discovery.
+
+        :param blockdevice_id: The volume unique ID.
+        :returns: A (path, timed_out) tuple.  The path is None if there was
+                  no discovery for the volume or it did not find the device,
+                  and timed_out is True if the discovery already waited the
+                  full ``device_wait_timeout`` for the device.
+        """
+        with self._discoveries_lock:
+            discovery = self._discoveries.get(blockdevice_id)
+        if discovery is None:
+            return None, False
+        if not discovery.wait(self._device_timeout):
+            return None, True
+        try:
+            paths = discovery.result()
+        except Exception:
+            LOG.exception('Device discovery for %s failed.', blockdevice_id)
+            return None, False
+        if not paths:
+            return None, True
+        if os.path.exists(paths[0]):
+            return paths[0], False
+        return None, False
+
+    def _find_volume_and_mappings(self, blockdevice_id):
+        """Looks up a volume and, if it exists, its mapping profiles."""
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            scvolume = self._find_volume(api, blockdevice_id)
+            mappings = []
+            if scvolume:
+                mappings = api.find_mapping_profiles(scvolume)
+        return scvolume, mappings
+
+    def _find_server(self):
+        """Looks up the server object for this host."""
+        iqn = iscsi_utils.get_initiator_name()
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            host = api.find_server(iqn)
+        LOG.info("Search for server returned: %s", host)
+        return host
+
+    def _create_server(self, attach_to):
+        """Creates the server object for this host."""
+        iqn = iscsi_utils.get_initiator_name()
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            host = api.create_server(attach_to, iqn)
+        LOG.info("Created server %s", host)
+        return host
+
+    def _login_ports(self):
+        """Makes sure this host is logged in to all the array's ports."""
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            ports = api.get_iscsi_ports()
+            max_workers = api.max_workers
+        iscsi_utils.iscsi_login_all(ports, max_workers)
+
+    def _find_for_attach(self, blockdevice_id):
+        """Looks up a volume to attach and the server object for this host.
+
+        The volume and server lookups run concurrently.
+
+        :param blockdevice_id: The volume unique ID.
+        :raises UnknownVolume: If the volume does not exist.
+        :returns: The ``VolumeRecord``, its mapping profiles and the server
+                  object, which is None if this host has none yet.
+        """
+        (scvolume, mappings), host = concurrency.parallel_map(
+            lambda lookup: lookup(),
+            [lambda: self._find_volume_and_mappings(blockdevice_id),
+             self._find_server],
+            2)
+
+        # Check that we have that volume
+        if not scvolume:
+            raise blockdevice.UnknownVolume(blockdevice_id)
+        return scvolume, mappings, host
+
+    def _map_volume(self, blockdevice_id, scvolume, mappings, host,
+                    attach_to, not_local):
+        """Maps a volume to the server object for this host.
+
+        :param blockdevice_id: The volume unique ID.
+        :param scvolume: The ``VolumeRecord`` to map.
+        :param mappings: The volume's current mapping profiles.
+        :param host: The server object for this host, or None to create it.
+        :param attach_to: The compute instance ID of this host.
+        :param not_local: Whether any existing mapping is an error.
+        :returns: The mapped ``VolumeRecord`` and the server object.
+        """
+        if not host:
+            # Try to create a new host
+            host = self._create_server(attach_to)
+
+        # Make sure we were able to find something
+        if not host:
+            raise BlockDriverAPIException()
+
+        # First check if we are already mapped
+        if mappings:
+            # See if it is to this server
+            if not_local:
+                raise blockdevice.AlreadyAttachedVolume(blockdevice_id)
+            for mapping in mappings:
+                if (mapping['server']['instanceName'] !=
+                        host['instanceName']):
+                    raise blockdevice.AlreadyAttachedVolume(blockdevice_id)
+
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            mapping = api.map_volume(scvolume, host)
+            if not mapping:
+                # Our volume index may be out of date, check the array.
+                scvolume = self._refresh_volume(api, blockdevice_id)
+                mapping = api.map_volume(scvolume, host)
+        if not mapping:
+            raise BlockDriverAPIException('Unable to map volume to server.')
+        return scvolume, host
+
     def attach_volume(self, blockdevice_id, attach_to):
         """Attach an existing volume to an initiator.
 
@@ -201,6 +685,12 @@ class DellStorageCenterBlockDeviceAPI(object):
             ``compute_instance_id`` method indicating the node to which to
             attach the volume.
 
+        The volume and server lookups run concurrently.  Once the volume is
+        known to exist the iSCSI portal logins run in the background while
+        the volume is mapped.
+        Device discovery is then started for ``get_device_path`` to pick
+        up, so the attach does not wait for the device to show up.
+
         :raises UnknownVolume: If the supplied ``blockdevice_id`` does not
             exist.
         :returns: A ``BlockDeviceVolume`` with a ``attached_to`` attribute set
@@ -214,48 +704,48 @@ class DellStorageCenterBlockDeviceAPI(object):
         # not_local = attach_to != self.compute_instance_id()
         not_local = True
 
-        with self._client.open_connection() as api:
-            # Check that we have that volume
-            scvolume = api.find_volume(blockdevice_id)
-            if not scvolume:
-                raise blockdevice.UnknownVolume(blockdevice_id)
+        scvolume, mappings, host = self._find_for_attach(blockdevice_id)
 
-            # Make sure we have a server defined for this host
-            iqn = iscsi_utils.get_initiator_name()
-            host = api.find_server(iqn)
-            LOG.info("Search for server returned: %s", host)
-            if not host:
-                # Try to create a new host
-                host = api.create_server(attach_to, iqn)
-                LOG.info("Created server %s", host)
-            # Make sure the server is logged in to the array
-            ports = api.get_iscsi_ports()
-            for port in ports:
-                iscsi_utils.iscsi_login(port[0], port[1])
+        # Make sure the server is logged in to the array
+        login = concurrency.Task(self._login_ports)
+        try:
+            scvolume, host = self._map_volume(blockdevice_id, scvolume,
+                                              mappings, host, attach_to,
+                                              not_local)
+        except Exception:
+            # Let the logins finish before the failure is reported.
+            login.wait()
+            raise
 
-            # Make sure we were able to find something
-            if not host:
-                raise BlockDriverAPIException()
+        try:
+            login.result()
+        except Exception:
+            exc_info = sys.exc_info()
+            self._unmap_volume(blockdevice_id, scvolume, host)
+            six.reraise(*exc_info)
 
-            # First check if we are already mapped
-            mappings = api.find_mapping_profiles(scvolume)
-            if mappings:
-                # See if it is to this server
-                if not_local:
-                    raise blockdevice.AlreadyAttachedVolume(blockdevice_id)
-                for mapping in mappings:
-                    if (mapping['server']['instanceName'] !=
-                            host['instanceName']):
-                        raise blockdevice.AlreadyAttachedVolume(blockdevice_id)
+        return self._finish_attach(blockdevice_id, scvolume, attach_to)
 
-            mapping = api.map_volume(scvolume, host)
-            if not mapping:
-                raise BlockDriverAPIException(
-                    'Unable to map volume to server.')
+    def _unmap_volume(self, blockdevice_id, scvolume, host):
+        """Undoes the mapping of an attach whose portal logins failed."""
+        LOG.error('Unable to log in to the array, unmapping %s.',
+                  blockdevice_id)
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
+            api.unmap_volume(scvolume, host)
 
-            self._do_rescan('attach')
+    def _finish_attach(self, blockdevice_id, scvolume, attach_to):
+        """Starts device discovery for a mapped volume and records it.
 
-            return self._to_blockdevicevolume(scvolume, attach_to)
+        :param blockdevice_id: The volume unique ID.
+        :param scvolume: The mapped ``VolumeRecord``.
+        :param attach_to: The compute instance ID of this host.
+        :returns: The attached ``BlockDeviceVolume``.
+        """
+        self._start_discovery(blockdevice_id, scvolume)
+        volume = self._to_blockdevicevolume(scvolume, attach_to)
+        self._changed()
+        self._snapshot.put(volume)
+        return volume
 
     def detach_volume(self, blockdevice_id):
         """Detach ``blockdevice_id`` from whatever host it is attached to.
@@ -269,23 +759,27 @@ class DellStorageCenterBlockDeviceAPI(object):
         :returns: ``None``
         """
         LOG.info('Detaching %s', blockdevice_id)
+        self._forget_discovery(blockdevice_id)
 
-        with self._client.open_connection() as api:
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
             # Check that we have that volume
-            scvolume = api.find_volume(blockdevice_id)
+            scvolume = self._find_volume(api, blockdevice_id)
             if not scvolume:
                 raise blockdevice.UnknownVolume(blockdevice_id)
 
             # First check if we are mapped
             mappings = api.find_mapping_profiles(scvolume)
+            if not mappings:
+                # Make sure our volume index was not out of date.
+                scvolume = self._refresh_volume(api, blockdevice_id)
+                mappings = api.find_mapping_profiles(scvolume)
             if not mappings:
                 raise blockdevice.UnattachedVolume(blockdevice_id)
 
-            device_id = scvolume['deviceId']
-            paths = iscsi_utils.find_paths(device_id)
-            paths.reverse()
-            for path in paths:
-                iscsi_utils.remove_device(path)
+            device_id = scvolume.device_id
+            iscsi_utils.remove_devices(iscsi_utils.find_paths(device_id),
+                                       self._device_timeout,
+                                       api.max_workers)
 
             # Make sure we have a server defined for this host
             iqn = iscsi_utils.get_initiator_name()
@@ -302,23 +796,45 @@ class DellStorageCenterBlockDeviceAPI(object):
                 raise BlockDriverAPIException('Unable to locate server.')
 
             api.unmap_volume(scvolume, host)
+        self._changed()
+        self._snapshot.update(blockdevice_id, attached_to=None)
         self._do_rescan('detach')
 
     def list_volumes(self):
         """List all the block devices available via the back end API.
 
+        Callers that ask while a listing is already in progress wait for
+        and share its result, unless this driver changed a volume since
+        that listing started.  If ``volume_snapshot_interval`` is set the
+        background snapshot is returned instead of asking the array.
+
+        :returns: A ``list`` of ``BlockDeviceVolume``s.
+        """
+        if self._snapshot.enabled:
+            volumes = self._snapshot.volumes()
+            if volumes is None:
+                self._snapshot.refresh()
+                volumes = self._snapshot.volumes()
+            return volumes
+        return list(self._list_flight.do(self._generation,
+                                         self._list_volumes))
+
+    def _list_volumes(self):
+        """Lists all the block devices from the back end API.
+
         :returns: A ``list`` of ``BlockDeviceVolume``s.
         """
         volumes = []
 
         try:
-            with self._client.open_connection() as api:
+            with self._client.open_connection(LIST_PRIORITY) as api:
                 vols = api.list_volumes()
+                all_mappings = api.find_mapping_profiles_for_volumes(vols)
 
                 # Now convert our API objects to flocker ones
                 for vol in vols:
                     attached_to = None
-                    mappings = api.find_mapping_profiles(vol)
+                    mappings = all_mappings.get(vol.instance_id)
                     if mappings:
                         attached_to = mappings[0]['server']['instanceName']
                     volumes.append(
@@ -342,36 +858,42 @@ class DellStorageCenterBlockDeviceAPI(object):
             not attached to a host.
         :returns: A ``FilePath`` for the device.
         """
+        # A volume attached by this driver already has its device
+        # discovery running, pick up its result.
+        path, timed_out = self._discovered_path(blockdevice_id)
+        if path:
+            return filepath.FilePath(path).realpath()
+
         device_id = None
-        with self._client.open_connection() as api:
+        with self._client.open_connection(ATTACH_PRIORITY) as api:
             # Check that we have that volume
-            volume = api.find_volume(blockdevice_id)
-            if not volume:
+            scvolume = self._find_volume(api, blockdevice_id)
+            if not scvolume:
                 raise blockdevice.UnknownVolume(blockdevice_id)
-
-            scvolume = api.find_volume(blockdevice_id)
-            device_id = scvolume['deviceId']
+            device_id = scvolume.device_id
 
             # First check if we are mapped
             # NOTE: The assumption right now is if we are mapped,
             # we are mapped to the local compute host.
             mappings = api.find_mapping_profiles(scvolume)
+            if not mappings:
+                # Make sure our volume index was not out of date.
+                scvolume = self._refresh_volume(api, blockdevice_id)
+                device_id = scvolume.device_id
+                mappings = api.find_mapping_profiles(scvolume)
             if not mappings:
                 raise blockdevice.UnattachedVolume(blockdevice_id)
 
         if not device_id:
             raise blockdevice.UnknownVolume(blockdevice_id)
 
-        # Look for any new devices
-        retries = 0
-        while retries < 4:
-            paths = iscsi_utils.find_paths(device_id)
-            if paths:
-                # Just return the first path
-                return filepath.FilePath(paths[0]).realpath()
-            retries += 1
-            LOG.info('%s not found, attempt %d', device_id, retries)
-            time.sleep(5)
+        # Wait for the device to show up, unless the discovery already
+        # waited for it.
+        paths = iscsi_utils.wait_for_paths(
+            device_id, 0 if timed_out else self._device_timeout)
+        if paths:
+            # Just return the first path
+            return filepath.FilePath(paths[0]).realpath()
         return None
 
     def resize_volume(self, blockdevice_id, size):
@@ -385,13 +907,20 @@ class DellStorageCenterBlockDeviceAPI(object):
         """
         with self._client.open_connection() as api:
             # Check that we have that volume
-            scvolume = api.find_volume(blockdevice_id)
+            scvolume = self._find_volume(api, blockdevice_id)
             if not scvolume:
                 raise blockdevice.UnknownVolume(blockdevice_id)
 
             volume_size = self._bytes_to_gig(size)
-            if not api.expand_volume(scvolume, volume_size):
-                raise blockdevice.VolumeException(blockdevice_id)
+            expanded = api.expand_volume(scvolume, volume_size)
+            if not expanded:
+                # Our volume index may be out of date, check the array.
+                scvolume = self._refresh_volume(api, blockdevice_id)
+                expanded = api.expand_volume(scvolume, volume_size)
+                if not expanded:
+                    raise blockdevice.VolumeException(blockdevice_id)
+        self._changed()
+        self._snapshot.update(blockdevice_id, size=expanded.size)
 
     def _bytes_to_gig(self, size):
         """Convert size in bytes to GiB.
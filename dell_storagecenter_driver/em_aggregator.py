@@ -0,0 +1,367 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Node-local aggregator for Enterprise Manager requests.
+
+Every agent and tool on a node normally logs in to the Enterprise Manager
+on its own.  ``AggregatorServer`` runs once per node and listens on a Unix
+socket.  It sends the REST requests of all the local clients over its own
+pooled, logged in sessions:
+
+* Client logins, logouts and keepalives are answered by the daemon and
+  never reach the Enterprise Manager.
+* Identical reads (``GET`` and ``GetList`` requests) that are in flight at
+  the same time are sent once and the response is shared.
+* Read responses are cached for ``cache_ttl`` seconds.  Any other request
+  is forwarded as is and empties the cache both when it is sent and when
+  it completes.  Reads that overlap such a request are not cached.
+
+Clients are not asked for the Enterprise Manager credentials, so access is
+limited to the socket: it is created readable and writable by its owner
+only, and connections from other users than root and the daemon's are
+refused.
+
+A ``StorageCenterApiHelper`` configured with ``aggregator_socket`` sends its
+requests to the daemon through an ``AggregatorAdapter``.  Run this module
+to start the daemon with the settings of the agent configuration::
+
+    python em_aggregator.py --config /etc/flocker/agent.yml
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+import requests
+from requests import adapters
+from six.moves import socketserver
+
+import concurrency
+import metrics
+
+
+DEFAULT_SOCKET = '/var/run/dell_sc_aggregator.sock'
+DEFAULT_CACHE_TTL = 5
+DEFAULT_TIMEOUT = 300
+# SO_PEERCRED from <asm-generic/socket.h>, Python 2 does not define it.
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+# struct ucred from <sys/socket.h>
+UCRED = struct.Struct('3i')
+LOG = logging.getLogger(__name__)
+
+
+def _send_message(sock, message):
+    """Writes a JSON message and ends the sending side of the socket."""
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    sock.shutdown(socket.SHUT_WR)
+
+
+def _peer_uid(sock):
+    """Gets the user ID of the process at the other end of a Unix socket."""
+    ucred = sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, UCRED.size)
+    return UCRED.unpack(ucred)[1]
+
+
+def _read_message(sock):
+    """Reads a JSON message up to the end of the socket."""
+    chunks = []
+    while True:
+        chunk = sock.recv(io.DEFAULT_BUFFER_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+class AggregatorAdapter(adapters.BaseAdapter):
+    """``requests`` transport adapter sending requests to the aggregator."""
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=DEFAULT_TIMEOUT):
+        """Create a new adapter.
+
+        :param path: The aggregator's Unix socket.
+        :param timeout: Seconds to wait for a response.
+        """
+        super(AggregatorAdapter, self).__init__()
+        self.path = path
+        self.timeout = timeout
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        """Sends a prepared request through the aggregator."""
+        url = request.path_url.split('/api/rest/', 1)[-1]
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            _send_message(sock, {'method': request.method,
+                                 'url': url,
+                                 'body': body})
+            reply = _read_message(sock)
+        except (socket.error, ValueError) as e:
+            raise requests.exceptions.ConnectionError(
+                'Error talking to the aggregator at %s: %s' % (self.path, e),
+                request=request)
+        finally:
+            sock.close()
+
+        content = (reply['content'] or u'').encode('utf-8')
+        response = requests.Response()
+        response.status_code = reply['status']
+        response.reason = reply['reason']
+        response.headers['Content-Type'] = 'application/json'
+        response.headers['Content-Length'] = str(len(content))
+        response.encoding = 'utf-8'
+        response.raw = io.BytesIO(content)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        """Nothing to clean up, each request uses its own socket."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers one client request."""
+
+    def handle(self):
+        try:
+            message = _read_message(self.request)
+            status, reason, content = self.server.aggregator.handle(
+                message['method'], message['url'], message.get('body'))
+        except Exception as e:
+            LOG.exception('Error handling aggregator request.')
+            status, reason, content = 502, 'Bad Gateway', u'%s' % e
+        try:
+            _send_message(self.request, {'status': status,
+                                         'reason': reason,
+                                         'content': content})
+        except socket.error:
+            LOG.debug('Client went away.', exc_info=True)
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def verify_request(self, request, client_address):
+        uid = _peer_uid(request)
+        if uid in self.aggregator.allowed_uids:
+            return True
+        LOG.warning('Refusing aggregator client of user %d.', uid)
+        return False
+
+
+class AggregatorServer(object):
+    """Serves the Enterprise Manager requests of all clients on a node."""
+
+    def __init__(self, helper, path=DEFAULT_SOCKET,
+                 cache_ttl=DEFAULT_CACHE_TTL, allowed_uids=None):
+        """Create a new aggregator.
+
+        :param helper: The ``StorageCenterApiHelper`` whose pooled sessions
+                       requests are forwarded on.
+        :param path: The Unix socket to listen on.
+        :param cache_ttl: Seconds to cache read responses, 0 to disable.
+        :param allowed_uids: The user IDs allowed to connect.  By default
+                             root and the user running the daemon.
+        """
+        self.helper = helper
+        self.path = path
+        self.cache_ttl = cache_ttl
+        if allowed_uids is None:
+            allowed_uids = (0, os.getuid())
+        self.allowed_uids = set(allowed_uids)
+        self.forwarded = 0
+        self.cached = 0
+        self._api_version = None
+        self._generation = 0
+        self._writes = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._flight = concurrency.SingleFlight('em_aggregator',
+                                                metrics.REGISTRY)
+        self._server = None
+
+    def start(self):
+        """Starts listening on a background thread."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Only the owner may ever connect, so the socket must not exist
+        # with looser permissions even for a moment.
+        umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.aggregator = self
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name='em_aggregator')
+        thread.daemon = True
+        thread.start()
+        LOG.info('Aggregating Enterprise Manager requests on %s', self.path)
+
+    def close(self):
+        """Stops listening and logs out of the pooled sessions."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            os.unlink(self.path)
+        self.helper.close()
+
+    def stats(self):
+        """Gets the request counters.
+
+        :returns: A dict with the number of requests forwarded to the
+                  Enterprise Manager, answered from the cache and answered
+                  by sharing another request's response.
+        """
+        with self._lock:
+            return {'forwarded': self.forwarded,
+                    'cached': self.cached,
+                    'coalesced': self._flight.coalesced}
+
+    def handle(self, method, url, body):
+        """Answers a client's REST request.
+
+        :param method: The HTTP method.
+        :param url: The REST url relative to the base url.
+        :param body: The JSON body as text, or None.
+        :returns: A (status, reason, content) tuple.
+        """
+        url = url.strip('/')
+        if url.startswith('ApiConnection/'):
+            return self._answer_session(method, url)
+        if method != 'GET' and not url.endswith('/GetList'):
+            # Anything else may change what the reads return.  Reads made
+            # while the change is in flight may see the state before it, so
+            # the cache is emptied again once it is done.
+            with self._lock:
+                self._writes += 1
+                self._invalidate()
+            try:
+                return self._forward(method, url, body)
+            finally:
+                with self._lock:
+                    self._writes -= 1
+                    self._invalidate()
+
+        with self._lock:
+            generation = self._generation
+            # Reads that overlap a change are never cached.
+            cacheable = self.cache_ttl > 0 and not self._writes
+            key = (method, url, body)
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.cached += 1
+                self._count('cached')
+                return entry[1]
+        # Reads that start after a change never share an older response.
+        response = self._flight.do((generation,) + key, self._forward,
+                                   method, url, body)
+        if cacheable and response[0] == 200:
+            with self._lock:
+                if self._generation == generation and not self._writes:
+                    self._store(key, response)
+        return response
+
+    def _invalidate(self):
+        """Empties the cache after a change, with the lock held."""
+        self._generation += 1
+        self._cache.clear()
+
+    def _store(self, key, response):
+        """Caches a read response, with the lock held.
+
+        Expired entries are dropped first so the cache of a daemon that
+        only ever serves reads does not keep growing.
+        """
+        now = time.time()
+        for old_key, entry in list(self._cache.items()):
+            if entry[0] <= now:
+                del self._cache[old_key]
+        self._cache[key] = (now + self.cache_ttl, response)
+
+    def _answer_session(self, method, url):
+        """Answers a client's login, logout or keepalive locally."""
+        self._count('local')
+        if url == 'ApiConnection/Logout':
+            return 204, 'No Content', None
+        if self._api_version is None:
+            with self.helper.open_connection() as api:
+                self._api_version = api.api_version
+        return 200, 'OK', json.dumps({'apiVersion': self._api_version,
+                                      'instanceId': 'ApiConnection'})
+
+    def _forward(self, method, url, body):
+        """Sends a request to the Enterprise Manager on a pooled session."""
+        with self._lock:
+            self.forwarded += 1
+        self._count('forwarded')
+        args = (url,)
+        if method in ('POST', 'PUT'):
+            args += (json.loads(body) if body else {},)
+        with self.helper.open_connection() as api:
+            r = getattr(api.client, method.lower())(*args)
+        return r.status_code, r.reason, r.text
+
+    def _count(self, result):
+        metrics.REGISTRY.increment('aggregator_requests_total',
+                                   {'result': result})
+
+
+if __name__ == "__main__":
+    import yaml
+
+    import dell_storagecenter_api
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config", "-c", help="The Flocker agent configuration file.",
+        default='/etc/flocker/agent.yml')
+    parser.add_argument(
+        "--debug", "-d", help="Log debug messages.", action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-7s [%(threadName)-19s]: %(message)s',
+        level=logging.DEBUG if args.debug else logging.INFO)
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file.read()).get('dataset', {})
+    path = config.pop('aggregator_socket', None) or DEFAULT_SOCKET
+    aggregator = AggregatorServer(
+        dell_storagecenter_api.StorageCenterApiHelper(config),
+        path,
+        int(config.get('aggregator_cache_ttl', DEFAULT_CACHE_TTL)))
+    metrics.start_exporter(metrics.REGISTRY,
+                           int(config.get('metrics_interval', 60)),
+                           config.get('metrics_file'))
+    aggregator.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.close()
@@ -0,0 +1,669 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""In-process stand-in for the Dell Enterprise Manager REST API.
+
+``EmSimulator`` keeps the volumes, servers, HBAs, mappings, folders and
+profiles of a single Storage Center in memory and answers the REST calls
+``StorageCenterApi`` makes.  Its ``adapter`` is a ``requests`` transport
+adapter, so a driver configured with ``em_adapter`` never touches the
+network::
+
+    simulator = em_simulator.EmSimulator(volumes=1000, latency=0.005)
+    api = dell_storagecenter_blockdevice.create_driver_instance(
+        cluster_id, storage_host='em', username='admin', password='x',
+        dell_sc_ssn=em_simulator.DEFAULT_SSN,
+        em_adapter=simulator.adapter())
+
+Latency and errors can be set per endpoint, using the endpoint names of
+the ``em_request`` metrics, e.g. ``StorageCenter/ScVolume/GetList`` or
+``StorageCenter/ScVolume/{id}/MapToServer``.
+
+Run this module to benchmark the API against different volume counts::
+
+    python em_simulator.py --volumes 100 1000 10000
+"""
+
+import argparse
+import io
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+
+import requests
+from requests import adapters
+
+import dell_storagecenter_api
+
+
+DEFAULT_SSN = 448
+API_VERSION = '3.1'
+DEVICE_ID_PREFIX = '6000d31000fa9e01'
+GIGABYTE = 1024 * 1024 * 1024
+STORAGE_PROFILES = ['Recommended', 'High Priority', 'Medium Priority',
+                    'Low Priority']
+SERVER_OS = ['Red Hat Linux 6.x', 'Red Hat Linux 7.x', 'Windows 2012']
+LOG = logging.getLogger(__name__)
+
+
+def _ref(obj):
+    """Gets the reference to an object embedded in other objects."""
+    return {'instanceId': obj['instanceId'],
+            'instanceName': obj.get('instanceName'),
+            'objectType': obj.get('objectType')}
+
+
+def _get_attribute(obj, name):
+    """Gets an object attribute, ignoring case like the EM does."""
+    if name in obj:
+        return obj[name]
+    name = name.lower()
+    for key, value in obj.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _matches(obj, apifilter):
+    """Checks an object against a REST filter."""
+    value = _get_attribute(obj, apifilter['attributeName'])
+    expected = apifilter['attributeValue']
+    if isinstance(value, dict):
+        value = value.get('instanceId')
+    if apifilter.get('filterType') == 'StartsWith':
+        return (value is not None and
+                (u'%s' % value).startswith(u'%s' % expected))
+    return value == expected or u'%s' % value == u'%s' % expected
+
+
+class EmSimulator(object):
+    """A simulated Enterprise Manager managing a single Storage Center."""
+
+    def __init__(self, ssn=DEFAULT_SSN, volumes=0, servers=0, mapped=0,
+                 portals=None, volume_folder='Flocker', latency=0.0,
+                 endpoint_latency=None, errors=None, error_status=500,
+                 api_version=API_VERSION, on_map=None, seed=None):
+        """Create a new simulator.
+
+        :param ssn: The Storage Center serial number.
+        :param volumes: The number of volumes to create in volume_folder.
+        :param servers: The number of other servers to create.
+        :param mapped: How many of those volumes to map to those servers.
+        :param portals: A list of (ip, port, target IQN) iSCSI portals, by
+                        default two.
+        :param volume_folder: The folder the initial volumes are put in.
+        :param latency: Seconds every request takes.
+        :param endpoint_latency: Dict of endpoint to seconds, overriding
+                                 latency.
+        :param errors: Dict of endpoint to the fraction of requests that
+                       fail with error_status.
+        :param error_status: The HTTP status of injected errors.
+        :param api_version: The REST API version reported at login.
+        :param on_map: Optional callable(volume, server) called when a
+                       volume is mapped to a server.
+        :param seed: Seed for the volume names and error injection.
+        """
+        self.ssn = ssn
+        self.latency = latency
+        self.endpoint_latency = endpoint_latency or {}
+        self.errors = errors or {}
+        self.error_status = error_status
+        self.api_version = api_version
+        self.on_map = on_map
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._failures = {}
+        self._next_id = 0
+        self._next_device = 0
+        self._lock = threading.Lock()
+        self._objects = dict((object_type, {}) for object_type in (
+            'ScVolume', 'ScServer', 'ScServerHba', 'ScMappingProfile',
+            'ScMapping', 'ScVolumeFolder', 'ScServerFolder',
+            'ScStorageProfile', 'ScServerOperatingSystem', 'ScFaultDomain',
+            'ScControllerPort'))
+        self._routes = [
+            ('POST', r'ApiConnection/Login$', self._login),
+            ('POST', r'ApiConnection/Logout$', self._logout),
+            ('GET', r'ApiConnection/ApiConnection$', self._keepalive),
+            ('GET', r'StorageCenter/StorageCenter$', self._storage_centers),
+            ('GET', r'StorageCenter/StorageCenter/[^/]+/UserPreferences$',
+             self._user_preferences),
+            ('GET', r'StorageCenter/ScConfiguration/[^/]+$',
+             self._configuration),
+            ('POST', r'StorageCenter/(ScVolumeFolder|ScServerFolder)$',
+             self._create_folder),
+            ('POST', r'StorageCenter/ScVolume$', self._create_volume),
+            ('DELETE', r'StorageCenter/ScVolume/([^/]+)$',
+             self._delete_volume),
+            ('PUT', r'StorageCenter/ScVolume/([^/]+)$', self._update_volume),
+            ('POST', r'StorageCenter/ScVolume/([^/]+)/MapToServer$',
+             self._map_volume),
+            ('POST', r'StorageCenter/ScVolume/([^/]+)/ExpandToSize$',
+             self._expand_volume),
+            ('GET', r'StorageCenter/ScVolume/([^/]+)/MappingList$',
+             self._volume_mappings),
+            ('GET', r'StorageCenter/ScVolume/([^/]+)/MappingProfileList$',
+             self._volume_mapping_profiles),
+            ('GET', r'StorageCenter/ScVolume/([^/]+)/VolumeConfiguration$',
+             self._volume_configuration),
+            ('POST', r'StorageCenter/ScVolumeConfiguration/([^/]+)/Modify$',
+             self._modify_volume),
+            ('DELETE', r'StorageCenter/ScMappingProfile/([^/]+)$',
+             self._delete_mapping_profile),
+            ('POST', r'StorageCenter/ScPhysicalServer$',
+             self._create_server),
+            ('POST', r'StorageCenter/ScPhysicalServer/([^/]+)/AddHba$',
+             self._add_hba),
+            ('DELETE', r'StorageCenter/ScServer/([^/]+)$',
+             self._delete_server),
+            ('GET', r'StorageCenter/ScServer/([^/]+)/HbaList$',
+             self._server_hbas),
+            ('GET', r'StorageCenter/ScControllerPort/([^/]+)$',
+             self._controller_port),
+            ('GET', r'StorageCenter/ScControllerPort/([^/]+)/FaultDomainList$',
+             self._controller_port_domains),
+            ('GET',
+             r'StorageCenter/ScControllerPortIscsiConfiguration/([^/]+)$',
+             self._controller_port_config),
+            ('POST',
+             r'StorageCenter/ScControllerPortIscsiConfiguration/GetList$',
+             self._controller_port_configs),
+            ('POST', r'StorageCenter/(Sc\w+)/GetList$', self._get_list),
+        ]
+        self._populate(portals, volume_folder, volumes, servers, mapped)
+
+    def adapter(self):
+        """Gets a ``requests`` transport adapter answering from this
+        simulator.
+        """
+        return EmAdapter(self)
+
+    def fail_next(self, endpoint, status=None, count=1):
+        """Makes the next requests to an endpoint fail.
+
+        :param endpoint: The endpoint name.
+        :param status: The HTTP status to fail with, by default
+                       error_status.  401 expires the session.
+        :param count: The number of requests to fail.
+        """
+        with self._lock:
+            self._failures.setdefault(endpoint, []).extend(
+                [status or self.error_status] * count)
+
+    def volumes(self):
+        """Gets a copy of all volumes on the simulated Storage Center."""
+        with self._lock:
+            return [dict(vol) for vol in self._objects['ScVolume'].values()]
+
+    # Object helpers, called with the lock held.
+
+    def _new_id(self):
+        self._next_id += 1
+        return '%d.%d' % (self.ssn, self._next_id)
+
+    def _add(self, object_type, **attributes):
+        obj = {'instanceId': self._new_id(),
+               'objectType': object_type,
+               'scSerialNumber': self.ssn,
+               'scName': 'Storage Center %d' % self.ssn}
+        obj.update(attributes)
+        if 'instanceName' not in obj:
+            obj['instanceName'] = obj.get('name')
+        self._objects[object_type][obj['instanceId']] = obj
+        return obj
+
+    def _get(self, object_type, instance_id):
+        return self._objects[object_type].get(instance_id)
+
+    def _populate(self, portals, volume_folder, volumes, servers, mapped):
+        """Creates the initial objects."""
+        with self._lock:
+            for name in STORAGE_PROFILES:
+                self._add('ScStorageProfile', name=name)
+            for name in SERVER_OS:
+                self._add('ScServerOperatingSystem', name=name)
+            self._controllers = [self._new_id(), self._new_id()]
+            if portals is None:
+                portals = [('10.10.0.%d' % (index + 1), 3260,
+                            'iqn.2002-03.com.compellent:5000d31000fa9e%02x'
+                            % index) for index in range(2)]
+            for index, (ip, port, iqn) in enumerate(portals):
+                domain = self._add('ScFaultDomain',
+                                   name='Domain %d' % index,
+                                   transportType='Iscsi',
+                                   targetIpv4Address=ip,
+                                   portNumber=port)
+                self._add('ScControllerPort',
+                          name='Port %d' % index,
+                          iscsiName=iqn,
+                          ipAddress=ip,
+                          portNumber=port,
+                          controller={'instanceId': self._controllers[
+                              index % len(self._controllers)]},
+                          faultDomain=_ref(domain))
+            folder = None
+            if volumes:
+                folder = self._create_folder_object('ScVolumeFolder',
+                                                    volume_folder, None)
+            names = [u'%s' % uuid.UUID(int=self._random.getrandbits(128))
+                     for _ in range(volumes)]
+            created = [self._create_volume_object(name, 1, folder, None)
+                       for name in names]
+            hosts = [self._create_server_object(
+                'server%d' % index, None,
+                'iqn.1993-08.org.debian:01:server%d' % index)
+                for index in range(servers)]
+            for index, vol in enumerate(created[:mapped if hosts else 0]):
+                self._map(vol, hosts[index % len(hosts)])
+
+    def _create_folder_object(self, object_type, name, parent):
+        folder_path = ''
+        if parent:
+            folder_path = '%s%s/' % (parent['folderPath'], parent['name'])
+        return self._add(object_type, name=name, folderPath=folder_path,
+                         parent=_ref(parent) if parent else None)
+
+    def _create_volume_object(self, name, size, folder, profile):
+        self._next_device += 1
+        folder_path = ''
+        if folder:
+            folder_path = '%s%s/' % (folder['folderPath'], folder['name'])
+        return self._add('ScVolume',
+                         name=name,
+                         deviceId='%s%016x' % (DEVICE_ID_PREFIX,
+                                               self._next_device),
+                         configuredSize='%s Bytes' % float(size * GIGABYTE),
+                         volumeFolder=_ref(folder) if folder else None,
+                         volumeFolderPath=folder_path,
+                         storageProfile=_ref(profile) if profile else None,
+                         inRecycleBin=False,
+                         active=False,
+                         mapped=False)
+
+    def _create_server_object(self, name, folder, iqn):
+        server = self._add('ScServer',
+                           name=name,
+                           status='Up',
+                           deleteAllowed=True,
+                           serverFolder=_ref(folder) if folder else None)
+        if iqn:
+            self._add('ScServerHba', name=iqn, portType='Iscsi',
+                      server=_ref(server))
+        return server
+
+    def _map(self, volume, server):
+        """Maps a volume to a server down every controller port."""
+        used = set(mapping['lun']
+                   for mapping in self._objects['ScMapping'].values()
+                   if mapping['server']['instanceId'] ==
+                   server['instanceId'])
+        lun = 1
+        while lun in used:
+            lun += 1
+        profile = self._add('ScMappingProfile',
+                            volume=_ref(volume),
+                            server=_ref(server),
+                            lun=lun)
+        hbas = [hba for hba in self._objects['ScServerHba'].values()
+                if hba['server']['instanceId'] == server['instanceId']]
+        for port in self._objects['ScControllerPort'].values():
+            for hba in hbas:
+                self._add('ScMapping',
+                          volume=_ref(volume),
+                          server=_ref(server),
+                          serverHba=_ref(hba),
+                          controller=port['controller'],
+                          controllerPort=_ref(port),
+                          profile=_ref(profile),
+                          lun=lun,
+                          readOnly=False,
+                          status='Up')
+        volume['active'] = True
+        volume['mapped'] = True
+        return profile
+
+    def _unmap(self, profile):
+        """Deletes a mapping profile and its mappings."""
+        del self._objects['ScMappingProfile'][profile['instanceId']]
+        mappings = self._objects['ScMapping']
+        for mapping in list(mappings.values()):
+            if mapping['profile']['instanceId'] == profile['instanceId']:
+                del mappings[mapping['instanceId']]
+        volume = self._get('ScVolume', profile['volume']['instanceId'])
+        if volume is not None:
+            volume['mapped'] = any(
+                other['volume']['instanceId'] == volume['instanceId']
+                for other in self._objects['ScMappingProfile'].values())
+
+    def _profiles_for(self, volume_id):
+        return [profile
+                for profile in self._objects['ScMappingProfile'].values()
+                if profile['volume']['instanceId'] == volume_id]
+
+    # Request handling
+
+    def handle(self, method, url, payload):
+        """Answers a REST request.
+
+        :param method: The HTTP method.
+        :param url: The REST url relative to the base url.
+        :param payload: The decoded JSON body or None.
+        :returns: A (status, reason, content) tuple.
+        """
+        endpoint = dell_storagecenter_api._normalize_endpoint(url)
+        time.sleep(self.endpoint_latency.get(endpoint, self.latency))
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            failures = self._failures.get(endpoint)
+            if failures:
+                status = failures.pop(0)
+                return status, 'Simulated failure', None
+            if self._random.random() < self.errors.get(endpoint, 0):
+                return self.error_status, 'Simulated failure', None
+            for route_method, pattern, handler in self._routes:
+                if route_method != method:
+                    continue
+                match = re.match(pattern, url)
+                if match:
+                    return handler(payload or {}, *match.groups())
+        return 404, 'Not Found', None
+
+    def _filter(self, object_type, payload):
+        apifilter = payload.get('filter', payload)
+        filters = apifilter.get('filters', [])
+        combine = any if apifilter.get('filterType') == 'OR' else all
+        return [obj for obj in self._objects[object_type].values()
+                if combine(_matches(obj, f) for f in filters)]
+
+    def _get_list(self, payload, object_type):
+        if object_type not in self._objects:
+            return 404, 'Not Found', None
+        return 200, 'OK', self._filter(object_type, payload)
+
+    def _login(self, payload):
+        return 200, 'OK', {'apiVersion': self.api_version,
+                           'instanceId': 'ApiConnection'}
+
+    def _logout(self, payload):
+        return 204, 'No Content', None
+
+    def _keepalive(self, payload):
+        return 200, 'OK', {'instanceId': 'ApiConnection'}
+
+    def _storage_centers(self, payload):
+        return 200, 'OK', [{'instanceId': str(self.ssn),
+                            'scSerialNumber': self.ssn,
+                            'name': 'Storage Center %d' % self.ssn}]
+
+    def _user_preferences(self, payload):
+        profile = list(self._objects['ScStorageProfile'].values())[0]
+        return 200, 'OK', {'allowStorageProfileSelection': True,
+                           'storageProfile': dict(profile)}
+
+    def _configuration(self, payload):
+        return 200, 'OK', {'iscsiTransportMode': 'VirtualPort'}
+
+    def _create_folder(self, payload, object_type):
+        parent = None
+        if payload.get('Parent'):
+            parent = self._get(object_type, payload['Parent'])
+            if parent is None:
+                return 400, 'Bad Request', None
+        return 201, 'Created', self._create_folder_object(
+            object_type, payload['Name'], parent)
+
+    def _create_volume(self, payload):
+        name = payload.get('Name')
+        size = int(payload.get('Size', '1 GB').split(' ')[0])
+        folder = self._get('ScVolumeFolder', payload.get('VolumeFolder'))
+        profile = self._get('ScStorageProfile', payload.get('StorageProfile'))
+        if payload.get('StorageProfile') and profile is None:
+            return 400, 'Bad Request', None
+        return 201, 'Created', self._create_volume_object(
+            name, size, folder, profile)
+
+    def _delete_volume(self, payload, volume_id):
+        if self._get('ScVolume', volume_id) is None:
+            return 404, 'Not Found', None
+        for profile in self._profiles_for(volume_id):
+            self._unmap(profile)
+        del self._objects['ScVolume'][volume_id]
+        return 200, 'OK', True
+
+    def _update_volume(self, payload, volume_id):
+        volume = self._get('ScVolume', volume_id)
+        if volume is None:
+            return 404, 'Not Found', None
+        if payload.get('VolumeFolder'):
+            folder = self._get('ScVolumeFolder', payload['VolumeFolder'])
+            if folder is None:
+                return 400, 'Bad Request', None
+            volume['volumeFolder'] = _ref(folder)
+            volume['volumeFolderPath'] = '%s%s/' % (folder['folderPath'],
+                                                    folder['name'])
+        if payload.get('Name'):
+            volume['name'] = payload['Name']
+        return 200, 'OK', volume
+
+    def _map_volume(self, payload, volume_id):
+        volume = self._get('ScVolume', volume_id)
+        server = self._get('ScServer', payload.get('server'))
+        if volume is None or server is None:
+            return 400, 'Bad Request', None
+        profile = self._map(volume, server)
+        if self.on_map is not None:
+            self.on_map(dict(volume), dict(server))
+        return 200, 'OK', profile
+
+    def _expand_volume(self, payload, volume_id):
+        volume = self._get('ScVolume', volume_id)
+        if volume is None:
+            return 404, 'Not Found', None
+        size = int(payload.get('NewSize', '0 GB').split(' ')[0])
+        volume['configuredSize'] = '%s Bytes' % float(size * GIGABYTE)
+        return 200, 'OK', volume
+
+    def _volume_mappings(self, payload, volume_id):
+        if self._get('ScVolume', volume_id) is None:
+            return 404, 'Not Found', None
+        return 200, 'OK', [
+            mapping for mapping in self._objects['ScMapping'].values()
+            if mapping['volume']['instanceId'] == volume_id]
+
+    def _volume_mapping_profiles(self, payload, volume_id):
+        if self._get('ScVolume', volume_id) is None:
+            return 404, 'Not Found', None
+        return 200, 'OK', self._profiles_for(volume_id)
+
+    def _volume_configuration(self, payload, volume_id):
+        if self._get('ScVolume', volume_id) is None:
+            return 404, 'Not Found', None
+        return 200, 'OK', {'instanceId': volume_id,
+                           'controller': {
+                               'instanceId': self._controllers[0]}}
+
+    def _modify_volume(self, payload, volume_id):
+        volume = self._get('ScVolume', volume_id)
+        profile = self._get('ScStorageProfile', payload.get('StorageProfile'))
+        if volume is None or profile is None:
+            return 400, 'Bad Request', None
+        volume['storageProfile'] = _ref(profile)
+        return 200, 'OK', {'instanceId': volume_id}
+
+    def _delete_mapping_profile(self, payload, profile_id):
+        profile = self._get('ScMappingProfile', profile_id)
+        if profile is None:
+            return 404, 'Not Found', None
+        self._unmap(profile)
+        return 200, 'OK', None
+
+    def _create_server(self, payload):
+        folder = self._get('ScServerFolder', payload.get('ServerFolder'))
+        return 201, 'Created', self._create_server_object(
+            payload['Name'], folder, None)
+
+    def _add_hba(self, payload, server_id):
+        server = self._get('ScServer', server_id)
+        if server is None:
+            return 404, 'Not Found', None
+        name = payload.get('WwnOrIscsiName')
+        for hba in self._objects['ScServerHba'].values():
+            if hba['instanceName'] == name:
+                hba['server'] = _ref(server)
+                return 200, 'OK', hba
+        return 200, 'OK', self._add('ScServerHba', name=name,
+                                    portType=payload.get('HbaPortType'),
+                                    server=_ref(server))
+
+    def _delete_server(self, payload, server_id):
+        if self._get('ScServer', server_id) is None:
+            return 404, 'Not Found', None
+        del self._objects['ScServer'][server_id]
+        for hba in self._objects['ScServerHba'].values():
+            if (hba.get('server') or {}).get('instanceId') == server_id:
+                hba['server'] = None
+        return 200, 'OK', None
+
+    def _server_hbas(self, payload, server_id):
+        return 200, 'OK', [
+            hba for hba in self._objects['ScServerHba'].values()
+            if (hba.get('server') or {}).get('instanceId') == server_id]
+
+    def _controller_port(self, payload, port_id):
+        port = self._get('ScControllerPort', port_id)
+        if port is None:
+            return 404, 'Not Found', None
+        return 200, 'OK', port
+
+    def _controller_port_domains(self, payload, port_id):
+        port = self._get('ScControllerPort', port_id)
+        if port is None:
+            return 404, 'Not Found', None
+        return 200, 'OK', [self._get('ScFaultDomain',
+                                     port['faultDomain']['instanceId'])]
+
+    def _controller_port_config(self, payload, port_id):
+        return self._controller_port(payload, port_id)
+
+    def _controller_port_configs(self, payload):
+        return 200, 'OK', list(self._objects['ScControllerPort'].values())
+
+
+class EmAdapter(adapters.BaseAdapter):
+    """``requests`` transport adapter answering from an ``EmSimulator``."""
+
+    def __init__(self, simulator):
+        super(EmAdapter, self).__init__()
+        self.simulator = simulator
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        """Answers a prepared request from the simulator."""
+        url = request.path_url.split('?')[0]
+        url = url.split('/api/rest/', 1)[-1]
+        payload = None
+        if request.body:
+            body = request.body
+            if isinstance(body, bytes):
+                body = body.decode('utf-8')
+            payload = json.loads(body)
+        status, reason, content = self.simulator.handle(
+            request.method, url, payload)
+
+        body = b''
+        if content is not None:
+            body = json.dumps(content).encode('utf-8')
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers['Content-Type'] = 'application/json'
+        response.headers['Content-Length'] = str(len(body))
+        response.encoding = 'utf-8'
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        """Nothing to clean up."""
+
+
+def _time(func, *args):
+    """Times a call, returning (seconds, result)."""
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def benchmark(volumes, latency=0.0, mapped_fraction=0.1):
+    """Times common API operations against a simulated Storage Center.
+
+    :param volumes: The number of volumes in the volume folder.
+    :param latency: Seconds each request takes.
+    :param mapped_fraction: The fraction of volumes that are mapped.
+    :returns: A dict of operation name to seconds.
+    """
+    simulator = EmSimulator(volumes=volumes, servers=10,
+                            mapped=int(volumes * mapped_fraction),
+                            latency=latency, seed=volumes)
+    helper = dell_storagecenter_api.StorageCenterApiHelper(
+        {'storage_host': 'em', 'username': 'admin', 'password': 'admin',
+         'dell_sc_ssn': DEFAULT_SSN, 'em_adapter': simulator.adapter(),
+         'session_keepalive_interval': 0})
+    name = simulator.volumes()[0]['name'] if volumes else u'missing'
+    result = {}
+    with helper.open_connection() as api:
+        result['list'], vols = _time(api.list_volumes)
+        result['mappings'] = _time(api.find_mapping_profiles_for_volumes,
+                                   vols)[0]
+    helper.index.replace_all([])
+    with helper.open_connection() as api:
+        result['find'] = _time(api.find_volume, name)[0]
+    with helper.open_connection() as api:
+        result['create'], vol = _time(api.create_volume,
+                                      u'%s' % uuid.uuid4(), 1)
+    with helper.open_connection() as api:
+        result['delete'] = _time(api.delete_volume, vol.name)[0]
+    helper.close()
+    result['requests'] = sum(simulator.requests.values())
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    # Get command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--volumes", "-n", help="Volume counts to benchmark.", type=int,
+        nargs='+', default=[100, 1000, 10000])
+    parser.add_argument(
+        "--latency", "-l", help="Seconds each request takes.",
+        type=float, default=0.0)
+    args = parser.parse_args()
+
+    operations = ['list', 'mappings', 'find', 'create', 'delete']
+    print('%8s  %s  %8s' % ('volumes',
+                            '  '.join('%10s' % op for op in operations),
+                            'requests'))
+    for count in args.volumes:
+        timings = benchmark(count, args.latency)
+        print('%8d  %s  %8d' % (count,
+                                '  '.join('%10.4f' % timings[op]
+                                          for op in operations),
+                                timings['requests']))
@@ -14,22 +14,95 @@
 """Utility functions for managing local host iSCSI."""
 
 import argparse
+import binascii
+import ctypes
+import ctypes.util
 from datetime import datetime
+import fcntl
 import logging
 import os
 import re
+import select
 import shlex
+import stat
 import subprocess
+import threading
 import time
 
+import concurrency
+import metrics
+
 
 LOG = logging.getLogger(__name__)
+# Host paths, see set_root
+DEV = '/dev'
+DEV_BY_ID = '/dev/disk/by-id'
+SYS_BLOCK = '/sys/block'
+SYS_ISCSI_SESSION = '/sys/class/iscsi_session'
+SYS_SCSI_HOST = '/sys/class/scsi_host'
+SYS_ISCSI_CONNECTION = '/sys/class/iscsi_connection'
+INITIATOR_NAME_FILE = '/etc/iscsi/initiatorname.iscsi'
+SCSI_ID = '/lib/udev/scsi_id'
+# Directory external commands are run from, None to use the PATH
+BIN_DIR = None
+DEFAULT_DISCOVERY_TTL = 300
+SD_REGEX = re.compile(r'sd[a-z]+(?![\d])')
+# SCSI VPD page 0x83 designator type and association for a logical unit NAA
+NAA_DESIGNATOR = 3
+LU_ASSOCIATION = 0
+DEFAULT_DEVICE_TIMEOUT = 20
+MIN_BACKOFF = 0.1
+MAX_BACKOFF = 2.0
+DEFAULT_EXEC_TIMEOUT = 120
+DEFAULT_MAX_COMMANDS = 8
+# Block device ioctl to flush buffers from <linux/fs.h>
+BLKFLSBUF = 0x1261
+# Limits on the external commands we run, see configure_exec
+_exec_timeout = DEFAULT_EXEC_TIMEOUT
+_exec_max_commands = DEFAULT_MAX_COMMANDS
+_exec_slots = threading.BoundedSemaphore(DEFAULT_MAX_COMMANDS)
+_exec_lock = threading.Lock()
+# Cached sendtargets discovery results: portal -> (expiry, targets)
+_discovery_cache = {}
+_discovery_lock = threading.Lock()
+# inotify flags from <sys/inotify.h>
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MOVED_TO = 0x80
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+
+
+def set_root(root='/', bin_dir=None):
+    """Points all host access at a different root directory.
+
+    Used to run against a simulated host, see ``sandbox``.
+
+    :param root: The directory holding the dev, sys and etc trees.
+    :param bin_dir: Directory to run external commands from instead of
+                    the PATH, or None.
+    """
+    global DEV, DEV_BY_ID, SYS_BLOCK, SYS_ISCSI_SESSION, SYS_SCSI_HOST
+    global SYS_ISCSI_CONNECTION, INITIATOR_NAME_FILE, SCSI_ID, BIN_DIR
+    DEV = os.path.join(root, 'dev')
+    DEV_BY_ID = os.path.join(DEV, 'disk', 'by-id')
+    SYS_BLOCK = os.path.join(root, 'sys', 'block')
+    SYS_ISCSI_SESSION = os.path.join(root, 'sys', 'class', 'iscsi_session')
+    SYS_SCSI_HOST = os.path.join(root, 'sys', 'class', 'scsi_host')
+    SYS_ISCSI_CONNECTION = os.path.join(
+        root, 'sys', 'class', 'iscsi_connection')
+    INITIATOR_NAME_FILE = os.path.join(
+        root, 'etc', 'iscsi', 'initiatorname.iscsi')
+    SCSI_ID = os.path.join(root, 'lib', 'udev', 'scsi_id')
+    BIN_DIR = bin_dir
+    with _discovery_lock:
+        _discovery_cache.clear()
 
 
 def get_initiator_name():
     """Gets the iSCSI initiator name."""
-    output = subprocess.check_output(
-        ['cat', '/etc/iscsi/initiatorname.iscsi'])
+    with open(INITIATOR_NAME_FILE) as initiator_file:
+        output = initiator_file.read()
     lines = output.split('\n')
     for line in lines:
         if '=' in line:
@@ -37,20 +110,124 @@ def get_initiator_name():
             return parts[1]
 
 
-def _exec(cmd):
+def configure_exec(timeout=DEFAULT_EXEC_TIMEOUT,
+                   max_commands=DEFAULT_MAX_COMMANDS):
+    """Sets the limits used when running external commands.
+
+    Every driver instance calls this, so the command slots are only
+    replaced when the limit changes.  Otherwise commands already running
+    would stop counting against the limit.
+
+    :param timeout: Seconds a command may run before it is killed.
+    :param max_commands: The maximum number of commands run at once.
+    """
+    global _exec_timeout, _exec_max_commands, _exec_slots
+    with _exec_lock:
+        _exec_timeout = timeout
+        if max_commands != _exec_max_commands:
+            _exec_max_commands = max_commands
+            _exec_slots = threading.BoundedSemaphore(max_commands)
+
+
+def _exec(cmd, timeout=None):
     """Executes a command.
 
-    Runs a command and gets its output.
+    Runs a command and gets its output.  Only a limited number of commands
+    run at once and a command that takes too long is killed.  The time
+    taken and the result are recorded per command in the driver metrics.
+
     :param cmd: The command line to run.
+    :param timeout: Seconds to allow, by default the configured timeout.
     :returns: The output from the command.
+    :raises: CalledProcessError if the command fails or times out.
     """
+    args = shlex.split(cmd)
+    if BIN_DIR:
+        args[0] = os.path.join(BIN_DIR, os.path.basename(args[0]))
+    labels = {'command': os.path.basename(args[0])}
+    if timeout is None:
+        timeout = _exec_timeout
     LOG.info('Running %s', cmd)
-    output = subprocess.check_output(shlex.split(cmd))
+    with _exec_slots:
+        start = time.time()
+        process = subprocess.Popen(args,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        killed = []
+
+        def kill():
+            killed.append(True)
+            try:
+                process.kill()
+            except OSError:
+                # It finished after all
+                pass
+
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            output, error = process.communicate()
+        finally:
+            timer.cancel()
+        elapsed = time.time() - start
+
+    metrics.REGISTRY.observe('exec_seconds', labels, elapsed)
+    if process.returncode:
+        result = 'error'
+        if killed:
+            result = 'timeout'
+            LOG.warning('%s killed after %s seconds', cmd, timeout)
+        labels['result'] = result
+        metrics.REGISTRY.increment('exec_total', labels)
+        if error:
+            LOG.debug('Error output: %s', error)
+        raise subprocess.CalledProcessError(process.returncode, cmd, output)
+    labels['result'] = 'ok'
+    metrics.REGISTRY.increment('exec_total', labels)
     if output:
         LOG.debug('Result: %s', output)
     return output
 
 
+def _flush_buffers(path):
+    """Flushes a block device's buffers, like blockdev --flushbufs.
+
+    :param path: The block device to flush.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if not stat.S_ISBLK(os.fstat(fd).st_mode):
+            return
+        fcntl.ioctl(fd, BLKFLSBUF, 0)
+    finally:
+        os.close(fd)
+
+
+def _read_sysfs(path):
+    """Reads a sysfs attribute.
+
+    :param path: The attribute file.
+    :returns: The stripped contents or None if it cannot be read.
+    """
+    try:
+        with open(path) as attr:
+            return attr.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _write_sysfs(path, value):
+    """Writes a sysfs attribute.
+
+    :param path: The attribute file.
+    :param value: The string to write.
+    """
+    LOG.debug('Writing %s to %s', value, path)
+    with open(path, 'w') as attr:
+        attr.write(value)
+
+
 def _do_login_logout(iqn, ip, do_login):
     """Perform the iSCSI login or logout."""
     try:
@@ -68,12 +245,53 @@ def _do_login_logout(iqn, ip, do_login):
     return False
 
 
-def _manage_session(ip_addr, port, do_login=True):
-    """Manage iSCSI sessions for all ports in a portal."""
-    if ip_addr == '0.0.0.0':
-        return
+def get_sessions():
+    """Gets the host's current iSCSI sessions from sysfs.
+
+    :returns: A set of (target IQN, 'ip:port' portal) tuples.
+    """
+    result = set()
+    try:
+        connections = os.listdir(SYS_ISCSI_CONNECTION)
+    except OSError:
+        return result
+    for connection in connections:
+        # Connections are named connection<session id>:<connection id>
+        match = re.match(r'connection(\d+):\d+$', connection)
+        if not match:
+            continue
+        conn_path = os.path.join(SYS_ISCSI_CONNECTION, connection)
+        address = (_read_sysfs(os.path.join(conn_path, 'persistent_address'))
+                   or _read_sysfs(os.path.join(conn_path, 'address')))
+        port = (_read_sysfs(os.path.join(conn_path, 'persistent_port'))
+                or _read_sysfs(os.path.join(conn_path, 'port')))
+        target = _read_sysfs(os.path.join(
+            SYS_ISCSI_SESSION, 'session%s' % match.group(1), 'targetname'))
+        if address and port and target:
+            result.add((target, '%s:%s' % (address, port)))
+    return result
+
+
+def _discover(ip_addr, port, refresh=False):
+    """Gets the targets behind a portal using sendtargets discovery.
+
+    Results are cached per portal for DEFAULT_DISCOVERY_TTL seconds.
+
+    :param ip_addr: The portal IP address.
+    :param port: The portal port.
+    :param refresh: If True ignore any cached result.
+    :returns: A list of (target IQN, 'ip:port' portal) tuples.
+    """
+    key = (ip_addr, port)
+    now = time.time()
+    with _discovery_lock:
+        cached = _discovery_cache.get(key)
+    if cached and cached[0] > now and not refresh:
+        return cached[1]
+
     output = _exec('iscsiadm -m discovery -t st -p %s %s' %
                    (ip_addr, port))
+    targets = []
     lines = output.split('\n')
     for line in lines:
         if ':' not in line:
@@ -81,7 +299,59 @@ def _manage_session(ip_addr, port, do_login=True):
         target = line.split(' ')
         iqn = target[1]
         ip = target[0].split(',')[0]
-        _do_login_logout(iqn, ip, do_login)
+        targets.append((iqn, ip))
+    with _discovery_lock:
+        _discovery_cache[key] = (now + DEFAULT_DISCOVERY_TTL, targets)
+    return targets
+
+
+def _forget_discovery(ip_addr, port):
+    """Drops the cached discovery result for a portal."""
+    with _discovery_lock:
+        _discovery_cache.pop((ip_addr, port), None)
+
+
+def _manage_session(ip_addr, port, do_login=True):
+    """Manage iSCSI sessions for all ports in a portal."""
+    if ip_addr == '0.0.0.0':
+        return
+    sessions = get_sessions()
+    for iqn, ip in _discover(ip_addr, port):
+        # Only log in where we need to and out where we are logged in.
+        if ((iqn, ip) in sessions) != do_login:
+            if not _do_login_logout(iqn, ip, do_login):
+                _forget_discovery(ip_addr, port)
+
+
+def iscsi_login_all(ports, max_workers=concurrency.DEFAULT_MAX_WORKERS):
+    """Makes sure this host is logged in to every target on the portals.
+
+    Existing sessions are read from sysfs and discovery results are
+    cached, so only missing target/portal pairs are logged in to.  The
+    discoveries and logins that are needed run in parallel.
+
+    :param ports: A list of (ip, port) portal tuples.
+    :param max_workers: The maximum number of concurrent iscsiadm calls.
+    """
+    portals = [(ip, port) for ip, port in ports if ip != '0.0.0.0']
+    discovered = concurrency.parallel_map(lambda portal: _discover(*portal),
+                                          portals,
+                                          max_workers)
+    sessions = get_sessions()
+    missing = {}
+    for portal, targets in zip(portals, discovered):
+        for target in targets:
+            if target not in sessions:
+                missing.setdefault(target, portal)
+    if not missing:
+        LOG.debug('Already logged in to all targets.')
+        return
+
+    def login(target):
+        if not _do_login_logout(target[0], target[1], True):
+            _forget_discovery(*missing[target])
+
+    concurrency.parallel_map(login, sorted(missing), max_workers)
 
 
 def iscsi_login(ip_addr, port=3260):
@@ -103,9 +373,89 @@ def rescan_iscsi():
     LOG.info('Rescan took %s - output: %s', (end - start), lines)
 
 
+def _get_session_hosts():
+    """Finds the SCSI hosts of the current iSCSI sessions.
+
+    :returns: A dict of target IQN to a set of scsi_host names.
+    """
+    result = {}
+    try:
+        sessions = os.listdir(SYS_ISCSI_SESSION)
+    except OSError:
+        return result
+    for session in sessions:
+        session_path = os.path.join(SYS_ISCSI_SESSION, session)
+        target = _read_sysfs(os.path.join(session_path, 'targetname'))
+        # The session device lives under its SCSI host, e.g.
+        # /sys/devices/platform/host3/session1/iscsi_session/session1
+        host = re.search(r'/(host\d+)/', os.path.realpath(session_path))
+        if target and host:
+            result.setdefault(target, set()).add(host.group(1))
+    return result
+
+
+def rescan_luns(targets):
+    """Perform a targeted rescan for specific LUNs.
+
+    Only the given LUN is scanned, and only on the SCSI hosts of the
+    sessions to its target, instead of rescanning every LUN on every
+    session.  Falls back to a full rescan if no matching session is found.
+
+    :param targets: An iterable of (target IQN, LUN) tuples.
+    """
+    start = datetime.now()
+    hosts = _get_session_hosts()
+    scanned = []
+    for iqn, lun in set(targets):
+        for host in sorted(hosts.get(iqn, ())):
+            try:
+                _write_sysfs(os.path.join(SYS_SCSI_HOST, host, 'scan'),
+                             '- - %s' % lun)
+                scanned.append((host, lun))
+            except (IOError, OSError):
+                LOG.exception('Error scanning %s for LUN %s', host, lun)
+    end = datetime.now()
+    if not scanned:
+        LOG.info('No sessions found for %s, rescanning all sessions.',
+                 targets)
+        return rescan_iscsi()
+    LOG.info('Rescan took %s - scanned: %s', (end - start), scanned)
+
+
+def _get_sysfs_multipath_device(sd_device):
+    """Get the multipath device for a volume from its sysfs holders.
+
+    A multipath map shows up as a dm-N holder of each of its paths, with
+    a dm/uuid starting with "mpath-".
+
+    :param sd_device: The SCSI device to look for.
+    :return: The /dev/mapper/ multipath device, None if there is no
+             multipath device, or False if sysfs could not tell.
+    """
+    holders_path = os.path.join(
+        SYS_BLOCK, os.path.basename(sd_device), 'holders')
+    try:
+        holders = os.listdir(holders_path)
+    except OSError:
+        return False
+    for holder in holders:
+        if not holder.startswith('dm-'):
+            continue
+        dm_path = os.path.join(SYS_BLOCK, holder, 'dm')
+        uuid = _read_sysfs(os.path.join(dm_path, 'uuid'))
+        name = _read_sysfs(os.path.join(dm_path, 'name'))
+        if uuid is None or name is None:
+            return False
+        if uuid.startswith('mpath-'):
+            return os.path.join(DEV, 'mapper', name)
+    return None
+
+
 def _get_multipath_device(sd_device):
     """Get the multipath device for a volume.
 
+    Sysfs is checked first.  Only if it cannot answer is multipath run.
+
     Output from multipath -l should be something like:
     36000d31000fa9e0000000000000002f2 dm-5 COMPELNT,Compellent Vol
     size=1.0G features='1 queue_if_no_path' hwhandler='0' wp=rw
@@ -118,6 +468,10 @@ def _get_multipath_device(sd_device):
     :param sd_device: The SCSI device to look for.
     :return: The /dev/mapper/ multipath device if one exists.
     """
+    result = _get_sysfs_multipath_device(sd_device)
+    if result is not False:
+        return result
+
     result = None
     try:
         output = _exec('multipath -l %s' % sd_device)
@@ -127,7 +481,7 @@ def _get_multipath_device(sd_device):
                 if 'COMPELNT' not in line:
                     continue
                 name = line.split(' ')[0]
-                result = '/dev/mapper/%s' % name
+                result = os.path.join(DEV, 'mapper', name)
                 break
     except Exception:
         # Oh well, we tried
@@ -136,30 +490,141 @@ def _get_multipath_device(sd_device):
     return result
 
 
+def _parse_vpd_pg83(data):
+    """Gets the NAA identifier from a SCSI VPD page 0x83.
+
+    :param data: The raw page data.
+    :returns: The identifier as a hex string or None.
+    """
+    data = bytearray(data)
+    pos = 4
+    end = min(len(data), 4 + ((data[2] << 8) | data[3]))
+    while pos + 4 <= end:
+        association = (data[pos + 1] >> 4) & 0x3
+        designator_type = data[pos + 1] & 0xf
+        length = data[pos + 3]
+        if (designator_type == NAA_DESIGNATOR and
+                association == LU_ASSOCIATION):
+            designator = data[pos + 4:pos + 4 + length]
+            return binascii.hexlify(designator).decode('ascii')
+        pos += 4 + length
+    return None
+
+
+def _read_vpd_pg83(dev):
+    """Reads the page 83 identifier of a SCSI disk from sysfs.
+
+    :param dev: The sd device name.
+    :returns: The identifier or None if it cannot be read.
+    """
+    try:
+        with open(os.path.join(SYS_BLOCK, dev, 'device', 'vpd_pg83'),
+                  'rb') as vpd:
+            return _parse_vpd_pg83(vpd.read())
+    except (IOError, OSError):
+        return None
+
+
+def _read_by_id_links():
+    """Maps sd devices to their identifiers using /dev/disk/by-id.
+
+    :returns: A dict of sd device name to identifier.
+    """
+    result = {}
+    try:
+        links = os.listdir(DEV_BY_ID)
+    except OSError:
+        return result
+    for link in links:
+        if link.startswith('scsi-3'):
+            ident = link[len('scsi-3'):]
+        elif link.startswith('wwn-0x'):
+            ident = link[len('wwn-0x'):]
+        else:
+            continue
+        dev = os.path.basename(os.readlink(os.path.join(DEV_BY_ID, link)))
+        if SD_REGEX.match(dev):
+            result[dev] = ident.lower()
+    return result
+
+
+def _scsi_id(dev):
+    """Gets the page 83 identifier of a SCSI disk using scsi_id.
+
+    :param dev: The sd device name.
+    :returns: The identifier or None on error.
+    """
+    try:
+        output = _exec('%s --page=0x83 --whitelisted --device=%s' %
+                       (SCSI_ID, os.path.join(DEV, dev)))
+        output = output.strip()
+        # scsi_id prefixes the identifier with its designator type
+        return output[1:].lower() if output else None
+    except Exception:
+        LOG.exception('Error getting device id for %s', dev)
+    return None
+
+
+def get_device_map():
+    """Builds a map of page 83 device IDs to local SCSI disks.
+
+    The identifiers are read from sysfs in a single pass.  Devices without
+    a readable vpd_pg83 are looked up in /dev/disk/by-id and, failing that,
+    with scsi_id.
+
+    :returns: A dict of device ID to a sorted list of sd device names.
+    """
+    idents = {}
+    missing = []
+    try:
+        devs = [dev for dev in os.listdir(SYS_BLOCK) if SD_REGEX.match(dev)]
+    except OSError:
+        devs = []
+    for dev in devs:
+        ident = _read_vpd_pg83(dev)
+        if ident:
+            idents[dev] = ident
+        else:
+            missing.append(dev)
+
+    if missing:
+        by_id = _read_by_id_links()
+        for dev in missing:
+            ident = by_id.get(dev) or _scsi_id(dev)
+            if ident:
+                idents[dev] = ident
+
+    result = {}
+    for dev, ident in idents.items():
+        result.setdefault(ident, []).append(dev)
+    for devs in result.values():
+        devs.sort()
+    return result
+
+
 def find_paths(device_id):
     """Looks for the local device paths.
 
     Note: The first element will be the multipath device if one is present.
 
     :param device_id: The page 83 device id.
-    :returns: A list of the local paths.
+    :returns: A list of the local paths, empty if ``device_id`` is not set.
     """
-    result = []
-    regex = re.compile('sd[a-z]+(?![\d])')
-    for dev in os.listdir('/dev/'):
-        if regex.match(dev):
-            try:
-                output = _exec('/lib/udev/scsi_id --page=0x83 '
-                               '--whitelisted --device=/dev/%s' %
-                               dev)
-                if device_id in output:
-                    LOG.info('Found %s at %s', device_id, dev)
-                    result.append('/dev/%s' % dev)
-            except Exception:
-                LOG.exception('Error getting device id for %s', dev)
+    if not device_id:
+        return []
+    device_id = device_id.lower()
+    device_map = get_device_map()
+    devs = device_map.get(device_id)
+    if devs is None:
+        devs = []
+        for ident, ident_devs in device_map.items():
+            if device_id in ident:
+                devs.extend(ident_devs)
+    for dev in devs:
+        LOG.info('Found %s at %s', device_id, dev)
 
     # Functional tests always want the same device reported
-    result.sort()
+    result = sorted(os.path.join(DEV, dev) for dev in devs)
 
     if result:
         # Check if there is a multipath device
@@ -170,34 +635,205 @@ def find_paths(device_id):
     return result
 
 
+class DeviceWatcher(object):
+    """Wakes up when device nodes are created or removed.
+
+    Uses inotify on a device directory so callers waiting for a device do
+    not have to sleep for fixed intervals.
+    """
+
+    def __init__(self, path, mask=IN_CREATE | IN_MOVED_TO):
+        """Start watching a directory.
+
+        :param path: The directory to watch.
+        :param mask: The inotify events to wake up for.
+        :raises: OSError if inotify is not available.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, path.encode('utf-8'), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed on %s' % path)
+
+    def wait(self, timeout):
+        """Waits for a watched event.
+
+        :param timeout: The maximum number of seconds to wait.
+        :returns: True if something happened.
+        """
+        ready = select.select([self.fd], [], [], timeout)[0]
+        if not ready:
+            return False
+        try:
+            # Drain the events, we only care that something happened.
+            while os.read(self.fd, 4096):
+                pass
+        except OSError:
+            pass
+        return True
+
+    def close(self):
+        """Stops watching."""
+        os.close(self.fd)
+
+
+def _create_watcher(path=None, mask=IN_CREATE | IN_MOVED_TO):
+    """Creates a DeviceWatcher for disk changes if possible.
+
+    :param path: The directory to watch, by default the by-id links.
+    :param mask: The inotify events to wake up for.
+    :returns: A ``DeviceWatcher`` or None.
+    """
+    if path is None:
+        path = DEV_BY_ID if os.path.isdir(DEV_BY_ID) else DEV
+    try:
+        return DeviceWatcher(path, mask)
+    except Exception:
+        LOG.debug('Unable to watch %s for new devices.', path,
+                  exc_info=True)
+    return None
+
+
+def wait_for_paths(device_id, timeout=DEFAULT_DEVICE_TIMEOUT):
+    """Waits for the local paths of a device to show up.
+
+    Wakes as soon as a new device node is created.  If device events are
+    not available, or as a safety net for missed events, the device is
+    polled with an increasing backoff.
+
+    :param device_id: The page 83 device id.
+    :param timeout: The maximum number of seconds to wait.
+    :returns: A list of the local paths, as from ``find_paths``, or an
+              empty list if the device did not appear in time.
+    """
+    deadline = time.time() + timeout
+    backoff = MIN_BACKOFF
+    watcher = _create_watcher()
+    try:
+        while True:
+            paths = find_paths(device_id)
+            if paths:
+                return paths
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOG.info('%s not found after %s seconds', device_id, timeout)
+                return []
+            wait = min(backoff, remaining)
+            if watcher is not None:
+                watcher.wait(wait)
+            else:
+                time.sleep(wait)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+def _settle(timeout):
+    """Waits for udev to finish processing device events.
+
+    :param timeout: The maximum number of seconds to wait.
+    """
+    try:
+        _exec('udevadm settle --timeout=%d' % max(int(timeout), 1))
+    except Exception:
+        LOG.exception('Error waiting for udev to settle.')
+
+
+def _remove_sd_device(path, timeout):
+    """Flushes and deletes a SCSI disk and waits for it to go away.
+
+    :param path: The /dev/sdX path to remove.
+    :param timeout: The maximum number of seconds to wait for removal.
+    :returns: True if the device was removed in time.
+    """
+    sd = os.path.basename(path)
+    sys_path = os.path.join(SYS_BLOCK, sd)
+    remove_path = os.path.join(sys_path, 'device', 'delete')
+    if not os.path.exists(remove_path):
+        return True
+
+    start = time.time()
+    try:
+        _flush_buffers(path)
+    except Exception:
+        LOG.exception('Error flushing IO to %s', path)
+    # Watch before deleting so the removal event cannot be missed.
+    watcher = _create_watcher(DEV, IN_DELETE)
+    try:
+        try:
+            _write_sysfs(remove_path, '1')
+        except (IOError, OSError):
+            LOG.exception('Error removing device %s', sd)
+            return False
+        deadline = start + timeout
+        backoff = MIN_BACKOFF
+        while os.path.exists(sys_path):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOG.warning('%s still present after %s seconds', sd, timeout)
+                return False
+            wait = min(backoff, remaining)
+            if watcher is not None:
+                watcher.wait(wait)
+            else:
+                time.sleep(wait)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+    finally:
+        if watcher is not None:
+            watcher.close()
+    LOG.info('Removed %s in %.3f seconds', sd, time.time() - start)
+    return True
+
+
+def _remove_multipath_device(path):
+    """Flushes and removes a multipath map.
+
+    :param path: The /dev/mapper/X path to remove.
+    """
+    try:
+        _exec('multipath -f %s' % os.path.basename(path))
+    except Exception:
+        LOG.exception('Error removing multipath device %s', path)
+
+
+def remove_devices(paths, timeout=DEFAULT_DEVICE_TIMEOUT,
+                   max_workers=concurrency.DEFAULT_MAX_WORKERS):
+    """Removes all the local paths of a device.
+
+    Any multipath map is flushed and removed once, then the SCSI disks
+    under it are deleted concurrently.  Each disk is considered gone as
+    soon as it disappears from sysfs; if one does not go away within
+    ``timeout`` seconds udev is given a chance to settle.
+
+    :param paths: The paths to remove, as returned by ``find_paths``.
+    :param timeout: The maximum number of seconds to wait for each disk.
+    :param max_workers: The maximum number of disks removed at once.
+    """
+    paths = [path for path in paths if path]
+    sd_paths = [path for path in paths
+                if SD_REGEX.match(os.path.basename(path))]
+    for path in paths:
+        if path not in sd_paths:
+            _remove_multipath_device(path)
+
+    removed = concurrency.parallel_map(
+        lambda path: _remove_sd_device(path, timeout),
+        sd_paths,
+        max_workers)
+    if not all(removed):
+        _settle(timeout)
+
+
 def remove_device(path):
     """Prepare removal of SCSI device.
 
     :param path: The /dev/sdX or /dev/mapper/X path to remove.
     """
-    if not path:
-        return
-
-    if '/dev/sd' in path:
-        sd = path.replace('/dev/', '')
-        remove_path = '/sys/block/%s/device/delete' % sd
-        if os.path.exists(remove_path):
-            try:
-                _exec('blockdev --flushbufs %s' % path)
-                time.sleep(4)
-            except Exception:
-                LOG.exception('Error flushing IO to %s', path)
-            try:
-                _exec('sh -c "echo 1 > %s"' % remove_path)
-                time.sleep(1)
-            except Exception:
-                LOG.exception('Error removing device %s', sd)
-    else:
-        try:
-            path = path.replace('/dev/mapper/', '')
-            _exec('multipath -f %s' % path)
-        except Exception:
-            LOG.exception('Error removing multipath device %s', path)
+    remove_devices([path])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Lightweight metrics collection for the driver.
+
+Counters, gauges and latency histograms are kept in a ``MetricsRegistry``
+and can be exported as a Prometheus text file or as Eliot messages.
+"""
+
+import bisect
+import logging
+import os
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_MESSAGE_TYPE = (
+    "flocker:node:agents:blockdevice:dellstoragecenter:metrics")
+LOG = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record a value.
+
+        :param value: The observed value, usually seconds.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """Gets the cumulative bucket counts.
+
+        :returns: A list of (upper bound, count) tuples ending with +Inf.
+        """
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class MetricsRegistry(object):
+    """Thread safe collection of named, labelled metrics."""
+
+    def __init__(self, prefix='dell_sc'):
+        """Create a new registry.
+
+        :param prefix: Prefix added to every metric name on export.
+        """
+        self.prefix = prefix
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def increment(self, name, labels=None, amount=1):
+        """Increment a counter.
+
+        :param name: The metric name.
+        :param labels: Optional dict of label names to values.
+        :param amount: The amount to add.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, labels=None, value=0):
+        """Set a gauge to a value.
+
+        :param name: The metric name.
+        :param labels: Optional dict of label names to values.
+        :param value: The current value.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, labels=None, value=0.0):
+        """Record a value in a histogram.
+
+        :param name: The metric name.
+        :param labels: Optional dict of label names to values.
+        :param value: The observed value, usually seconds.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        """Gets a point in time copy of all metrics.
+
+        :returns: A list of dicts describing each metric series.
+        """
+        result = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                result.append({'name': name, 'type': 'counter',
+                               'labels': dict(labels), 'value': value})
+            for (name, labels), value in sorted(self._gauges.items()):
+                result.append({'name': name, 'type': 'gauge',
+                               'labels': dict(labels), 'value': value})
+            for (name, labels), hist in sorted(self._histograms.items()):
+                result.append({'name': name, 'type': 'histogram',
+                               'labels': dict(labels),
+                               'count': hist.count,
+                               'sum': hist.total,
+                               'buckets': hist.cumulative()})
+        return result
+
+    def to_prometheus(self):
+        """Formats all metrics in the Prometheus text exposition format.
+
+        :returns: The metrics text.
+        """
+        lines = []
+        typed = set()
+        for series in self.snapshot():
+            name = '%s_%s' % (self.prefix, series['name'])
+            if name not in typed:
+                lines.append('# TYPE %s %s' % (name, series['type']))
+                typed.add(name)
+            labels = series['labels']
+            if series['type'] != 'histogram':
+                lines.append('%s%s %s' % (name, _format_labels(labels),
+                                          _format_value(series['value'])))
+                continue
+            for bound, count in series['buckets']:
+                bucket_labels = dict(labels)
+                bucket_labels['le'] = _format_value(bound)
+                lines.append('%s_bucket%s %d' % (
+                    name, _format_labels(bucket_labels), count))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels),
+                                          _format_value(series['sum'])))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels),
+                                            series['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Writes the metrics to a Prometheus text file.
+
+        The file is replaced atomically so a collector never reads a
+        partial file.
+
+        :param path: The file to write.
+        """
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        os.rename(tmp_path, path)
+
+    def write_eliot(self):
+        """Writes each metric series as an Eliot message."""
+        import eliot
+        for series in self.snapshot():
+            series = dict(series)
+            series['metric'] = '%s_%s' % (self.prefix, series.pop('name'))
+            series.pop('buckets', None)
+            eliot.Message.new(message_type=METRICS_MESSAGE_TYPE,
+                              **series).write()
+
+
+def _format_labels(labels):
+    """Formats a label dict for Prometheus."""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items()))
+
+
+def _format_value(value):
+    """Formats a sample value for Prometheus."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsExporter(object):
+    """Periodically exports a registry from a background thread."""
+
+    def __init__(self, registry, interval, path=None, eliot=False):
+        """Create a new exporter.
+
+        :param registry: The ``MetricsRegistry`` to export.
+        :param interval: Seconds between exports.
+        :param path: Optional Prometheus text file to write.
+        :param eliot: If True also write the metrics as Eliot messages.
+        """
+        self.registry = registry
+        self.interval = interval
+        self.path = path
+        self.eliot = eliot
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts the exporter thread."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.name = 'metrics_exporter'
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the exporter, waiting for an export in progress."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.path:
+                    self.registry.write_prometheus(self.path)
+                if self.eliot:
+                    self.registry.write_eliot()
+            except Exception:
+                LOG.exception('Error exporting metrics.')
+
+
+def start_exporter(registry, interval, path=None, eliot=False):
+    """Starts a thread periodically exporting the metrics.
+
+    :param registry: The ``MetricsRegistry`` to export.
+    :param interval: Seconds between exports.
+    :param path: Optional Prometheus text file to write.
+    :param eliot: If True also write the metrics as Eliot messages.
+    :returns: The started ``MetricsExporter`` or None if there is nothing
+              to export.
+    """
+    if not path and not eliot:
+        return None
+    exporter = MetricsExporter(registry, interval, path, eliot)
+    exporter.start()
+    return exporter
+
+
+# Metrics shared by everything in this process.
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,375 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Simulated iSCSI host for exercising ``iscsi_utils`` without an array.
+
+A ``FakeHost`` generates the /dev, /sys/block and /sys/class trees of a
+host logged in to a Storage Center with any number of LUNs, along with stub
+``iscsiadm``, ``scsi_id``, ``multipath`` and ``udevadm`` commands that take
+a configurable time to run.  While active, ``iscsi_utils`` is pointed at
+the fake root so lookups, logins, rescans and teardown run unmodified.
+
+Run this module to benchmark the host side hot paths::
+
+    python sandbox.py --luns 10 100 5000
+"""
+
+import argparse
+import binascii
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+import iscsi_utils
+
+
+LOG = logging.getLogger(__name__)
+ARRAY_IQN = 'iqn.2002-03.com.compellent:5000d31000fa9e%02x'
+INITIATOR_IQN = 'iqn.1993-08.org.debian:01:sandbox'
+NAA_PREFIX = '6000d31000fa9e00'
+PORTAL_PORT = 3260
+
+STUB_HEADER = '''#!%(python)s
+import os
+import shutil
+import sys
+import time
+
+ROOT = %(root)r
+time.sleep(%(latency)r)
+args = sys.argv[1:]
+'''
+
+# iscsiadm -m discovery|node|session
+ISCSIADM_STUB = '''
+if args[:2] == ['-m', 'discovery']:
+    with open(os.path.join(ROOT, 'etc', 'iscsi', 'targets')) as targets:
+        sys.stdout.write(targets.read())
+elif args[:2] == ['-m', 'node']:
+    with open(os.path.join(ROOT, 'etc', 'iscsi', 'logins'), 'a') as log:
+        log.write(' '.join(args[2:]) + '\\n')
+'''
+
+# scsi_id --page=0x83 --whitelisted --device=<dev>
+SCSI_ID_STUB = '''
+dev = os.path.basename(args[-1].split('=', 1)[1])
+with open(os.path.join(ROOT, 'sys', 'block', dev, 'device', 'wwid')) as wwid:
+    sys.stdout.write('3%s\\n' % wwid.read().strip())
+'''
+
+# multipath -l <dev> | multipath -f <map>
+MULTIPATH_STUB = '''
+sys_block = os.path.join(ROOT, 'sys', 'block')
+if args[0] == '-l':
+    holders = os.path.join(sys_block, os.path.basename(args[1]), 'holders')
+    for dm in os.listdir(holders) if os.path.isdir(holders) else []:
+        with open(os.path.join(sys_block, dm, 'dm', 'name')) as name:
+            sys.stdout.write('%s %s COMPELNT,Compellent Vol\\n' %
+                             (name.read().strip(), dm))
+elif args[0] == '-f':
+    dev_path = os.path.join(ROOT, 'dev', 'mapper', args[1])
+    dm = os.path.basename(os.readlink(dev_path))
+    for sd in os.listdir(os.path.join(sys_block, dm, 'slaves')):
+        os.rmdir(os.path.join(sys_block, sd, 'holders', dm))
+    os.remove(dev_path)
+    shutil.rmtree(os.path.join(sys_block, dm))
+'''
+
+STUBS = {
+    'iscsiadm': ISCSIADM_STUB,
+    'scsi_id': SCSI_ID_STUB,
+    'multipath': MULTIPATH_STUB,
+    'udevadm': '',
+}
+
+
+def sd_name(index):
+    """Gets the kernel name of the index'th SCSI disk, sda to sdzz..."""
+    name = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(ord('a') + rem) + name
+    return 'sd' + name
+
+
+def device_id(lun):
+    """Gets the page 83 NAA identifier of a simulated LUN."""
+    return '%s%016x' % (NAA_PREFIX, lun)
+
+
+def vpd_pg83(ident):
+    """Builds a VPD page 0x83 holding a single NAA designator."""
+    naa = binascii.unhexlify(ident)
+    designator = bytearray([0x01, iscsi_utils.NAA_DESIGNATOR, 0, len(naa)])
+    designator += bytearray(naa)
+    return bytes(bytearray([0, 0x83, 0, len(designator)]) + designator)
+
+
+def _write(path, value, mode='w'):
+    """Writes a file, creating its directory if needed."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, mode) as out:
+        out.write(value)
+
+
+class FakeHost(object):
+    """A simulated host logged in to a Storage Center.
+
+    Each LUN is reached over every portal, as one sd device per portal, and
+    optionally through a dm multipath map over those devices.
+    """
+
+    def __init__(self, luns, portals=2, multipath=True, vpd=True,
+                 latency=0.0, root=None):
+        """Create a new simulated host.
+
+        :param luns: The number of LUNs to present.
+        :param portals: The number of portals, and so paths per LUN.
+        :param multipath: Whether each LUN gets a multipath map.
+        :param vpd: Whether the disks have a vpd_pg83 sysfs attribute.
+        :param latency: Seconds each stub command takes to run.
+        :param root: The directory to build in, by default a new one.
+        """
+        self.luns = luns
+        self.portals = portals
+        self.multipath = multipath
+        self.vpd = vpd
+        self.latency = latency
+        self.root = root or tempfile.mkdtemp(prefix='sc_sandbox_')
+        self.bin_dir = os.path.join(self.root, 'bin')
+        self.devices = {}
+        self._disk_count = 0
+        self._map_count = 0
+        self._write_sysfs = None
+
+    def __enter__(self):
+        self.build()
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deactivate()
+        self.destroy()
+
+    def path(self, *parts):
+        """Gets a path inside the fake root."""
+        return os.path.join(self.root, *parts)
+
+    def portal(self, index):
+        """Gets the (ip, port) of a simulated portal."""
+        return ('10.10.%d.%d' % (index // 250, index % 250 + 1), PORTAL_PORT)
+
+    def target(self, index):
+        """Gets the target IQN behind a simulated portal."""
+        return ARRAY_IQN % index
+
+    def disks(self, lun):
+        """Gets the sd device names of a LUN, one per portal."""
+        return self.devices[device_id(lun)]
+
+    def build(self):
+        """Generates the fake root and stub commands."""
+        _write(self.path('etc', 'iscsi', 'initiatorname.iscsi'),
+               'InitiatorName=%s\n' % INITIATOR_IQN)
+        targets = []
+        for index in range(self.portals):
+            ip, port = self.portal(index)
+            targets.append('%s:%s,0 %s\n' % (ip, port, self.target(index)))
+            self._build_session(index + 1, ip, port, self.target(index))
+        _write(self.path('etc', 'iscsi', 'targets'), ''.join(targets))
+        os.makedirs(self.path('dev', 'disk', 'by-id'))
+        os.makedirs(self.path('dev', 'mapper'))
+        for lun in range(self.luns):
+            self.add_lun(device_id(lun))
+        self._build_stubs()
+
+    def _build_session(self, session, ip, port, target):
+        """Adds an iSCSI session and its SCSI host."""
+        host = 'host%d' % (session + 1)
+        session_name = 'session%d' % session
+        device = self.path('sys', 'devices', 'platform', host, session_name,
+                           'iscsi_session', session_name)
+        _write(os.path.join(device, 'targetname'), target + '\n')
+        _write(self.path('sys', 'class', 'scsi_host', host, 'scan'), '')
+        sessions = self.path('sys', 'class', 'iscsi_session')
+        if not os.path.isdir(sessions):
+            os.makedirs(sessions)
+        os.symlink(device, os.path.join(sessions, session_name))
+        connection = self.path('sys', 'class', 'iscsi_connection',
+                               'connection%d:0' % session)
+        _write(os.path.join(connection, 'persistent_address'), ip + '\n')
+        _write(os.path.join(connection, 'persistent_port'), '%s\n' % port)
+
+    def add_lun(self, ident):
+        """Presents a LUN to the host.
+
+        Adds an sd device per portal and, if enabled, a multipath map over
+        them.  Nothing is done if the LUN's devices are already present.
+
+        :param ident: The page 83 NAA identifier of the LUN.
+        :returns: The sd device names of the LUN.
+        """
+        disks = self.devices.get(ident)
+        if disks and all(os.path.exists(self.path('sys', 'block', disk))
+                         for disk in disks):
+            return disks
+        disks = [sd_name(self._disk_count + index)
+                 for index in range(self.portals)]
+        self._disk_count += self.portals
+        self.devices[ident] = disks
+        for disk in disks:
+            device = self.path('sys', 'block', disk, 'device')
+            _write(os.path.join(device, 'wwid'), ident + '\n')
+            _write(os.path.join(device, 'delete'), '')
+            if self.vpd:
+                _write(os.path.join(device, 'vpd_pg83'), vpd_pg83(ident),
+                       'wb')
+            os.makedirs(self.path('sys', 'block', disk, 'holders'))
+            _write(self.path('dev', disk), '')
+        link = self.path('dev', 'disk', 'by-id', 'wwn-0x%s' % ident)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.join('..', '..', disks[0]), link)
+        if not self.multipath:
+            return disks
+
+        dm = 'dm-%d' % self._map_count
+        name = 'mpath%s' % sd_name(self._map_count)[2:]
+        self._map_count += 1
+        _write(self.path('sys', 'block', dm, 'dm', 'name'), name + '\n')
+        _write(self.path('sys', 'block', dm, 'dm', 'uuid'),
+               'mpath-3%s\n' % ident)
+        os.makedirs(self.path('sys', 'block', dm, 'slaves'))
+        for disk in disks:
+            os.makedirs(self.path('sys', 'block', disk, 'holders', dm))
+            os.makedirs(self.path('sys', 'block', dm, 'slaves', disk))
+        _write(self.path('dev', dm), '')
+        os.symlink(self.path('dev', dm), self.path('dev', 'mapper', name))
+        return disks
+
+    def _build_stubs(self):
+        """Writes the stub commands."""
+        header = STUB_HEADER % {'python': sys.executable,
+                                'root': self.root,
+                                'latency': self.latency}
+        for name, body in STUBS.items():
+            _write(os.path.join(self.bin_dir, name), header + body)
+            os.chmod(os.path.join(self.bin_dir, name),
+                     stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP)
+        scsi_id = self.path('lib', 'udev', 'scsi_id')
+        _write(scsi_id, header + SCSI_ID_STUB)
+        os.chmod(scsi_id, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP)
+
+    def _remove_disk(self, disk):
+        """Removes a SCSI disk the way the kernel does on delete."""
+        ident = None
+        wwid = self.path('sys', 'block', disk, 'device', 'wwid')
+        if os.path.exists(wwid):
+            with open(wwid) as wwid_file:
+                ident = wwid_file.read().strip()
+        shutil.rmtree(self.path('sys', 'block', disk), ignore_errors=True)
+        if os.path.exists(self.path('dev', disk)):
+            os.remove(self.path('dev', disk))
+        link = self.path('dev', 'disk', 'by-id', 'wwn-0x%s' % ident)
+        if ident and os.path.lexists(link):
+            os.remove(link)
+
+    def activate(self):
+        """Points ``iscsi_utils`` at this host."""
+        iscsi_utils.set_root(self.root, self.bin_dir)
+        self._write_sysfs = iscsi_utils._write_sysfs
+        write_sysfs = self._write_sysfs
+
+        def kernel_write(path, value):
+            write_sysfs(path, value)
+            parts = path.split(os.sep)
+            if parts[-1] == 'delete' and value.strip() == '1':
+                self._remove_disk(parts[-3])
+
+        iscsi_utils._write_sysfs = kernel_write
+
+    def deactivate(self):
+        """Points ``iscsi_utils`` back at the real host."""
+        if self._write_sysfs is not None:
+            iscsi_utils._write_sysfs = self._write_sysfs
+            self._write_sysfs = None
+        iscsi_utils.set_root()
+
+    def destroy(self):
+        """Removes the fake root."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _time(func, *args):
+    """Times a call, returning (seconds, result)."""
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def benchmark(luns, portals=2, latency=0.0, samples=10):
+    """Times the host side hot paths against a simulated host.
+
+    :param luns: The number of LUNs on the host.
+    :param portals: The number of portals, and so paths per LUN.
+    :param latency: Seconds each stub command takes to run.
+    :param samples: The number of LUNs looked up.
+    :returns: A dict of operation name to average seconds.
+    """
+    result = {}
+    with FakeHost(luns, portals, latency=latency) as host:
+        sample = range(0, luns, max(luns // samples, 1))[:samples]
+        lookups = [_time(iscsi_utils.find_paths, device_id(lun))[0]
+                   for lun in sample]
+        result['find_paths'] = sum(lookups) / len(lookups)
+        result['multipath'] = _time(iscsi_utils._get_multipath_device,
+                                    host.disks(0)[0])[0]
+        result['login'] = _time(iscsi_utils.iscsi_login,
+                                *host.portal(0))[0]
+        result['rescan'] = _time(iscsi_utils.rescan_iscsi)[0]
+        teardowns = [
+            _time(iscsi_utils.remove_devices,
+                  iscsi_utils.find_paths(device_id(lun)))[0]
+            for lun in sample]
+        result['teardown'] = sum(teardowns) / len(teardowns)
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    # Get command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--luns", "-n", help="LUN counts to benchmark.", type=int,
+        nargs='+', default=[10, 100, 5000])
+    parser.add_argument(
+        "--portals", "-p", help="Paths per LUN.", type=int, default=2)
+    parser.add_argument(
+        "--latency", "-l", help="Seconds each stub command takes.",
+        type=float, default=0.0)
+    args = parser.parse_args()
+
+    operations = ['find_paths', 'multipath', 'login', 'rescan', 'teardown']
+    print('%8s  %s' % ('luns', '  '.join('%10s' % op for op in operations)))
+    for count in args.luns:
+        timings = benchmark(count, args.portals, args.latency)
+        print('%8d  %s' % (count, '  '.join('%10.4f' % timings[op]
+                                            for op in operations)))
@@ -0,0 +1,667 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tests for
+``flocker.node.agents.blockdevice.DellStorageCenterBlockDeviceAPI``
+against a simulated Enterprise Manager and host.
+"""
+import bitmath
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+import requests
+from flocker.node.agents.test.test_blockdevice import (
+    make_iblockdeviceapi_tests)
+from flocker.node.agents.test.test_blockdevice import (
+    make_iprofiledblockdeviceapi_tests)
+from flocker.node.agents import blockdevice
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from dell_storagecenter_driver import dell_storagecenter_api
+from dell_storagecenter_driver import dell_storagecenter_async
+from dell_storagecenter_driver.dell_storagecenter_blockdevice import (
+    create_driver_instance)
+from dell_storagecenter_driver import em_aggregator
+from dell_storagecenter_driver import em_simulator
+from dell_storagecenter_driver import sandbox
+from dell_storagecenter_driver import warm_pool
+
+
+MIN_ALLOCATION_SIZE = bitmath.GiB(1).bytes
+MIN_ALLOCATION_UNIT = MIN_ALLOCATION_SIZE
+
+
+def simulated_config(simulator):
+    """Gets the driver configuration for a simulated Enterprise Manager."""
+    return {'storage_host': 'em-simulator',
+            'username': 'admin',
+            'password': 'admin',
+            'dell_sc_ssn': simulator.ssn,
+            'em_adapter': simulator.adapter(),
+            'session_keepalive_interval': 0,
+            'device_wait_timeout': 5}
+
+
+def api_factory(test_case):
+    """Create a driver instance using a simulated array and host.
+
+    Volumes mapped on the simulated array show up as devices on the
+    simulated host.
+
+    :param test_case: The specific test case instance.
+    :return: A test configured driver instance.
+    """
+    host = sandbox.FakeHost(0)
+    host.__enter__()
+    test_case.addCleanup(host.__exit__, None, None, None)
+    simulator = em_simulator.EmSimulator(
+        portals=[host.portal(index) + (host.target(index),)
+                 for index in range(host.portals)],
+        on_map=lambda volume, server: host.add_lun(volume['deviceId']))
+    driver = create_driver_instance(cluster_id=uuid4(),
+                                    **simulated_config(simulator))
+    test_case.addCleanup(driver.close)
+    return driver
+
+
+class DellStorageCenterSimulatedInterfaceTests(
+    make_iblockdeviceapi_tests(
+        blockdevice_api_factory=(
+            lambda test_case: api_factory(test_case)
+        ),
+        minimum_allocatable_size=MIN_ALLOCATION_SIZE,
+        device_allocation_unit=MIN_ALLOCATION_UNIT,
+        unknown_blockdevice_id_factory=lambda test: unicode(uuid4()))):
+
+    def test_device_size(self):
+        pass
+    test_device_size.skip = 'Simulated devices are not block devices.'
+
+
+class DellStorageCenterSimulatedProfiledInterfaceTests(
+    make_iprofiledblockdeviceapi_tests(
+        profiled_blockdevice_api_factory=(
+            lambda test_case: api_factory(test_case)
+        ),
+        dataset_size=MIN_ALLOCATION_UNIT)):
+    pass
+
+
+class DellStorageCenterSimulatedAttachTests(unittest.TestCase):
+    """Attach and device lookup against a simulated array and host."""
+
+    def setUp(self):
+        self.driver = api_factory(self)
+        self.simulator = self.driver._client.config['em_adapter'].simulator
+
+    def test_attach_unknown_volume(self):
+        self.assertRaises(blockdevice.UnknownVolume,
+                          self.driver.attach_volume, unicode(uuid4()),
+                          self.driver.compute_instance_id())
+        # Nothing was set up on the array or the host for it.
+        self.assertNotIn('StorageCenter/ScPhysicalServer',
+                         self.simulator.requests)
+        self.assertNotIn(
+            'StorageCenter/ScControllerPortIscsiConfiguration/GetList',
+            self.simulator.requests)
+
+
+class DellStorageCenterAsyncSimulatorTests(unittest.TestCase):
+    """The reactor based driver against a simulated array and host."""
+
+    def setUp(self):
+        self.driver = (
+            dell_storagecenter_async.DellStorageCenterAsyncBlockDeviceAPI(
+                reactor, api_factory(self), 4))
+        self.addCleanup(self.driver.close)
+
+    @defer.inlineCallbacks
+    def test_volume_lifecycle(self):
+        instance_id = yield self.driver.compute_instance_id()
+        volume = yield self.driver.create_volume(uuid4(),
+                                                 MIN_ALLOCATION_SIZE)
+        volumes = yield self.driver.list_volumes()
+        self.assertEqual([volume], volumes)
+
+        attached = yield self.driver.attach_volume(volume.blockdevice_id,
+                                                   instance_id)
+        self.assertEqual(volume.set(attached_to=instance_id), attached)
+        volumes = yield self.driver.list_volumes()
+        self.assertEqual([attached], volumes)
+        path = yield self.driver.get_device_path(volume.blockdevice_id)
+        self.assertTrue(path.exists())
+
+        yield self.driver.detach_volume(volume.blockdevice_id)
+        volumes = yield self.driver.list_volumes()
+        self.assertEqual([volume], volumes)
+
+        yield self.driver.destroy_volume(volume.blockdevice_id)
+        volumes = yield self.driver.list_volumes()
+        self.assertEqual([], volumes)
+
+    @defer.inlineCallbacks
+    def test_attach_unknown_volume(self):
+        instance_id = yield self.driver.compute_instance_id()
+        yield self.assertFailure(
+            self.driver.attach_volume(unicode(uuid4()), instance_id),
+            blockdevice.UnknownVolume)
+
+    @defer.inlineCallbacks
+    def test_attach_attached_volume(self):
+        instance_id = yield self.driver.compute_instance_id()
+        volume = yield self.driver.create_volume(uuid4(),
+                                                 MIN_ALLOCATION_SIZE)
+        yield self.driver.attach_volume(volume.blockdevice_id, instance_id)
+        yield self.assertFailure(
+            self.driver.attach_volume(volume.blockdevice_id, instance_id),
+            blockdevice.AlreadyAttachedVolume)
+
+
+class StorageCenterApiSimulatorTests(unittest.TestCase):
+    """REST error handling against a simulated Enterprise Manager."""
+
+    def setUp(self):
+        self.simulator = em_simulator.EmSimulator(volumes=20, seed=1)
+        self.helper = dell_storagecenter_api.StorageCenterApiHelper(
+            simulated_config(self.simulator))
+        self.addCleanup(self.helper.close)
+
+    def test_list_volumes(self):
+        with self.helper.open_connection() as api:
+            names = sorted(vol.name for vol in api.list_volumes())
+        self.assertEqual(
+            sorted(vol['name'] for vol in self.simulator.volumes()), names)
+
+    def test_list_volumes_chunked(self):
+        config = simulated_config(self.simulator)
+        config['volume_list_chunked'] = True
+        helper = dell_storagecenter_api.StorageCenterApiHelper(config)
+        self.addCleanup(helper.close)
+        with helper.open_connection() as api:
+            api.create_volume(u'Scratch', 1)
+            names = sorted(vol.name for vol in api.list_volumes())
+        self.assertIn(u'Scratch', names)
+        self.assertEqual(
+            sorted(vol['name'] for vol in self.simulator.volumes()), names)
+
+    def test_list_mapping_profiles(self):
+        simulator = em_simulator.EmSimulator(volumes=20, servers=2,
+                                             mapped=20, seed=1)
+        helper = dell_storagecenter_api.StorageCenterApiHelper(
+            simulated_config(simulator))
+        self.addCleanup(helper.close)
+        with helper.open_connection() as api:
+            vols = api.list_volumes()[:3]
+            profiles = api.list_mapping_profiles(vols)
+            expected = [api.find_mapping_profiles(vol) for vol in vols]
+        self.assertEqual(
+            sorted(p['instanceId'] for ps in expected for p in ps),
+            sorted(p['instanceId'] for p in profiles))
+
+    def test_expired_session(self):
+        self.simulator.fail_next('StorageCenter/ScVolume', 401)
+        with self.helper.open_connection() as api:
+            vol = api.create_volume(u'%s' % uuid4(), 1)
+        self.assertEqual(MIN_ALLOCATION_SIZE, vol.size)
+        self.assertEqual(2, self.simulator.requests['ApiConnection/Login'])
+
+    def test_create_error(self):
+        self.simulator.fail_next('StorageCenter/ScVolume')
+        with self.helper.open_connection() as api:
+            self.assertRaises(Exception, api.create_volume,
+                              u'%s' % uuid4(), 1)
+
+    def test_session_pool_close(self):
+        pool = dell_storagecenter_api.SessionPool(
+            self.helper._create_connection, keepalive_interval=0.05)
+        connection = pool.acquire()
+        pool.release(connection)
+        pool.close()
+        pool._keepalive_thread.join(5)
+        self.assertFalse(pool._keepalive_thread.is_alive())
+        # Connections released after the close are logged out.
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertEqual(0, pool.stats()['idle'])
+        self.assertEqual(2, self.simulator.requests['ApiConnection/Logout'])
+
+    def test_truncated_list(self):
+        r = requests.Response()
+        r.raw = io.BytesIO(b'[{"instanceId": "1"}, {"instanceId": "2"')
+        with self.helper.open_connection() as api:
+            self.assertRaises(ValueError, list, api._iter_json_list(r))
+
+    def test_folder_cache(self):
+        url = 'StorageCenter/ScVolumeFolder'
+        listurl = url + '/GetList'
+        with self.helper.open_connection() as api:
+            flocker = api._find_folder(listurl, u'Flocker')
+            start = self.simulator.requests[listurl]
+            self.assertEqual(flocker, api._find_folder(listurl, u'Flocker'))
+            self.assertEqual(start, self.simulator.requests[listurl])
+            # Missing folders are looked up again.
+            self.assertIsNone(api._find_folder(listurl, u'Cached'))
+            self.assertIsNone(api._find_folder(listurl, u'Cached'))
+            self.assertEqual(start + 2, self.simulator.requests[listurl])
+            # Creating a folder drops the cached lookups.
+            api._create_folder(url, '', u'Cached')
+            self.assertIsNotNone(api._find_folder(listurl, u'Cached'))
+            api._find_folder(listurl, u'Flocker')
+            self.assertEqual(start + 4, self.simulator.requests[listurl])
+
+    def test_memo_per_connection(self):
+        endpoint = 'StorageCenter/ScVolume/{id}/MappingProfileList'
+        with self.helper.open_connection() as api:
+            vol = api.list_volumes()[0]
+            api.find_mapping_profiles(vol)
+            api.find_mapping_profiles(vol)
+            self.assertEqual(1, self.simulator.requests[endpoint])
+            with self.helper.open_connection() as other:
+                self.assertIsNot(api, other)
+                other.find_mapping_profiles(vol)
+            self.assertEqual(2, self.simulator.requests[endpoint])
+        self.assertEqual({}, api.memo)
+        with self.helper.open_connection() as again:
+            again.find_mapping_profiles(vol)
+        self.assertEqual(3, self.simulator.requests[endpoint])
+
+    def test_create_volumes(self):
+        names = [u'%s' % uuid4() for _ in range(10)]
+        with self.helper.open_connection() as api:
+            results = api.create_volumes(
+                [(name, 1, None) for name in names] +
+                [(u'%s' % uuid4(), 1, u'Unknown')], 4)
+        self.assertEqual(names, [vol.name for vol, _ in results[:-1]])
+        self.assertEqual([None] * 10, [error for _, error in results[:-1]])
+        self.assertIsNotNone(results[-1][1])
+
+    def test_delete_volumes(self):
+        names = [vol['name'] for vol in self.simulator.volumes()]
+        with self.helper.open_connection() as api:
+            results = api.delete_volumes(names, 4)
+        self.assertEqual([(True, None)] * len(names), results)
+        self.assertEqual([], self.simulator.volumes())
+
+
+class ConcurrentRequestSimulatorTests(unittest.TestCase):
+    """Bulk operations fanned out over a slow array."""
+
+    def setUp(self):
+        self.simulator = em_simulator.EmSimulator(volumes=200, latency=0.002,
+                                                  seed=1)
+        self.config = simulated_config(self.simulator)
+
+    def test_delete_volumes(self):
+        helper = dell_storagecenter_api.StorageCenterApiHelper(self.config)
+        self.addCleanup(helper.close)
+        names = [vol['name'] for vol in self.simulator.volumes()]
+        with helper.open_connection() as api:
+            results = api.delete_volumes(names, 8)
+        self.assertEqual([(True, None)] * len(names), results)
+        self.assertEqual([], self.simulator.volumes())
+        # The workers did not share the caller's connection.
+        self.assertLess(1, helper.pool.stats()['misses'])
+
+    def test_destroy_volumes(self):
+        driver = create_driver_instance(cluster_id=uuid4(), **self.config)
+        self.addCleanup(driver.close)
+        names = [vol['name'] for vol in self.simulator.volumes()]
+        self.assertEqual([None] * len(names),
+                         driver.destroy_volumes(names, 8))
+        self.assertEqual([], self.simulator.volumes())
+
+
+class DellStorageCenterSingleFlightTests(unittest.TestCase):
+    """Concurrent identical driver reads against a slow array."""
+
+    def setUp(self):
+        self.simulator = em_simulator.EmSimulator(
+            volumes=5, seed=1,
+            endpoint_latency={'StorageCenter/ScVolume/GetList': 0.5})
+        self.driver = create_driver_instance(
+            cluster_id=uuid4(), **simulated_config(self.simulator))
+        self.addCleanup(self.driver.close)
+
+    def test_list_volumes_coalesced(self):
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.driver.list_volumes()))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([5] * 5, [len(volumes) for volumes in results])
+        stats = self.driver.single_flight_stats()['list_volumes']
+        self.assertEqual(5, stats['calls'] + stats['coalesced'])
+        self.assertEqual(
+            stats['calls'],
+            self.simulator.requests['StorageCenter/ScVolume/GetList'])
+
+    def test_list_volumes_sees_own_create(self):
+        thread = threading.Thread(target=self.driver.list_volumes)
+        thread.start()
+        while not self.driver._list_flight._flights:
+            time.sleep(0.01)
+        volume = self.driver.create_volume(uuid4(), MIN_ALLOCATION_SIZE)
+        volumes = self.driver.list_volumes()
+        thread.join()
+        self.assertIn(volume.blockdevice_id,
+                      [v.blockdevice_id for v in volumes])
+        # The listing in flight before the create was not shared.
+        self.assertEqual(
+            2, self.simulator.requests['StorageCenter/ScVolume/GetList'])
+
+
+class VolumeSnapshotSimulatorTests(unittest.TestCase):
+    """Listing volumes from the background snapshot."""
+
+    def setUp(self):
+        self.simulator = em_simulator.EmSimulator(volumes=5, seed=1)
+        self.driver = create_driver_instance(
+            cluster_id=uuid4(), volume_snapshot_interval=60,
+            **simulated_config(self.simulator))
+
+    def test_close(self):
+        self.assertEqual(5, len(self.driver.list_volumes()))
+        self.driver.close()
+        self.assertFalse(self.driver._snapshot._thread.is_alive())
+
+    def test_changes_during_refresh(self):
+        volumes = self.driver.list_volumes()
+        snapshot = self.driver._snapshot
+        listed = threading.Event()
+        release = threading.Event()
+        refresh = snapshot._refresh
+
+        def slow_refresh():
+            result = refresh()
+            listed.set()
+            release.wait(5)
+            return result
+
+        snapshot._refresh = slow_refresh
+        refresher = threading.Thread(target=snapshot.refresh)
+        refresher.start()
+        listed.wait(5)
+        # The listing has been read, these changes are newer.
+        created = volumes[0].set(blockdevice_id=u'created')
+        snapshot.put(created)
+        snapshot.remove(volumes[1].blockdevice_id)
+        snapshot.update(volumes[2].blockdevice_id, attached_to=u'node')
+        release.set()
+        refresher.join(5)
+        self.assertEqual(
+            [volumes[0], volumes[2].set(attached_to=u'node')] +
+            volumes[3:] + [created],
+            snapshot.volumes())
+
+
+class AggregatorSimulatorTests(unittest.TestCase):
+    """Several clients sharing a node-local aggregator."""
+
+    def setUp(self):
+        self.simulator = em_simulator.EmSimulator(volumes=5, seed=1)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = self.path = os.path.join(directory, 'aggregator.sock')
+        self.aggregator = em_aggregator.AggregatorServer(
+            dell_storagecenter_api.StorageCenterApiHelper(
+                simulated_config(self.simulator)),
+            path)
+        self.aggregator.start()
+        self.addCleanup(self.aggregator.close)
+        config = dict(simulated_config(self.simulator),
+                      em_adapter=None, aggregator_socket=path)
+        self.clients = [dell_storagecenter_api.StorageCenterApiHelper(config)
+                        for _ in range(3)]
+        for client in self.clients:
+            self.addCleanup(client.close)
+
+    def test_single_login(self):
+        for client in self.clients:
+            with client.open_connection() as api:
+                self.assertEqual(5, len(api.list_volumes()))
+        self.assertEqual(1, self.simulator.requests['ApiConnection/Login'])
+        self.assertEqual(
+            1, self.simulator.requests['StorageCenter/ScVolume/GetList'])
+
+    def test_socket_access(self):
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+        session = requests.Session()
+        session.mount('https://',
+                      em_aggregator.AggregatorAdapter(self.path, 5))
+        url = 'https://em/api/rest/StorageCenter/ScVolume/GetList'
+        self.assertEqual(200, session.post(url, json={}).status_code)
+        # Clients of other users are refused.
+        self.aggregator.allowed_uids = set()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          session.post, url, json={})
+
+    def test_read_during_change(self):
+        self.simulator.endpoint_latency['StorageCenter/ScVolume'] = 0.5
+
+        def create():
+            with self.clients[0].open_connection() as api:
+                api.create_volume(u'%s' % uuid4(), 1)
+        thread = threading.Thread(target=create)
+        thread.start()
+        while not self.aggregator._writes:
+            time.sleep(0.01)
+        with self.clients[1].open_connection() as api:
+            api.list_volumes()
+        thread.join()
+        with self.clients[0].open_connection() as api:
+            self.assertEqual(6, len(api.list_volumes()))
+
+    def test_change_empties_cache(self):
+        with self.clients[0].open_connection() as api:
+            api.list_volumes()
+            api.create_volume(u'%s' % uuid4(), 1)
+        with self.clients[1].open_connection() as api:
+            self.assertEqual(6, len(api.list_volumes()))
+
+
+class TtlCacheTests(unittest.TestCase):
+    """Expiry and empty results of the metadata cache."""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.patch(dell_storagecenter_api.time, 'time', lambda: self.now)
+        self.cache = dell_storagecenter_api.TtlCache(10)
+        self.loads = []
+
+    def get(self, value):
+        def loader():
+            self.loads.append(value)
+            return value
+        return self.cache.get(('key',), loader)
+
+    def test_expiry(self):
+        self.assertEqual(1, self.get(1))
+        self.now += 9
+        self.assertEqual(1, self.get(2))
+        self.now += 1
+        self.assertEqual(3, self.get(3))
+        self.assertEqual([1, 3], self.loads)
+
+    def test_empty_not_cached(self):
+        self.assertIsNone(self.get(None))
+        self.assertEqual([], self.get([]))
+        self.assertEqual(1, self.get(1))
+        self.assertEqual([None, [], 1], self.loads)
+
+    def test_disabled(self):
+        self.cache.ttl = 0
+        self.get(1)
+        self.get(1)
+        self.assertEqual([1, 1], self.loads)
+
+    def test_invalidate(self):
+        self.get(1)
+        self.cache.invalidate('other')
+        self.get(2)
+        self.cache.invalidate('key')
+        self.get(3)
+        self.assertEqual([1, 3], self.loads)
+
+
+class VolumeIndexTests(unittest.TestCase):
+    """Lookups and listing updates of the volume index."""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.patch(dell_storagecenter_api.time, 'time', lambda: self.now)
+        self.index = dell_storagecenter_api.VolumeIndex(negative_ttl=30)
+
+    def volume(self, name):
+        return dell_storagecenter_api.VolumeRecord(
+            name, u'1.%s' % name, None, MIN_ALLOCATION_SIZE, None)
+
+    def test_lookup(self):
+        self.assertEqual((False, None), self.index.lookup(u'a'))
+        vol = self.volume(u'a')
+        self.index.add(vol)
+        self.assertEqual((True, vol), self.index.lookup(u'a'))
+        self.index.discard(u'a')
+        self.assertEqual((False, None), self.index.lookup(u'a'))
+
+    def test_mark_missing(self):
+        self.index.add(self.volume(u'a'))
+        self.index.mark_missing(u'a')
+        self.assertEqual((True, None), self.index.lookup(u'a'))
+        self.now += 30
+        self.assertEqual((False, None), self.index.lookup(u'a'))
+
+    def test_listing_race(self):
+        listed = [self.volume(name) for name in (u'a', u'b', u'c')]
+        generation = self.index.start_listing()
+        # Changes made while the listing was in flight.
+        created = self.volume(u'd')
+        self.index.add(created)
+        self.index.mark_missing(u'b')
+        self.index.discard(u'c')
+        self.index.replace_all(listed, generation)
+        self.assertEqual((True, listed[0]), self.index.lookup(u'a'))
+        self.assertEqual((True, None), self.index.lookup(u'b'))
+        self.assertEqual((False, None), self.index.lookup(u'c'))
+        self.assertEqual((True, created), self.index.lookup(u'd'))
+
+    def test_stale_listing(self):
+        generation = self.index.start_listing()
+        self.index.add(self.volume(u'a'))
+        self.index.replace_all([], self.index.start_listing())
+        self.index.replace_all([self.volume(u'b')], generation)
+        self.assertEqual((False, None), self.index.lookup(u'a'))
+        self.assertEqual((False, None), self.index.lookup(u'b'))
+
+
+class RequestLimiterTests(unittest.TestCase):
+    """Admission order and adaptation of the Enterprise Manager limiter."""
+
+    def test_priority_order(self):
+        limiter = dell_storagecenter_api.RequestLimiter(1, 1)
+        limiter.acquire()
+        admitted = []
+
+        def request(priority):
+            limiter.acquire(priority)
+            admitted.append(priority)
+            limiter.release(0.01)
+
+        threads = []
+        for priority in (dell_storagecenter_api.PRIORITY_BACKGROUND,
+                         dell_storagecenter_api.PRIORITY_NORMAL,
+                         dell_storagecenter_api.PRIORITY_CRITICAL):
+            thread = threading.Thread(target=request, args=(priority,))
+            thread.start()
+            threads.append(thread)
+        while sum(limiter._waiting) < 3:
+            time.sleep(0.01)
+        limiter.release(0.01)
+        for thread in threads:
+            thread.join()
+        self.assertEqual([dell_storagecenter_api.PRIORITY_CRITICAL,
+                          dell_storagecenter_api.PRIORITY_NORMAL,
+                          dell_storagecenter_api.PRIORITY_BACKGROUND],
+                         admitted)
+
+    def test_backs_off_when_slow(self):
+        limiter = dell_storagecenter_api.RequestLimiter(20, 2)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(0.05)
+        self.assertEqual(20, limiter.limit)
+        limiter.acquire()
+        limiter.release(1.0, ok=False)
+        self.assertEqual(18, limiter.limit)
+
+    def test_mixed_endpoint_latency(self):
+        limiter = dell_storagecenter_api.RequestLimiter(32, 2)
+        traffic = [(0.05, ('GET', 'StorageCenter/ScVolume/{id}'))] * 3
+        traffic.append((1.0, ('POST', 'StorageCenter/ScVolume/GetList')))
+        for _ in range(100):
+            for latency, endpoint in traffic:
+                limiter.acquire()
+                limiter.release(latency, endpoint=endpoint)
+        self.assertEqual(32, limiter.limit)
+
+
+class WarmPoolSimulatorTests(unittest.TestCase):
+    """Handing out pre-created volumes."""
+
+    def setUp(self):
+        self.simulator = em_simulator.EmSimulator(seed=1)
+        config = simulated_config(self.simulator)
+        self.pool = warm_pool.WarmPool(config, u'node1', 2)
+        self.addCleanup(self.pool.close)
+        self.helper = dell_storagecenter_api.StorageCenterApiHelper(config)
+        self.addCleanup(self.helper.close)
+
+    def test_claim(self):
+        self.pool.refill()
+        name = u'%s' % uuid4()
+        with self.helper.open_connection() as api:
+            vol = self.pool.claim(api, name, 2)
+            self.assertEqual([name], [v.name for v in api.list_volumes()])
+        self.assertEqual(2 * MIN_ALLOCATION_SIZE, vol.size)
+        self.assertEqual({'claimed': 1, 'missed': 0, 'ready': {'': 1}},
+                         self.pool.stats())
+        self.pool.refill()
+        self.assertEqual(3, len(self.simulator.volumes()))
+
+    def test_claim_smaller(self):
+        config = simulated_config(self.simulator)
+        pool = warm_pool.WarmPool(config, u'node2', 1, volume_size=4)
+        self.addCleanup(pool.close)
+        pool.refill()
+        with self.helper.open_connection() as api:
+            self.assertIsNone(pool.claim(api, u'%s' % uuid4(), 1))
+            vol = pool.claim(api, u'%s' % uuid4(), 4)
+        self.assertEqual(4 * MIN_ALLOCATION_SIZE, vol.size)
+
+    def test_claim_empty(self):
+        with self.helper.open_connection() as api:
+            self.assertIsNone(self.pool.claim(api, u'%s' % uuid4(), 1))
+            self.assertIsNone(self.pool.claim(api, u'%s' % uuid4(), 1,
+                                              u'Unpooled'))
+        self.assertEqual(1, self.pool.stats()['missed'])
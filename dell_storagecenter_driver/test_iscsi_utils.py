@@ -0,0 +1,136 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tests for ``iscsi_utils`` against a simulated host.
+"""
+import os
+import shutil
+import subprocess
+import time
+import unittest
+
+from dell_storagecenter_driver import iscsi_utils
+from dell_storagecenter_driver import metrics
+from dell_storagecenter_driver import sandbox
+
+
+class IscsiUtilsSandboxTests(unittest.TestCase):
+    """Host side operations on a multipath host with a few LUNs."""
+
+    luns = 10
+    multipath = True
+    vpd = True
+
+    def setUp(self):
+        self.host = sandbox.FakeHost(self.luns,
+                                     multipath=self.multipath,
+                                     vpd=self.vpd)
+        self.host.__enter__()
+        self.addCleanup(self.host.__exit__, None, None, None)
+
+    def expected_paths(self, lun):
+        """Gets the paths find_paths should report for a LUN."""
+        paths = [self.host.path('dev', disk)
+                 for disk in self.host.disks(lun)]
+        if self.multipath:
+            paths.insert(0, self.host.path(
+                'dev', 'mapper', 'mpath%s' % sandbox.sd_name(lun)[2:]))
+        return paths
+
+    def test_initiator_name(self):
+        self.assertEqual(sandbox.INITIATOR_IQN,
+                         iscsi_utils.get_initiator_name().strip())
+
+    def test_find_paths(self):
+        for lun in (0, 3, self.luns - 1):
+            self.assertEqual(
+                self.expected_paths(lun),
+                iscsi_utils.find_paths(sandbox.device_id(lun)))
+
+    def test_find_paths_unknown(self):
+        self.assertEqual(
+            [], iscsi_utils.find_paths(sandbox.device_id(self.luns)))
+
+    def test_find_paths_no_device_id(self):
+        self.assertEqual([], iscsi_utils.find_paths(None))
+
+    def test_remove_devices(self):
+        device_id = sandbox.device_id(2)
+        iscsi_utils.remove_devices(iscsi_utils.find_paths(device_id), 5)
+        self.assertEqual([], iscsi_utils.find_paths(device_id))
+        self.assertEqual(self.expected_paths(1),
+                         iscsi_utils.find_paths(sandbox.device_id(1)))
+
+    def test_login_skips_sessions(self):
+        logins = self.host.path('etc', 'iscsi', 'logins')
+        iscsi_utils.iscsi_login_all([self.host.portal(0),
+                                     self.host.portal(1)])
+        self.assertFalse(os.path.exists(logins))
+
+        shutil.rmtree(self.host.path('sys', 'class', 'iscsi_connection',
+                                     'connection2:0'))
+        iscsi_utils.iscsi_login_all([self.host.portal(0),
+                                     self.host.portal(1)])
+        with open(logins) as login_file:
+            self.assertEqual(
+                ['-l -T %s -p %s:%s' % ((self.host.target(1),) +
+                                        self.host.portal(1))],
+                login_file.read().splitlines())
+
+    def test_rescan_luns(self):
+        iscsi_utils.rescan_luns([(self.host.target(1), 4)])
+        with open(self.host.path('sys', 'class', 'scsi_host', 'host3',
+                                 'scan')) as scan:
+            self.assertEqual('- - 4', scan.read())
+        with open(self.host.path('sys', 'class', 'scsi_host', 'host2',
+                                 'scan')) as scan:
+            self.assertEqual('', scan.read())
+
+
+class IscsiUtilsNoMultipathTests(IscsiUtilsSandboxTests):
+    """Host side operations without multipath or sysfs VPD pages."""
+
+    multipath = False
+    vpd = False
+
+
+class ExecTests(unittest.TestCase):
+    """Limits on the external commands run by the driver."""
+
+    def exec_total(self, result):
+        """Gets the number of sleep commands that ended with a result."""
+        for series in metrics.REGISTRY.snapshot():
+            if (series['name'] == 'exec_total' and
+                    series['labels'] == {'command': 'sleep',
+                                         'result': result}):
+                return series['value']
+        return 0
+
+    def test_timeout(self):
+        timeouts = self.exec_total('timeout')
+        start = time.time()
+        self.assertRaises(subprocess.CalledProcessError,
+                          iscsi_utils._exec, 'sleep 30', 0.1)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(timeouts + 1, self.exec_total('timeout'))
+
+    def test_configure_keeps_slots(self):
+        self.addCleanup(iscsi_utils.configure_exec)
+        slots = iscsi_utils._exec_slots
+        iscsi_utils.configure_exec(60)
+        self.assertIs(slots, iscsi_utils._exec_slots)
+        self.assertEqual(60, iscsi_utils._exec_timeout)
+        iscsi_utils.configure_exec(60, 2)
+        self.assertIsNot(slots, iscsi_utils._exec_slots)
@@ -0,0 +1,93 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tests for ``metrics``.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dell_storagecenter_driver import metrics
+
+
+class MetricsRegistryTests(unittest.TestCase):
+    """Prometheus text export of a registry."""
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry(prefix='test')
+
+    def test_counter_and_gauge(self):
+        self.registry.increment('requests', {'method': 'GET'})
+        self.registry.increment('requests', {'method': 'GET'}, 2)
+        self.registry.set_gauge('idle', value=4)
+        self.assertEqual(
+            '# TYPE test_requests counter\n'
+            'test_requests{method="GET"} 3\n'
+            '# TYPE test_idle gauge\n'
+            'test_idle 4\n',
+            self.registry.to_prometheus())
+
+    def test_label_escaping(self):
+        self.registry.increment('errors', {'reason': 'a "b"\\c\nd'})
+        self.assertIn('test_errors{reason="a \\"b\\"\\\\c\\nd"} 1\n',
+                      self.registry.to_prometheus())
+
+    def test_histogram(self):
+        for value in (0.003, 0.2, 0.2, 100.0):
+            self.registry.observe('latency', {'op': 'list'}, value)
+        lines = self.registry.to_prometheus().splitlines()
+        self.assertEqual('# TYPE test_latency histogram', lines[0])
+        buckets = lines[1:-2]
+        self.assertEqual(len(metrics.DEFAULT_BUCKETS) + 1, len(buckets))
+        self.assertEqual('test_latency_bucket{le="0.005",op="list"} 1',
+                         buckets[0])
+        self.assertEqual('test_latency_bucket{le="0.25",op="list"} 3',
+                         buckets[5])
+        self.assertEqual('test_latency_bucket{le="60.0",op="list"} 3',
+                         buckets[-2])
+        self.assertEqual('test_latency_bucket{le="+Inf",op="list"} 4',
+                         buckets[-1])
+        self.assertEqual('test_latency_sum{op="list"} %r' % 100.403,
+                         lines[-2])
+        self.assertEqual('test_latency_count{op="list"} 4', lines[-1])
+
+
+class MetricsExporterTests(unittest.TestCase):
+    """Periodic export to a Prometheus text file."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.registry = metrics.MetricsRegistry(prefix='test')
+
+    def test_nothing_to_export(self):
+        self.assertIsNone(metrics.start_exporter(self.registry, 0.01))
+
+    def test_file_export(self):
+        path = os.path.join(self.tmpdir, 'dell_sc.prom')
+        self.registry.increment('requests')
+        exporter = metrics.start_exporter(self.registry, 0.01, path)
+        self.addCleanup(exporter.stop)
+        deadline = time.time() + 5
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.01)
+        exporter.stop()
+        with open(path) as metrics_file:
+            self.assertEqual(self.registry.to_prometheus(),
+                             metrics_file.read())
+        # Only the exported file is left behind.
+        self.assertEqual(['dell_sc.prom'], os.listdir(self.tmpdir))
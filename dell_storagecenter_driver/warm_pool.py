@@ -0,0 +1,233 @@
+#    Copyright 2015 Dell Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Pool of pre-created volumes for fast volume creation.
+
+Creating an ``ScVolume`` is the slowest request the driver makes.  A
+``WarmPool`` keeps a number of spare volumes for each configured storage
+profile in a staging folder.  Creating a volume then only renames a spare
+into the volume folder, and expands it if a larger size was asked for,
+while a background thread creates a replacement.
+
+Spare volumes are named after the node and storage profile they belong to,
+so the pools of different nodes sharing a Storage Center never hand out
+the same volume.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+import bitmath
+
+import dell_storagecenter_api
+
+
+DEFAULT_FOLDER = 'FlockerPool'
+DEFAULT_VOLUME_SIZE = 1
+DEFAULT_REFRESH_INTERVAL = 300
+NAME_PREFIX = 'flocker-pool-'
+LOG = logging.getLogger(__name__)
+
+
+class WarmPool(object):
+    """Spare volumes waiting to be handed out by ``create_volume``."""
+
+    def __init__(self, config, owner, count, profiles=None,
+                 folder=DEFAULT_FOLDER, volume_size=DEFAULT_VOLUME_SIZE,
+                 init=False, interval=DEFAULT_REFRESH_INTERVAL):
+        """Create a new pool.
+
+        :param config: The driver configuration settings.
+        :param owner: Identifier of this node, such as its hostname.
+        :param count: The number of spares to keep per storage profile.
+        :param profiles: The storage profile names to keep spares for.  An
+                         empty name stands for the default profile.
+        :param folder: The staging volume folder for the spares.
+        :param volume_size: The size of the spares in GB.
+        :param init: Whether to initialize each spare as it is created.
+        :param interval: Seconds between checks that the spares are still
+                         on the array.
+        """
+        self.owner = owner
+        self.count = count
+        self.profiles = list(profiles or [''])
+        self.volume_size = volume_size
+        self.init = init
+        self.interval = interval
+        self.claimed = 0
+        self.missed = 0
+        # The spares live in their own folder, so they get their own
+        # connections with that folder configured.
+        self._client = dell_storagecenter_api.StorageCenterApiHelper(
+            dict(config, volume_folder_name=folder))
+        self._spares = dict((profile, []) for profile in self.profiles)
+        # Spares handed out, with the time their claim finished, so a
+        # listing made while they were being renamed does not bring them
+        # back.
+        self._taken = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _prefix(self, profile):
+        """Gets the name prefix of this node's spares for a profile."""
+        tag = hashlib.md5(
+            (u'%s/%s' % (self.owner, profile)).encode('utf-8'))
+        return '%s%s-' % (NAME_PREFIX, tag.hexdigest()[:12])
+
+    def start(self):
+        """Starts the background refill thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='warm_pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background refill thread."""
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refill()
+            except Exception:
+                LOG.exception('Error refilling the volume pool.')
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def refill(self):
+        """Finds this node's spares on the array and tops them up."""
+        started = time.time()
+        with self._client.open_connection(
+                dell_storagecenter_api.PRIORITY_BACKGROUND) as api:
+            volumes = api.list_volumes()
+            found = {}
+            with self._lock:
+                for name, finished in list(self._taken.items()):
+                    if finished is not None and finished < started:
+                        del self._taken[name]
+                for profile in self.profiles:
+                    prefix = self._prefix(profile)
+                    found[profile] = [vol for vol in volumes
+                                      if vol.name.startswith(prefix) and
+                                      vol.name not in self._taken]
+                    self._spares[profile] = list(found[profile])
+
+            wanted = []
+            for profile in self.profiles:
+                for _ in range(self.count - len(found[profile])):
+                    wanted.append((u'%s%s' % (self._prefix(profile),
+                                              uuid.uuid4().hex),
+                                   self.volume_size,
+                                   profile or None))
+            if not wanted:
+                return
+            LOG.info('Creating %d spare volumes.', len(wanted))
+            created = api.create_volumes(wanted)
+            for (name, _, profile), (scvolume, error) in zip(wanted,
+                                                             created):
+                if error is not None or not scvolume:
+                    LOG.error('Unable to create spare volume %s: %s',
+                              name, error)
+                    continue
+                if self.init:
+                    api._init_volume(scvolume)
+                with self._lock:
+                    self._spares[profile or ''].append(scvolume)
+
+    def claim(self, api, name, size, profile=None):
+        """Hands out a spare volume as a new volume.
+
+        The spare is renamed and moved into the volume folder and expanded
+        if needed.  Spares larger than the new volume are never handed out,
+        volumes can't be shrunk.  A replacement is then created in the
+        background.
+
+        :param api: An open ``StorageCenterApi`` connection for the volume
+                    folder.
+        :param name: The name of the new volume.
+        :param size: The size of the new volume in GB.
+        :param profile: The storage profile name of the new volume.
+        :returns: The ``VolumeRecord`` of the new volume, or None if there
+                  was no spare to use.
+        """
+        profile = profile or ''
+        with self._lock:
+            spares = self._spares.get(profile)
+            if spares is None:
+                # Not a pooled storage profile.
+                return None
+            spare = None
+            for index, candidate in enumerate(spares):
+                if bitmath.Byte(candidate.size).to_GiB().value <= size:
+                    spare = spares.pop(index)
+                    break
+            if spare is None:
+                self.missed += 1
+            else:
+                self._taken[spare.name] = None
+        if spare is None:
+            self._wakeup.set()
+            return None
+
+        try:
+            scvolume = self._claim(api, spare, name, size)
+        finally:
+            with self._lock:
+                self._taken[spare.name] = time.time()
+            self._wakeup.set()
+        if scvolume:
+            with self._lock:
+                self.claimed += 1
+            LOG.info('Claimed spare volume %(spare)s as %(name)s',
+                     {'spare': spare.name, 'name': name})
+        return scvolume
+
+    def _claim(self, api, spare, name, size):
+        """Renames and, if needed, expands a spare volume."""
+        scvolume = api.rename_volume(spare, name)
+        if not scvolume:
+            return None
+        if size > bitmath.Byte(scvolume.size).to_GiB().value:
+            expanded = api.expand_volume(scvolume, size)
+            if not expanded:
+                # Don't leave a volume of the wrong size behind.
+                LOG.error('Unable to expand claimed volume %s.', name)
+                api.delete_volume(name)
+                return None
+            scvolume = expanded
+        return scvolume
+
+    def stats(self):
+        """Gets the pool counters.
+
+        :returns: A dict with the number of volumes claimed from the pool,
+                  the number of creates that found no spare and the number
+                  of spares ready per profile.
+        """
+        with self._lock:
+            return {'claimed': self.claimed,
+                    'missed': self.missed,
+                    'ready': dict((profile, len(spares)) for profile, spares
+                                  in self._spares.items())}
+
+    def close(self):
+        """Stops refilling and logs out of the pool's connections."""
+        self.stop()
+        self._client.close()